@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+iZsh AI 后端调用
+
+提供两种调用方式：
+- call_ai_text(prompt): 等待完整回复
+- stream_ai(prompt): 逐块产出回复文本
+
+流式调用的后端选择：
+1. 环境中有 IZSH_AI_API_KEY 时，直接以流式 HTTP（SSE）请求 API，
+   请求/响应格式与 zsh/ai 模块（Src/Modules/ai.c）一致
+2. 否则运行 izsh 的 ai_suggest，并以非缓冲方式读取子进程输出
+
+read_first_option() 在解析到第一个有效选项（数字或 Y/N）后立即停止读取。
+
+后端故障以异常报告：HTTP 错误（urllib.error）、连接错误和超时（OSError），
+ai_suggest 超时前或退出前没有任何输出时抛出 BackendError（OSError 的子类）。
+"""
+
+import codecs
+import json
+import os
+import re
+import select
+import subprocess
+import time
+
+import proc_group
+
+IZSH_BIN = os.path.expanduser('~/.local/bin/izsh')
+
+# 运行 izsh 所需的环境变量
+IZSH_ENV = {
+    'DYLD_LIBRARY_PATH': '/Users/zhangzhen/anaconda3/lib',
+    'OBJC_DISABLE_INITIALIZE_FORK_SAFETY': 'YES',
+}
+
+# 通过位置参数传递 prompt，避免 prompt 中的引号破坏命令
+AI_SUGGEST_SCRIPT = 'source ~/.izshrc 2>/dev/null && ai_suggest "$1"'
+
+class BackendError(OSError):
+    """AI 后端没有返回任何内容（ai_suggest 超时或无输出退出）"""
+
+
+class APIError(BackendError):
+    """AI 后端返回了错误信息而不是回答（HTTP 状态正常、响应体是错误，或 ai_suggest 输出错误信息）"""
+
+
+# ai_suggest（ai_parse_response_json）输出错误信息时的前缀
+API_ERROR_PREFIX = 'API 错误'
+
+
+# 选项标记：数字、Y/N、yes/no（前后不能紧邻字母数字）
+OPTION_TOKEN_PATTERN = re.compile(r'(?<![A-Za-z0-9])(\d+|yes|no|[YyNn])(?![A-Za-z0-9])', re.IGNORECASE)
+
+# 流式 HTTP 默认输出长度
+DEFAULT_MAX_TOKENS = 1024
+
+
+def izsh_command(prompt):
+    """构造调用 ai_suggest 的 izsh 命令行"""
+    return [IZSH_BIN, '-c', AI_SUGGEST_SCRIPT, 'izsh', prompt]
+
+
+def izsh_env():
+    return {**os.environ, **IZSH_ENV}
+
+
+def api_config():
+    """从环境变量读取 API 配置（与 ai.c 的 ai_load_config 默认值一致），未配置返回 None"""
+    api_key = os.environ.get('IZSH_AI_API_KEY')
+    if not api_key:
+        return None
+    return {
+        'api_key': api_key,
+        'api_url': os.environ.get('IZSH_AI_API_URL', 'https://api.openai.com/v1').rstrip('/'),
+        'model': os.environ.get('IZSH_AI_MODEL', 'gpt-3.5-turbo'),
+        'api_type': os.environ.get('IZSH_AI_API_TYPE', 'anthropic'),
+    }
+
+
+def build_request(config, prompt, max_tokens, stream, system=None):
+    """构造请求 URL、请求头和 JSON（对应 ai_build_request_json）"""
+    body = {
+        'model': config['model'],
+        'messages': [{'role': 'user', 'content': prompt}],
+        'max_tokens': max_tokens,
+    }
+    if stream:
+        body['stream'] = True
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f"Bearer {config['api_key']}",
+    }
+    if config['api_type'] == 'anthropic':
+        url = f"{config['api_url']}/messages"
+        headers['anthropic-version'] = '2023-06-01'
+        headers['x-api-key'] = config['api_key']
+        if system:
+            body['system'] = system
+    else:
+        url = f"{config['api_url']}/chat/completions"
+        if system:
+            body['messages'].insert(0, {'role': 'system', 'content': system})
+
+    return url, headers, json.dumps(body, ensure_ascii=False).encode('utf-8')
+
+
+def parse_response(data):
+    """解析完整 JSON 响应（对应 ai_parse_response_json），无法识别返回 None"""
+    # 格式1: OpenAI
+    choices = data.get('choices')
+    if isinstance(choices, list) and choices:
+        message = choices[0].get('message') or {}
+        if isinstance(message.get('content'), str):
+            return message['content']
+
+    # 格式2: 简化格式
+    if data.get('success') is True:
+        for field in ('data', 'content'):
+            if isinstance(data.get(field), str):
+                return data[field]
+
+    # 格式3: Anthropic
+    content = data.get('content')
+    if isinstance(content, list) and content:
+        text = content[0].get('text') if isinstance(content[0], dict) else None
+        if isinstance(text, str):
+            return text
+
+    # 格式4: 错误
+    error = response_error(data)
+    if error is not None:
+        return f"{API_ERROR_PREFIX}: {error}"
+
+    return None
+
+
+def response_error(data):
+    """响应或流式事件中的错误信息（OpenAI {"error": ...}、Anthropic {"type": "error", ...}），没有返回 None"""
+    error = data.get('error')
+    if isinstance(error, dict) and isinstance(error.get('message'), str):
+        return error['message']
+    if isinstance(error, str):
+        return error
+    return None
+
+
+def parse_stream_event(data):
+    """解析一条 SSE 事件，返回增量文本（可能为空字符串）"""
+    # OpenAI: {"choices":[{"delta":{"content":"..."}}]}
+    choices = data.get('choices')
+    if isinstance(choices, list) and choices:
+        delta = choices[0].get('delta') or choices[0].get('message') or {}
+        return delta.get('content') or ''
+
+    # Anthropic: {"type":"content_block_delta","delta":{"type":"text_delta","text":"..."}}
+    delta = data.get('delta')
+    if isinstance(delta, dict):
+        return delta.get('text') or ''
+
+    return ''
+
+
+def stream_http(prompt, timeout=30, max_tokens=DEFAULT_MAX_TOKENS, system=None, config=None):
+    """以流式 HTTP 请求 API，逐块产出文本"""
+    import urllib.request
+
+    config = config or api_config()
+    url, headers, body = build_request(config, prompt, max_tokens, True, system)
+    request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        content_type = response.headers.get('Content-Type', '')
+        if 'text/event-stream' not in content_type:
+            # 后端不支持流式，按完整响应解析
+            data = json.loads(response.read().decode('utf-8'))
+            error = response_error(data)
+            if error is not None:
+                raise APIError(f"{API_ERROR_PREFIX}: {error}")
+            text = parse_response(data)
+            if text:
+                yield text
+            return
+
+        for raw in response:
+            line = raw.decode('utf-8', errors='replace').strip()
+            if not line.startswith('data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == '[DONE]':
+                break
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                continue
+            error = response_error(event)
+            if error is not None:
+                raise APIError(f"{API_ERROR_PREFIX}: {error}")
+            text = parse_stream_event(event)
+            if text:
+                yield text
+
+
+def stream_process(args, timeout=30, env=None):
+    """运行子进程，按到达顺序逐块产出 stdout 文本；生成器关闭或超时时终止整个进程组
+
+    超时或退出前没有产出任何文本时抛出 BackendError（已有部分输出时超时只是结束）。
+    """
+    proc = proc_group.spawn(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env=env,
+    )
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    fd = proc.stdout.fileno()
+    deadline = time.monotonic() + timeout
+    produced = False
+
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                if not produced:
+                    raise BackendError(f"ai_suggest 在 {timeout} 秒内没有输出")
+                break
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                tail = decoder.decode(b'', final=True)
+                if tail:
+                    yield tail
+                elif not produced:
+                    raise BackendError("ai_suggest 没有输出")
+                break
+            text = decoder.decode(chunk)
+            if text:
+                produced = True
+                yield text
+    finally:
+        proc.stdout.close()
+        proc_group.release(proc)
+
+
+def stream_ai(prompt, timeout=30, max_tokens=DEFAULT_MAX_TOKENS, system=None):
+    """流式调用 AI，逐块产出回复文本"""
+    config = api_config()
+    if config:
+        yield from stream_http(prompt, timeout, max_tokens, system, config)
+    else:
+        # ai_suggest 不支持系统提示词，直接拼在前面
+        if system:
+            prompt = f"{system}\n{prompt}"
+        yield from check_api_error(stream_process(izsh_command(prompt), timeout, izsh_env()))
+
+
+def check_api_error(chunks):
+    """转发 ai_suggest 的输出；输出以错误前缀开头时读完并抛出 APIError（不当作回答）"""
+    head = ''
+    for chunk in chunks:
+        if head is None:
+            yield chunk
+            continue
+        head += chunk
+        if not API_ERROR_PREFIX.startswith(head.lstrip()[:len(API_ERROR_PREFIX)]):
+            yield head
+            head = None
+        elif len(head.lstrip()) >= len(API_ERROR_PREFIX):
+            raise APIError((head + ''.join(chunks)).strip())
+    if head:
+        yield head
+
+
+def call_ai_text(prompt, timeout=30, max_tokens=DEFAULT_MAX_TOKENS, system=None):
+    """调用 AI 并返回完整回复"""
+    return ''.join(stream_ai(prompt, timeout, max_tokens, system)).strip()
+
+
+def option_pattern(keys):
+    """由选项键集合构造匹配模式（多字母的键同时接受首字母）"""
+    alternatives = set()
+    for key in keys:
+        alternatives.add(key)
+        if len(key) > 1 and key.isalpha():
+            alternatives.add(key[0])
+    ordered = sorted(alternatives, key=len, reverse=True)
+    return re.compile(r'(?<![A-Za-z0-9])(' + '|'.join(re.escape(k) for k in ordered) + r')(?![A-Za-z0-9])',
+                      re.IGNORECASE)
+
+
+def first_option_token(chunks, keys=None):
+    """从文本块流中读取第一个完整的选项标记，读到后立即停止
+
+    keys 为空时接受数字和 Y/N（yes/no 归一为首字母），否则只接受 keys 中的选项。
+    标记需要看到后续字符（或流结束）才算完整，避免把 "12" 截成 "1"。
+    """
+    pattern = option_pattern(keys) if keys else OPTION_TOKEN_PATTERN
+    buffer = ''
+    try:
+        for chunk in chunks:
+            buffer += chunk
+            match = pattern.search(buffer)
+            if match and match.end() < len(buffer):
+                return match.group(1) if keys else normalize_token(match.group(1))
+        match = pattern.search(buffer)
+        if not match:
+            return None
+        return match.group(1) if keys else normalize_token(match.group(1))
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+
+def normalize_token(token):
+    """yes/no 归一为 Y/N 首字母，其他原样返回"""
+    if token.lower() in ('yes', 'no'):
+        return token[0]
+    return token
+
+
+def read_first_option(prompt, timeout=30, max_tokens=DEFAULT_MAX_TOKENS, system=None):
+    """流式调用 AI，返回第一个有效选项标记（数字或 Y/N），失败返回 None"""
+    return first_option_token(stream_ai(prompt, timeout, max_tokens, system))
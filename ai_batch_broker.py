@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+跨会话 AI 决策合并（批处理代理）
+
+每个包装器进程一次只决策一个提示，进程内的 DecisionBatcher 合并不到请求。多个会话同时
+遇到提示时，由本机共享的代理进程合并：
+- 包装器经 Unix 套接字把 (问题, 选项, 超时) 发给代理，一行 JSON 请求、一行 JSON 回答
+- 连接不上时启动代理（脱离终端的后台进程，flock 保证同一配置只有一个），
+  仍不可用时抛出 BrokerUnavailable，由调用方在进程内决策
+- 代理用 DecisionBatcher 合并：一次 AI 调用进行中到达的请求排队，下一次调用一起发送；
+  IZSH_AI_BATCH_WINDOW（毫秒，默认 0）为首个请求到达后额外等待的时间
+- 套接字名包含后端配置（API 地址、类型、模型、密钥）和窗口的摘要，不同配置的会话不共用代理
+- 后端故障（ai_breaker.is_backend_failure）以 BackendError 交回包装器，熔断器照常计数
+- 代理空闲 IDLE_EXIT 秒后退出，下次需要时重新启动
+
+用法：
+    ai_batch_broker.py start    在后台启动代理（已在运行时直接退出）
+    ai_batch_broker.py serve    在前台运行代理
+
+环境变量：
+- IZSH_AI_BATCH=0              不经代理（ai_decision.decide_batched 在进程内决策）
+- IZSH_AI_BATCH_DIR            套接字目录（默认 ~/.izsh）
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+DEFAULT_DIR = os.path.expanduser('~/.izsh')
+
+# 代理空闲多久后退出（秒）
+IDLE_EXIT = 60.0
+
+# 启动代理后等待套接字可连接的时间（秒）
+START_WAIT = 1.0
+
+# 同时合并的最大请求数
+MAX_BATCH = 8
+
+
+class BrokerUnavailable(Exception):
+    """代理无法启动或连接中断（调用方应在进程内决策）"""
+
+
+def batch_window():
+    """首个请求到达后额外等待的时间（秒）"""
+    return float(os.environ.get('IZSH_AI_BATCH_WINDOW', 0)) / 1000
+
+
+def socket_path():
+    """当前后端配置对应的代理套接字"""
+    from ai_backend import IZSH_BIN, api_config
+
+    config = api_config() or {'izsh': IZSH_BIN}
+    digest = hashlib.sha256(json.dumps([config, batch_window()], sort_keys=True).encode()).hexdigest()[:12]
+    directory = os.environ.get('IZSH_AI_BATCH_DIR', DEFAULT_DIR)
+    return os.path.join(directory, f"ai_batch-{digest}.sock")
+
+
+def connect(path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        raise
+    return conn
+
+
+def start_broker():
+    """在后台启动代理（start 子命令在 fork 后立即返回）"""
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), 'start'],
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        pass
+
+
+def open_connection(path):
+    """连接代理，连接不上时启动它并在 START_WAIT 秒内重试"""
+    try:
+        return connect(path)
+    except OSError:
+        pass
+    start_broker()
+    deadline = time.monotonic() + START_WAIT
+    while True:
+        try:
+            return connect(path)
+        except OSError as e:
+            if time.monotonic() >= deadline:
+                raise BrokerUnavailable(f"批处理代理不可用: {e}")
+        time.sleep(0.02)
+
+
+def ask_broker(question, options, timeout=30):
+    """经代理决策，返回选项键或 None；后端故障抛出 BackendError，代理不可用抛出 BrokerUnavailable"""
+    from ai_backend import BackendError
+    from ai_decision import BATCH_RESULT_MARGIN
+
+    conn = open_connection(socket_path())
+    request = {'question': question, 'options': [list(option) for option in options], 'timeout': timeout}
+    try:
+        conn.settimeout(timeout + batch_window() + BATCH_RESULT_MARGIN)
+        conn.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+        with conn.makefile('rb') as reader:
+            line = reader.readline()
+    except socket.timeout:
+        raise BackendError(f"批处理代理在 {timeout} 秒内没有回答")
+    except OSError as e:
+        raise BrokerUnavailable(f"批处理代理连接中断: {e}")
+    finally:
+        conn.close()
+
+    try:
+        reply = json.loads(line)
+    except ValueError:
+        raise BrokerUnavailable("批处理代理没有回答")
+    if 'error' in reply:
+        if reply.get('backend'):
+            raise BackendError(reply['error'])
+        raise RuntimeError(reply['error'])
+    answer = reply.get('answer')
+    keys = [key for key, _ in options]
+    return answer if answer in keys else None
+
+
+class Broker:
+    """代理进程：接受包装器的请求，经 DecisionBatcher 合并后回答"""
+
+    def __init__(self, path):
+        from ai_decision import DecisionBatcher
+
+        self.path = path
+        self.batcher = DecisionBatcher(window=batch_window(), max_batch=MAX_BATCH)
+        self.lock = threading.Lock()
+        self.active = 0
+
+    def handle(self, conn):
+        from ai_breaker import is_backend_failure
+
+        with self.lock:
+            self.active += 1
+        try:
+            with conn.makefile('rb') as reader:
+                request = json.loads(reader.readline())
+            options = [tuple(option) for option in request['options']]
+            timeout = float(request.get('timeout') or 30)
+            try:
+                reply = {'answer': self.batcher.decide(str(request.get('question') or ''), options, timeout)}
+            except Exception as e:
+                reply = {'error': str(e) or type(e).__name__, 'backend': is_backend_failure(e)}
+            conn.sendall(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        finally:
+            conn.close()
+            with self.lock:
+                self.active -= 1
+
+    def serve(self, listener):
+        """接受连接直到空闲 IDLE_EXIT 秒"""
+        listener.settimeout(IDLE_EXIT)
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                with self.lock:
+                    if not self.active:
+                        return
+                continue
+            conn.settimeout(None)
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+
+def serve(path=None):
+    """运行代理；同一套接字已有代理时返回 False"""
+    path = path or socket_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(lock_fd)
+        return False
+
+    # 持有锁时残留的套接字文件属于已退出的代理
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(128)
+    try:
+        Broker(path).serve(listener)
+    finally:
+        # 先删除套接字再释放锁，之后启动的代理不会删掉新代理的套接字
+        os.unlink(path)
+        listener.close()
+        os.close(lock_fd)
+    return True
+
+
+def daemonize():
+    """脱离调用方：fork 后父进程退出，子进程成为新会话的首进程"""
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'start':
+        daemonize()
+        serve()
+    elif command == 'serve':
+        if not serve():
+            print("批处理代理已在运行", file=sys.stderr)
+            sys.exit(1)
+    else:
+        print(__doc__.strip().split('用法：')[-1].split('环境变量')[0].strip())
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
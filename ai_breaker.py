@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+AI 后端熔断器（跨会话共享）
+
+AI 后端故障时，每个提示都要等满调用超时才回退到默认选项。熔断器记录连续失败次数：
+- closed：正常调用
+- open：连续失败达到阈值后打开，冷却期内直接跳过 AI（走默认选项），不再等待超时
+- half_open：冷却期结束后只放行一个探测调用（带租期，持有者崩溃后租期到期可由其他会话重新探测），
+  成功则关闭，失败则重新打开并加倍冷却时间（不超过 MAX_COOLDOWN）；探测因与后端无关的原因
+  出错时由 release_probe 立即交还租期
+
+状态保存在 ~/.izsh/ai_breaker.json（IZSH_AI_BREAKER_FILE），读写时用 flock 加锁，
+同一台机器上的所有包装器会话共享。状态文件不可用时不熔断（始终放行）。
+
+只有后端故障计为失败（is_backend_failure）：传输错误、超时、HTTP 5xx/429、响应中的错误信息
+（ai_backend.APIError）。AI 正常返回但回答无效、本机辅助进程数达到上限等与后端健康无关的情况不计入。
+
+环境变量：
+- IZSH_AI_BREAKER=0            关闭熔断
+- IZSH_AI_BREAKER_FAILURES     打开熔断的连续失败次数（默认 3）
+- IZSH_AI_BREAKER_COOLDOWN     首次冷却秒数（默认 30）
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+DEFAULT_FILE = os.path.expanduser('~/.izsh/ai_breaker.json')
+
+# 冷却时间上限（秒）
+MAX_COOLDOWN = 300.0
+
+
+def is_backend_failure(error):
+    """异常是否表示 AI 后端故障：传输错误、超时、HTTP 5xx/429、APIError（其他 HTTP 错误和解析错误不算）"""
+    from concurrent.futures import TimeoutError as FutureTimeout
+    from http.client import HTTPException
+    from urllib.error import HTTPError
+
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code == 429
+    return isinstance(error, (OSError, FutureTimeout, HTTPException))
+
+
+def probe_owner():
+    """探测租期持有者标识（进程和线程）"""
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+def breaker_enabled():
+    return os.environ.get('IZSH_AI_BREAKER', '1') == '1'
+
+
+class CircuitBreaker:
+    """以共享状态文件实现的熔断器"""
+
+    def __init__(self, path=None, threshold=None, cooldown=None):
+        self.path = path or os.environ.get('IZSH_AI_BREAKER_FILE', DEFAULT_FILE)
+        self.threshold = threshold or int(os.environ.get('IZSH_AI_BREAKER_FAILURES', 3))
+        self.cooldown = cooldown or float(os.environ.get('IZSH_AI_BREAKER_COOLDOWN', 30))
+
+    def _update(self, change):
+        """加锁读取状态，调用 change(状态) 修改后写回，返回 change 的结果；文件不可用时返回 None"""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, 65536, 0)
+            try:
+                state = json.loads(raw) if raw else {}
+            except ValueError:
+                state = {}
+            if not isinstance(state, dict):
+                state = {}
+            before = dict(state)
+            result = change(state)
+            if state != before:
+                data = json.dumps(state).encode()
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, data, 0)
+            return result
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    def allow(self, lease=30.0):
+        """是否可以调用 AI；冷却期结束后第一个调用者取得探测租期（lease 秒）"""
+        def change(state):
+            status = state.get('state', STATE_CLOSED)
+            if status == STATE_CLOSED:
+                return True
+            now = time.time()
+            if now < state.get('retry_at', 0):
+                return False
+            if status == STATE_HALF_OPEN and now < state.get('probe_until', 0):
+                # 其他会话正在探测
+                return False
+            state['state'] = STATE_HALF_OPEN
+            state['probe_until'] = now + lease
+            state['probe_owner'] = probe_owner()
+            return True
+
+        allowed = self._update(change)
+        return True if allowed is None else allowed
+
+    def record_success(self):
+        def change(state):
+            if state.get('state', STATE_CLOSED) != STATE_CLOSED or state.get('failures'):
+                state.clear()
+                state['state'] = STATE_CLOSED
+        self._update(change)
+
+    def record_failure(self, error=''):
+        def change(state):
+            now = time.time()
+            failures = state.get('failures', 0) + 1
+            status = state.get('state', STATE_CLOSED)
+            state['failures'] = failures
+            state['last_error'] = str(error)[:200]
+            state['last_failure'] = now
+            if status == STATE_HALF_OPEN:
+                # 探测失败：重新打开，冷却时间加倍
+                cooldown = min(state.get('cooldown', self.cooldown) * 2, MAX_COOLDOWN)
+            elif status == STATE_CLOSED and failures >= self.threshold:
+                cooldown = self.cooldown
+            else:
+                return
+            state['state'] = STATE_OPEN
+            state['cooldown'] = cooldown
+            state['retry_at'] = now + cooldown
+            state.pop('probe_until', None)
+            state.pop('probe_owner', None)
+        self._update(change)
+
+    def release_probe(self):
+        """交还本线程持有的探测租期（探测因与后端无关的原因失败），其他会话可以立即探测"""
+        def change(state):
+            if state.get('state') == STATE_HALF_OPEN and state.get('probe_owner') == probe_owner():
+                state.pop('probe_until', None)
+                state.pop('probe_owner', None)
+        self._update(change)
+
+    def status(self):
+        """当前状态（不取得探测租期）：(状态, 距下次探测的秒数)"""
+        def read(state):
+            status = state.get('state', STATE_CLOSED)
+            return status, max(0.0, state.get('retry_at', 0) - time.time())
+        return self._update(read) or (STATE_CLOSED, 0.0)
+
+    def is_open(self):
+        """冷却期内（调用 AI 会被直接跳过）"""
+        status, wait = self.status()
+        return status != STATE_CLOSED and wait > 0
+
+    def reset(self):
+        self._update(lambda state: state.clear())
+
+
+_breaker = None
+
+
+def get_breaker():
+    """进程内共享的熔断器，IZSH_AI_BREAKER=0 时返回 None"""
+    global _breaker
+    if not breaker_enabled():
+        return None
+    if _breaker is None:
+        _breaker = CircuitBreaker()
+    return _breaker
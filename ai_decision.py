@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+AI 决策协议（菜单选择 / 确认提示）
+
+- 固定的短系统提示词（每次请求相同，便于服务端缓存前缀）
+- 选项编码为紧凑的枚举列表
+- 限制输出长度为 1~2 个 token，并用检测到的选项集合校验回答
+- 同时等待的多个决策合并为一次请求（DecisionBatcher）：包装器每个进程一次只决策一个提示，
+  因此经本机共享的批处理代理（ai_batch_broker）合并各会话的请求；一次调用进行中到达的请求
+  在下一次调用中一起发送，IZSH_AI_BATCH_WINDOW（毫秒，默认 0）为额外等待的窗口
+"""
+
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+from ai_backend import call_ai_text, first_option_token, stream_ai
+
+# 等待批处理结果时在请求超时之外额外等待的秒数（排在前一批之后、窗口期等）
+BATCH_RESULT_MARGIN = 5.0
+
+# 固定系统提示词（英文比中文说明短得多，保持不变以利于缓存）
+DECISION_SYSTEM_PROMPT = (
+    "You auto-answer prompts in an unattended terminal session. "
+    "Reply with exactly one option key from the list and nothing else. "
+    "Prefer options that let the task continue, then recommended/default ones; "
+    "avoid skip, cancel and abort. Ignore keyboard shortcut hints."
+)
+
+# 批量决策：每行一个 "编号: 选项键"
+BATCH_SYSTEM_PROMPT = (
+    "You auto-answer prompts in an unattended terminal session. "
+    "For each numbered prompt reply on its own line as '<n>: <option key>' and nothing else. "
+    "Prefer options that let the task continue, then recommended/default ones; "
+    "avoid skip, cancel and abort. Ignore keyboard shortcut hints."
+)
+
+# 决策回答只需要一个选项键
+DECISION_MAX_TOKENS = 2
+
+# 批量决策时每个回答行的 token 预算
+BATCH_TOKENS_PER_ANSWER = 6
+
+# 选项键之外的文本不参与编码
+MAX_OPTION_TEXT = 60
+
+
+def menu_options(menu_items):
+    """菜单项 -> [(键, 文本)]，没有编号的菜单按位置编号"""
+    return [(str(item.get('number', i + 1)), item.get('text', ''))
+            for i, item in enumerate(menu_items)]
+
+
+def confirm_options(options, line=''):
+    """确认提示的选项描述（如 'Y/n'、'1/2/3'）-> [(键, 文本)]"""
+    if options in ('numbered_menu', 'numbered_options'):
+        keys = re.findall(r'(?<!\d)(\d+)[\.\)]', line)
+        return [(key, '') for key in dict.fromkeys(keys)] or [('1', '')]
+    if options == 'question_prompt':
+        return [('Y', 'yes'), ('n', 'no')]
+    return [(part, '') for part in options.split('/') if part]
+
+
+def build_decision_prompt(question, options):
+    """构造紧凑的决策请求：问题 + 枚举选项"""
+    lines = [f"Q: {question.strip()[:200]}"] if question and question.strip() else []
+    seen = set()
+    for key, text in options:
+        if key in seen:
+            continue
+        seen.add(key)
+        text = ' '.join(text.split())[:MAX_OPTION_TEXT]
+        lines.append(f"{key}) {text}" if text else f"{key})")
+    lines.append("A:")
+    return '\n'.join(lines)
+
+
+def match_option(token, options):
+    """校验回答是否属于选项集合，返回规范的选项键，否则返回 None"""
+    if not token:
+        return None
+    token = token.strip()
+    for key, _ in options:
+        if token == key:
+            return key
+    lowered = token.lower()
+    for key, _ in options:
+        if lowered == key.lower():
+            return key
+    for key, _ in options:
+        if len(key) > 1 and key.isalpha() and lowered == key[0].lower():
+            return key
+    return None
+
+
+def decide(question, options, timeout=30):
+    """调用 AI 在选项集合中做出选择，回答不合法或失败返回 None"""
+    if not options:
+        return None
+    prompt = build_decision_prompt(question, options)
+    chunks = stream_ai(prompt, timeout, DECISION_MAX_TOKENS, DECISION_SYSTEM_PROMPT)
+    token = first_option_token(chunks, [key for key, _ in options])
+    return match_option(token, options)
+
+
+def build_batch_prompt(requests):
+    """构造批量决策请求：[(问题, 选项)] -> 带编号的提示列表"""
+    blocks = []
+    for n, (question, options) in enumerate(requests, 1):
+        blocks.append(f"[{n}]\n" + build_decision_prompt(question, options)[:-len("\nA:")])
+    return '\n'.join(blocks)
+
+
+def parse_batch_answers(output, requests):
+    """解析批量回答，返回与请求一一对应的选项键（无效为 None）"""
+    answers = [None] * len(requests)
+    for match in re.finditer(r'^\W*(\d+)\W*[:.)=-]\s*(\S+)', output, re.MULTILINE):
+        n = int(match.group(1)) - 1
+        if 0 <= n < len(requests) and answers[n] is None:
+            token = match.group(2).strip('.,;:()[]"\'')
+            answers[n] = match_option(token, requests[n][1])
+    return answers
+
+
+def decide_batch(requests, timeout=30):
+    """一次 AI 调用完成多个决策，返回选项键列表（无效为 None）"""
+    if len(requests) == 1:
+        return [decide(requests[0][0], requests[0][1], timeout)]
+    prompt = build_batch_prompt(requests)
+    output = call_ai_text(prompt, timeout, BATCH_TOKENS_PER_ANSWER * len(requests), BATCH_SYSTEM_PROMPT)
+    return parse_batch_answers(output, requests)
+
+
+class DecisionBatcher:
+    """决策微批处理：收集窗口期内到达的请求，合并为一次调用后分发结果
+
+    窗口为 0 时不额外等待，只合并上一次调用进行期间排队的请求。
+    """
+
+    def __init__(self, window=0.03, max_batch=8):
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []   # [(问题, 选项, 超时, Future)]
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.worker = None
+
+    def submit(self, question, options, timeout=30):
+        """提交一个决策请求，返回 Future（结果为选项键或 None）"""
+        future = Future()
+        if not options:
+            future.set_result(None)
+            return future
+
+        with self.lock:
+            self.pending.append((question, options, timeout, future))
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+            self.wakeup.notify()
+        return future
+
+    def decide(self, question, options, timeout=30):
+        """提交并等待结果（超过超时加余量仍无结果时抛出 concurrent.futures.TimeoutError）"""
+        return self.submit(question, options, timeout).result(timeout + self.window + BATCH_RESULT_MARGIN)
+
+    def _collect(self):
+        """等待首个请求，再在窗口期内继续收集，返回本批请求"""
+        with self.lock:
+            while not self.pending:
+                # 等待超时后重新检查：超时与重新获得锁之间可能有请求提交
+                # （它看到本线程仍存活，不会新建工作线程）
+                if not self.wakeup.wait(timeout=5) and not self.pending:
+                    # 长时间空闲，退出工作线程（下次提交时重建）
+                    self.worker = None
+                    return None
+            deadline = time.monotonic() + self.window
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.wakeup.wait(timeout=remaining)
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            requests = [(question, options) for question, options, _, _ in batch]
+            timeout = max(item[2] for item in batch)
+            try:
+                answers = decide_batch(requests, timeout)
+            except Exception as e:
+                for *_, future in batch:
+                    future.set_exception(e)
+                continue
+            for (*_, future), answer in zip(batch, answers):
+                future.set_result(answer)
+
+
+_batcher = None
+
+
+def get_batcher():
+    """获取进程内共享的批处理器（IZSH_AI_BATCH_WINDOW 为额外等待的窗口毫秒数，默认 0）"""
+    global _batcher
+    if _batcher is None:
+        window = float(os.environ.get('IZSH_AI_BATCH_WINDOW', 0)) / 1000
+        _batcher = DecisionBatcher(window=window)
+    return _batcher
+
+
+def decide_batched(question, options, timeout=30):
+    """经跨会话批处理代理做出决策；代理关闭（IZSH_AI_BATCH=0）或不可用时经进程内批处理器"""
+    if not options:
+        return None
+    if os.environ.get('IZSH_AI_BATCH', '1') == '1':
+        from ai_batch_broker import BrokerUnavailable, ask_broker
+        try:
+            return ask_broker(question, options, timeout)
+        except BrokerUnavailable:
+            pass
+    return get_batcher().decide(question, options, timeout)
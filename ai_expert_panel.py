@@ -11,11 +11,18 @@ AI 命令专家管理面板
 """
 
 import os
+import re
 import sys
 import json
+import time
 import subprocess
 from pathlib import Path
 
+from pattern_guard import PatternError, SafePattern, check_pattern, format_report
+
+# 专家提示词分节检索（与 ai_suggest_with_expert 使用相同的上下文）
+sys.path.insert(0, str(Path(__file__).resolve().parent / "ai_experts"))
+
 # AI 专家配置目录
 EXPERTS_DIR = Path.home() / ".izsh" / "ai_experts"
 CONFIG_FILE = EXPERTS_DIR / "experts.json"
@@ -48,11 +55,39 @@ def load_config():
     with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def validate_patterns(config):
+    """检查所有专家的 patterns：拒绝不安全的模式，改写无界通配
+
+    返回错误列表（为空表示全部通过）
+    """
+    errors = []
+    for expert_id, expert in config.get('experts', {}).items():
+        checked = []
+        for pattern in expert.get('patterns', []):
+            try:
+                rewritten, notes = check_pattern(pattern)
+            except PatternError as e:
+                errors.append(f"{expert_id}: {pattern!r} {e}")
+                continue
+            for note in notes:
+                color_print(f"⚠️  {expert_id}: {pattern!r} {note}", 'yellow')
+            checked.append(rewritten)
+        expert['patterns'] = checked
+    return errors
+
 def save_config(config):
-    """保存配置文件"""
+    """保存配置文件（先检查正则模式）"""
+    errors = validate_patterns(config)
+    if errors:
+        color_print("❌ 以下模式不安全，配置未保存：", 'red')
+        for error in errors:
+            print(f"   {error}")
+        return False
+
     with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
         json.dump(config, f, indent=2, ensure_ascii=False)
     color_print("✅ 配置已保存", 'green')
+    return True
 
 def init_experts_dir():
     """初始化专家目录"""
@@ -282,10 +317,11 @@ def create_custom_expert():
         "auto_load": True,
         "priority": 10,
         "commands": commands,
-        "patterns": [f"^{cmd}\\s+" for cmd in commands]
+        "patterns": [f"^{re.escape(cmd)}\\s+" for cmd in commands]
     }
 
-    save_config(config)
+    if not save_config(config):
+        return
 
     color_print(f"\n✅ 已创建专家: {name}", 'green')
     color_print(f"📝 模板文件: {template_path}", 'blue')
@@ -294,6 +330,323 @@ def create_custom_expert():
     print(f"   2. 查看提示词: ai-expert view {expert_id}")
     print(f"   3. 测试专家: {commands[0]} (会自动加载该专家)")
 
+def sample_lines(path=None):
+    """性能剖析用的样本行：指定文件的内容，或内置的典型命令和超长行"""
+    if path:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return [line.rstrip('\n') for line in f]
+
+    commands = ['git status', 'docker ps -a', 'kubectl get pods -A', 'npm install', 'vim main.py',
+                'python3', 'ssh user@host', 'mysql -u root -p', 'tmux attach -t work']
+    prompts = ['Do you want to create foo.py?', 'Continue? [Y/n]', '❯ 1. Yes', '1) Option A  2) Option B']
+    long_lines = [
+        '1) ' + 'x ' * 5000,
+        'a' * 20000 + '?',
+        ' '.join(f'{i}) item' for i in range(2000)),
+    ]
+    return commands + prompts + long_lines
+
+def profile_patterns(path=None):
+    """剖析专家 patterns 和提示检测模式的耗时，输出最慢的模式"""
+    config = load_config()
+    matchers = []
+    for expert_id, expert in config.get('experts', {}).items():
+        for pattern in expert.get('patterns', []):
+            try:
+                matchers.append(SafePattern(pattern, label=expert_id, can_disable=True))
+            except PatternError as e:
+                color_print(f"❌ {expert_id}: {pattern!r} {e}", 'red')
+
+    from wrapper_engine import matchers as engine_matchers
+    matchers.extend(m for m, _ in engine_matchers('confirm'))
+
+    lines = sample_lines(path)
+    color_print(f"\n正在用 {len(lines)} 行样本剖析 {len(matchers)} 个模式...", 'blue')
+    for line in lines:
+        for matcher in matchers:
+            matcher.search(line)
+
+    print(format_report(matchers))
+
+def format_record(record):
+    """决策记录的单行展示"""
+    from decision_log import SOURCE_NAMES
+    when = time.strftime('%m-%d %H:%M:%S', time.localtime(record.ts))
+    source = SOURCE_NAMES.get(record.source, str(record.source))
+    answer = record.answer or '-'
+    return (f"{when}  {record.session:016x}  {source:<7} {answer:<6} "
+            f"{record.latency_ms:7.0f}ms  {record.prompt[:60]}")
+
+def show_decision_log(args):
+    """查看决策日志：stats（默认）/ tail [N] / session <id>，可加 --since 时长"""
+    import decision_log
+
+    since = None
+    if '--since' in args:
+        pos = args.index('--since')
+        try:
+            since = decision_log.parse_since(args[pos + 1])
+        except (IndexError, ValueError):
+            color_print("❌ --since 需要时长，例如 30m、12h、7d", 'red')
+            return
+        args = args[:pos] + args[pos + 2:]
+
+    action = args[0] if args else 'stats'
+    if action == 'stats':
+        stats = decision_log.aggregate(since=since)
+        color_print("\n📒 决策日志统计", 'cyan', bold=True)
+        print(f"   位置: {decision_log.log_dir()}")
+        print(f"   分段: {stats['segments']}    记录: {stats['records']}    会话: {stats['sessions']}")
+        if stats['records']:
+            first = time.strftime('%Y-%m-%d %H:%M', time.localtime(stats['first']))
+            last = time.strftime('%Y-%m-%d %H:%M', time.localtime(stats['last']))
+            print(f"   时间: {first} ~ {last}")
+            print("   来源: " + '  '.join(f"{k}={v}" for k, v in stats['by_source'].items()))
+            print(f"   平均决策延迟: {stats['mean_latency_ms']:.0f} ms    倒计时累计: {stats['countdown_s']:.0f} s")
+    elif action == 'tail':
+        try:
+            count = int(args[1]) if len(args) > 1 else 20
+        except ValueError:
+            color_print("❌ 条数必须是数字", 'red')
+            return
+        for record in decision_log.tail_records(count):
+            print(format_record(record))
+    elif action == 'session':
+        if len(args) < 2:
+            color_print("❌ 请指定会话 ID", 'red')
+            print("用法: ai-expert log session <id>")
+            return
+        try:
+            session = int(args[1], 16)
+        except ValueError:
+            color_print("❌ 会话 ID 必须是十六进制", 'red')
+            return
+        for record in decision_log.iter_records(since=since, session=session):
+            print(format_record(record))
+    else:
+        color_print(f"❌ 未知操作: {action}", 'red')
+        print("用法: ai-expert log [stats|tail [N]|session <id>] [--since 时长]")
+
+def show_report(args):
+    """决策历史分析报告：ai-expert report [--since 时长] [--top N] [--json]"""
+    import decision_log
+
+    since = None
+    top = 10
+    as_json = '--json' in args
+    try:
+        if '--since' in args:
+            since = decision_log.parse_since(args[args.index('--since') + 1])
+        if '--top' in args:
+            top = int(args[args.index('--top') + 1])
+    except (IndexError, ValueError):
+        color_print("❌ 参数无效", 'red')
+        print("用法: ai-expert report [--since 7d] [--top N] [--json]")
+        return
+
+    report = decision_log.build_report(since=since, top=top)
+    if as_json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    color_print("\n📊 自动决策分析报告", 'cyan', bold=True)
+    print("=" * 60)
+    if not report['records']:
+        print("   暂无决策记录")
+        return
+
+    first = time.strftime('%Y-%m-%d %H:%M', time.localtime(report['first']))
+    last = time.strftime('%Y-%m-%d %H:%M', time.localtime(report['last']))
+    print(f"   记录: {report['records']}    会话: {report['sessions']}    时间: {first} ~ {last}")
+    print("   来源: " + '  '.join(f"{k}={v}" for k, v in report['by_source'].items()))
+
+    latency = report['latency_ms']
+    color_print("\n⏱️  决策延迟 (ms)", 'yellow', bold=True)
+    print(f"   {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    print(f"   {latency['mean']:8.0f} {latency['p50']:8.0f} {latency['p95']:8.0f} "
+          f"{latency['p99']:8.0f} {latency['max']:8.0f}")
+
+    countdown = report['countdown_s']
+    color_print("\n⏳ 倒计时耗时", 'yellow', bold=True)
+    print(f"   累计 {countdown['total']:.0f} s，平均每次 {countdown['mean']:.1f} s，"
+          f"其中回答为默认选项的 {countdown['on_default_answers']:.0f} s")
+
+    answerable = report['answerable']
+    color_print("\n♻️  可由缓存/规则回答的 AI 决策", 'yellow', bold=True)
+    print(f"   AI 决策 {answerable['ai_decisions']} 次：规则（默认选项）{answerable['rule']:.0%}，"
+          f"缓存（重复提示同一回答）{answerable['cache']:.0%}，合计 {answerable['rule_or_cache']:.0%}")
+
+    color_print(f"\n🔝 最常见的提示（前 {top}）", 'yellow', bold=True)
+    for item in report['top_prompts']:
+        print(f"   {item['count']:8d}  {item['prompt'][:70]}")
+
+# ai-expert test 默认样例问题（{command} 替换为专家的第一个命令）；
+# experts.json 中专家的 test_queries 字段可以覆盖
+DEFAULT_TEST_QUERIES = [
+    "{command} 查看当前状态用什么命令？",
+    "用 {command} 撤销或回滚上一步操作",
+    "{command} 出现连接超时或权限错误怎么排查？",
+]
+
+# 测试问题附加的格式要求（ai_suggest 的回答直接作为命令使用）
+TEST_FORMAT_HINT = "只输出一条可以直接执行的命令或语句，不要解释，不要使用 Markdown。"
+
+# 回答格式检查：单行、无 Markdown、不是错误信息
+MAX_ANSWER_CHARS = 200
+ERROR_PREFIXES = ('API 错误', 'AI 调用失败', '❌')
+MARKDOWN_PREFIXES = ('```', '#', '- ', '* ', '**', '> ')
+
+# 超过以下阈值的专家标记为不适合交互使用
+HEAVY_PROMPT_TOKENS = 1500
+SLOW_P95_SECONDS = float(os.environ.get('IZSH_EXPERT_TEST_SLOW', 3))
+
+def answer_compliant(answer):
+    """回答是否符合格式：非空单行、无 Markdown、不是错误信息、长度合理"""
+    answer = (answer or '').strip()
+    if not answer or '\n' in answer or len(answer) > MAX_ANSWER_CHARS:
+        return False
+    return not answer.startswith(ERROR_PREFIXES + MARKDOWN_PREFIXES)
+
+def build_expert_query(expert, template, query, full=False):
+    """与 ai_suggest_with_expert 相同的请求文本，返回 (请求, token 估算)"""
+    from expert_sections import estimate_tokens, select_context
+    context = template if full else select_context(template, query)[0]
+    prompt = f"作为 {expert['name']}，请回答以下问题：\n\n【专家上下文】\n{context}\n\n【用户问题】\n{query}"
+    return prompt, estimate_tokens(prompt)
+
+def start_test_stub(experts, latency):
+    """启动本地 AI 桩服务：每个专家的请求回答其第一个命令"""
+    from ai_stub_server import StubConfig, StubServer
+    config = StubConfig(latency=latency)
+    config.script = [(re.compile(re.escape(f"作为 {expert['name']}，")),
+                      f"{expert_commands(expert)[0]} --help")
+                     for expert in experts.values()]
+    server = StubServer(config, port=0)
+    os.environ['IZSH_AI_API_URL'] = server.start()
+    os.environ['IZSH_AI_API_KEY'] = 'stub'
+    return server
+
+def expert_commands(expert):
+    return [command.rstrip('*-') for command in expert.get('commands', [])] or ['?']
+
+def run_expert_tests(args):
+    """并发运行专家样例问题，统计请求大小、延迟分位数和回答格式符合率
+
+    ai-expert test [id|--all] [--stub] [--latency 分布] [--concurrency N] [--runs N]
+                   [--timeout 秒] [--full] [--json]
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import decision_log
+
+    options = {'--concurrency': 4, '--runs': 1, '--timeout': 30.0, '--latency': 'lognormal:0.3,0.5'}
+    rest = []
+    try:
+        i = 0
+        while i < len(args):
+            if args[i] in options:
+                options[args[i]] = type(options[args[i]])(args[i + 1])
+                i += 2
+            else:
+                rest.append(args[i])
+                i += 1
+    except (IndexError, ValueError):
+        color_print("❌ 参数无效", 'red')
+        print("用法: ai-expert test [id|--all] [--stub] [--concurrency N] [--runs N] [--timeout 秒] [--full] [--json]")
+        return
+    args = rest
+
+    config = load_config()
+    experts = {key: expert for key, expert in config.get('experts', {}).items()
+               if expert.get('enabled', True)}
+    targets = [a for a in args if not a.startswith('--')]
+    if targets and '--all' not in args:
+        missing = [t for t in targets if t not in experts]
+        if missing:
+            color_print(f"❌ 未找到专家: {', '.join(missing)}", 'red')
+            return
+        experts = {key: experts[key] for key in targets}
+
+    # 读取模板，组装请求
+    tasks = []
+    templates = {}
+    for key, expert in experts.items():
+        template_path = EXPERTS_DIR / expert.get('template', '')
+        if not template_path.is_file():
+            color_print(f"⚠️  {key}: 模板文件不存在，跳过", 'yellow')
+            continue
+        templates[key] = template_path.read_text(encoding='utf-8')
+        queries = expert.get('test_queries') or [q.format(command=expert_commands(expert)[0])
+                                                 for q in DEFAULT_TEST_QUERIES]
+        for _ in range(options['--runs']):
+            for query in queries:
+                prompt, tokens = build_expert_query(expert, templates[key], f"{query}\n{TEST_FORMAT_HINT}",
+                                                    full='--full' in args)
+                tasks.append((key, prompt, tokens))
+    if not tasks:
+        color_print("📋 没有可测试的专家", 'yellow')
+        return
+
+    server = start_test_stub(experts, options['--latency']) if '--stub' in args else None
+    from ai_backend import api_config, call_ai_text
+    backend = 'stub' if server else ('HTTP API' if api_config() else 'izsh ai_suggest')
+
+    def run(task):
+        key, prompt, _ = task
+        start = time.perf_counter()
+        try:
+            answer = call_ai_text(prompt, timeout=options['--timeout'])
+            error = None
+        except Exception as e:
+            answer, error = '', str(e)
+        return key, time.perf_counter() - start, answer, error
+
+    if '--json' not in args:
+        color_print(f"\n🧪 测试 {len(templates)} 个专家，{len(tasks)} 个请求，并发 {options['--concurrency']}，"
+                    f"后端: {backend}", 'cyan', bold=True)
+    with ThreadPoolExecutor(max_workers=options['--concurrency']) as pool:
+        results = list(pool.map(run, tasks))
+    if server:
+        server.shutdown()
+        server.server_close()
+
+    from expert_sections import estimate_tokens
+    report = {}
+    for key in templates:
+        latency = decision_log.LatencyHistogram()
+        prompt_tokens = [tokens for task_key, _, tokens in tasks if task_key == key]
+        compliant = errors = 0
+        for result_key, elapsed, answer, error in results:
+            if result_key != key:
+                continue
+            latency.add(elapsed)
+            errors += error is not None
+            compliant += answer_compliant(answer)
+        report[key] = {
+            'template_tokens': estimate_tokens(templates[key]),
+            'prompt_tokens': sum(prompt_tokens) // len(prompt_tokens),
+            'requests': latency.count,
+            'latency_s': {
+                'p50': latency.percentile(50), 'p95': latency.percentile(95), 'max': latency.max,
+            },
+            'compliance': compliant / latency.count,
+            'errors': errors,
+        }
+        report[key]['heavy'] = (report[key]['prompt_tokens'] > HEAVY_PROMPT_TOKENS
+                                or report[key]['latency_s']['p95'] > SLOW_P95_SECONDS)
+
+    if '--json' in args:
+        print(json.dumps({'backend': backend, 'experts': report}, indent=2, ensure_ascii=False))
+        return
+
+    print(f"\n   {'专家':<12} {'模板':>6} {'请求':>6} {'p50(s)':>8} {'p95(s)':>8} {'max(s)':>8} {'格式':>6} {'错误':>4}")
+    for key, row in sorted(report.items(), key=lambda item: -item[1]['latency_s']['p95']):
+        latency = row['latency_s']
+        mark = '⚠️' if row['heavy'] else '  '
+        print(f"{mark} {key:<12} {row['template_tokens']:>6} {row['prompt_tokens']:>6} {latency['p50']:>8.2f} "
+              f"{latency['p95']:>8.2f} {latency['max']:>8.2f} {row['compliance']:>6.0%} {row['errors']:>4}")
+    print(f"\n   模板/请求为估算的 token 数；⚠️ 表示请求超过 {HEAVY_PROMPT_TOKENS} tokens "
+          f"或 p95 超过 {SLOW_P95_SECONDS:g} 秒，不适合交互使用")
+
 def show_help():
     """显示帮助信息"""
     help_text = """
@@ -308,6 +661,11 @@ AI 命令专家管理面板
     edit <id>          编辑专家提示词
     toggle <id>        启用/禁用专家
     create             创建自定义专家
+    patterns [文件]    剖析正则模式耗时，列出最慢的模式
+    log [操作]         查看自动决策日志（stats / tail [N] / session <id>，可加 --since 7d）
+    report [选项]      决策分析报告：延迟分位数、倒计时耗时、高频提示（--since/--top/--json）
+    test [id|--all]    并发运行专家样例问题：请求大小、延迟分位数、回答格式符合率
+                       （--stub 使用本地桩服务，--concurrency/--runs/--timeout/--full/--json）
     help               显示此帮助
 
 示例:
@@ -316,6 +674,10 @@ AI 命令专家管理面板
     ai-expert edit docker       # 编辑 Docker 专家
     ai-expert toggle python     # 启用/禁用 Python 专家
     ai-expert create            # 创建自定义专家
+    ai-expert patterns app.log  # 用日志文件剖析模式耗时
+    ai-expert log tail 50       # 最近 50 条自动决策
+    ai-expert report --since 7d # 最近 7 天的决策分析
+    ai-expert test git --stub   # 用本地桩服务测试 Git 专家
 
 快捷键:
     Ctrl+E              打开专家面板（在 iZsh 中）
@@ -324,6 +686,7 @@ AI 命令专家管理面板
     - 专家提示词位于: ~/.izsh/ai_experts/templates/
     - 自定义专家位于: ~/.izsh/ai_experts/custom/
     - 配置文件位于: ~/.izsh/ai_experts/experts.json
+    - 决策日志位于: ~/.izsh/decisions/
 """
     color_print(help_text, 'cyan')
 
@@ -358,6 +721,14 @@ def main():
         toggle_expert(sys.argv[2])
     elif command == 'create':
         create_custom_expert()
+    elif command == 'patterns':
+        profile_patterns(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif command == 'log':
+        show_decision_log(sys.argv[2:])
+    elif command == 'report':
+        show_report(sys.argv[2:])
+    elif command == 'test':
+        run_expert_tests(sys.argv[2:])
     elif command == 'help' or command == '-h' or command == '--help':
         show_help()
     else:
@@ -5,6 +5,7 @@
 # 配置
 EXPERTS_DIR="${HOME}/.izsh/ai_experts"
 EXPERTS_CONFIG="${EXPERTS_DIR}/experts.json"
+EXPERT_SECTIONS="${EXPERTS_DIR}/expert_sections.py"
 CURRENT_EXPERT_FILE="/tmp/.izsh_current_expert_$$"
 
 # 查找匹配的专家ID
@@ -172,17 +173,32 @@ get_current_expert() {
     fi
 }
 
-# AI 建议函数增强版（包含专家提示词）
+# 选出专家提示词中与问题相关的小节（按 token 预算），失败时使用完整提示词
+select_expert_context() {
+    local query="$1"
+    local context=""
+
+    if [[ -f "$EXPERT_SECTIONS" ]]; then
+        context=$(printf '%s' "$IZSH_EXPERT_PROMPT" | python3 "$EXPERT_SECTIONS" "$query")
+    fi
+    if [[ -z "$context" ]]; then
+        context="$IZSH_EXPERT_PROMPT"
+    fi
+    printf '%s' "$context"
+}
+
+# AI 建议函数增强版（包含专家提示词中与问题相关的小节）
 ai_suggest_with_expert() {
     local query="$*"
 
     # 如果有加载的专家，将提示词作为上下文
     if [[ -n "$IZSH_EXPERT_PROMPT" ]]; then
         local expert_name=$(get_expert_name "$IZSH_CURRENT_EXPERT")
+        local expert_context=$(select_expert_context "$query")
         local enhanced_query="作为 ${expert_name}，请回答以下问题：
 
 【专家上下文】
-$IZSH_EXPERT_PROMPT
+$expert_context
 
 【用户问题】
 $query"
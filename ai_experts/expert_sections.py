@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+专家提示词的分节检索
+
+ai_suggest_with_expert 原来把整个专家模板（templates/*.prompt，每个数 KB）拼在每个问题前面，
+请求的 token 数和延迟都随之增加，而通常只有一两个场景小节与问题相关。这里：
+- 按 ## / ### 标题把模板切分为小节（代码块中的 # 注释不算标题），小节文本带上级标题
+- 标题之前的内容和第一个 ## 小节（专家身份）总是保留
+- 其余小节用 BM25 对问题排序（英文按单词、中文按相邻两字切分词项，标题词项加权），
+  按得分取前 top_k 个，在 token 预算内按原文顺序拼接
+- 估算每次调用节省的 token 数（中日韩字符按 1 个 token，其余按 4 个字符 1 个 token）
+
+用法（模板从 stdin 读取，选出的上下文写到 stdout，节省情况写到 stderr）：
+    printf '%s' "$IZSH_EXPERT_PROMPT" | expert_sections.py "如何撤销上一次提交"
+
+环境变量：
+- IZSH_EXPERT_RETRIEVAL=false    关闭（输出完整模板）
+- IZSH_EXPERT_TOKEN_BUDGET       上下文 token 预算（默认 800）
+- IZSH_EXPERT_TOP_K              最多选取的小节数（默认 4）
+- IZSH_EXPERT_REPORT=false       不输出节省情况
+"""
+
+import math
+import os
+import re
+import sys
+from collections import Counter, namedtuple
+
+DEFAULT_TOKEN_BUDGET = 800
+DEFAULT_TOP_K = 4
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 标题词项的权重（按重复次数计入词频）
+HEADING_WEIGHT = 3
+
+HEADING = re.compile(r'^(#{2,3})\s+(.*\S)\s*$')
+FENCE = re.compile(r'^\s*(```|~~~)')
+WORD = re.compile(r'[a-z0-9][a-z0-9_\-\.]*')
+CJK = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+
+Section = namedtuple('Section', ['position', 'heading', 'text', 'tokens'])
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符各 1 个，其余字符每 4 个 1 个"""
+    cjk = sum(len(run) for run in CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def terms(text):
+    """检索词项：英文单词（去掉末尾标点）和中文相邻两字"""
+    text = text.lower()
+    result = [word.rstrip('.-') for word in WORD.findall(text)]
+    for run in CJK.findall(text):
+        if len(run) == 1:
+            result.append(run)
+        else:
+            result.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return [term for term in result if term]
+
+
+def split_sections(template):
+    """切分模板，返回 (总是保留的开头部分, [Section])
+
+    开头部分为第一个 ## 标题之前的内容加上第一个 ## 小节（专家身份）。
+    ### 小节的文本前加上其所属的 ## 标题，单独选出时不丢失语境。
+    """
+    blocks = []           # [(上级 ## 标题, 标题, [行])]
+    parent = heading = None
+    current = []
+    in_fence = False
+    for line in template.splitlines():
+        if FENCE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else HEADING.match(line)
+        if not match:
+            current.append(line)
+            continue
+        blocks.append((parent, heading, current))
+        if len(match.group(1)) == 2:
+            parent, heading = None, match.group(2)
+        else:
+            if heading is not None and parent is None:
+                parent = heading
+            heading = match.group(2)
+        current = [line]
+    blocks.append((parent, heading, current))
+
+    head_count = 2 if len(blocks) > 1 and blocks[1][0] is None else 1
+    head = '\n\n'.join('\n'.join(lines).strip() for _, _, lines in blocks[:head_count]).strip()
+
+    sections = []
+    for parent, heading, lines in blocks[head_count:]:
+        body = '\n'.join(lines[1:]).strip()
+        if not body:
+            # 只有标题（下面全是 ### 小节）的 ## 不单独选取
+            continue
+        text = '\n'.join(lines).strip()
+        if parent:
+            text = f"## {parent}\n\n{text}"
+            heading = f"{parent} {heading}"
+        sections.append(Section(len(sections), heading, text, estimate_tokens(text)))
+    return head, sections
+
+
+class SectionIndex:
+    """单个模板各小节的 BM25 索引"""
+
+    def __init__(self, sections):
+        self.sections = sections
+        self.freqs = []
+        self.lengths = []
+        df = Counter()
+        for section in sections:
+            tf = Counter(terms(section.text))
+            for term in terms(section.heading):
+                tf[term] += HEADING_WEIGHT
+            self.freqs.append(tf)
+            self.lengths.append(sum(tf.values()))
+            df.update(tf.keys())
+        count = len(sections)
+        self.avg_length = sum(self.lengths) / count if count else 0.0
+        self.idf = {term: math.log(1 + (count - n + 0.5) / (n + 0.5)) for term, n in df.items()}
+
+    def scores(self, query):
+        """各小节对查询的 BM25 得分"""
+        query_terms = set(terms(query))
+        result = []
+        for tf, length in zip(self.freqs, self.lengths):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length) if self.avg_length else BM25_K1
+            for term in query_terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (BM25_K1 + 1) / (freq + norm)
+            result.append(score)
+        return result
+
+
+def select_context(template, query, budget=None, top_k=None):
+    """选出与问题相关的模板内容，返回 (上下文, 统计)
+
+    统计：full_tokens、tokens、saved、sections（选中数）、total_sections
+    """
+    budget = budget if budget is not None else int(os.environ.get('IZSH_EXPERT_TOKEN_BUDGET', DEFAULT_TOKEN_BUDGET))
+    top_k = top_k if top_k is not None else int(os.environ.get('IZSH_EXPERT_TOP_K', DEFAULT_TOP_K))
+    full_tokens = estimate_tokens(template)
+    head, sections = split_sections(template)
+
+    used = estimate_tokens(head)
+    chosen = []
+    if sections and top_k > 0:
+        scores = SectionIndex(sections).scores(query)
+        ranked = sorted((score, section.position) for section, score in zip(sections, scores) if score > 0)
+        for score, position in reversed(ranked):
+            if len(chosen) >= top_k:
+                break
+            section = sections[position]
+            if used + section.tokens > budget:
+                continue
+            chosen.append(section)
+            used += section.tokens
+
+    parts = [head] + [section.text for section in sorted(chosen, key=lambda s: s.position)]
+    context = '\n\n'.join(part for part in parts if part)
+    tokens = estimate_tokens(context)
+    return context, {
+        'full_tokens': full_tokens,
+        'tokens': tokens,
+        'saved': max(0, full_tokens - tokens),
+        'sections': len(chosen),
+        'total_sections': len(sections),
+    }
+
+
+def format_report(stats):
+    full = stats['full_tokens']
+    percent = stats['saved'] * 100 // full if full else 0
+    return (f"📉 专家上下文: {stats['tokens']}/{full} tokens（节省 {stats['saved']}，{percent}%），"
+            f"选用 {stats['sections']}/{stats['total_sections']} 节")
+
+
+def main():
+    query = ' '.join(sys.argv[1:])
+    template = sys.stdin.read()
+    if os.environ.get('IZSH_EXPERT_RETRIEVAL', 'true') == 'false' or not query.strip():
+        sys.stdout.write(template)
+        return
+    context, stats = select_context(template, query)
+    sys.stdout.write(context)
+    if os.environ.get('IZSH_EXPERT_REPORT', 'true') != 'false':
+        print(f"\033[2m{format_report(stats)}\033[0m", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+ai-query 本地缓存与离线索引
+
+功能：
+- 按 (子命令, 参数, 工具版本, 类型) 缓存 man 手册、--help 输出和 AI 回答
+- 过期时间（TTL）和总大小上限，超出时按最近访问时间淘汰
+- 基于 SQLite FTS5 的全文索引，离线检索相关的历史结果
+- 工具版本按可执行文件路径和修改时间缓存，命中时无需再运行 --version
+"""
+
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+# 辅助进程管理模块位于仓库根目录
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import proc_group
+
+# 缓存位置和默认限制（可通过环境变量覆盖）
+CACHE_DIR = Path.home() / ".izsh" / "cache"
+CACHE_DB = CACHE_DIR / "ai_query.db"
+DEFAULT_TTL = 7 * 24 * 3600          # 7 天
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024  # 50 MB
+
+# 缓存内容类型
+KIND_MAN = 'man'
+KIND_HELP = 'help'
+KIND_ANSWER = 'answer'
+
+# 表结构版本（PRAGMA user_version）；旧版本的缓存表在打开时重建
+SCHEMA_VERSION = 1
+
+
+def cache_enabled():
+    """是否启用缓存（IZSH_QUERY_CACHE=0 关闭）"""
+    return os.environ.get('IZSH_QUERY_CACHE', '1') != '0'
+
+
+class QueryCache:
+    """ai-query 结果缓存（SQLite + FTS5）"""
+
+    def __init__(self, path=None, ttl=None, max_bytes=None):
+        self.path = Path(path) if path else CACHE_DB
+        self.ttl = ttl if ttl is not None else int(
+            os.environ.get('IZSH_QUERY_CACHE_TTL', DEFAULT_TTL))
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            float(os.environ.get('IZSH_QUERY_CACHE_MAX_MB', DEFAULT_MAX_BYTES / 1024 / 1024))
+            * 1024 * 1024)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), timeout=5)
+        self.has_fts = False
+        self._init_schema()
+
+    def _init_schema(self):
+        """创建表结构
+
+        全文索引 docs 的 rowid 等于 entries.id，按 rowid 删除索引行（docs 的其他列不能高效过滤）
+        """
+        cur = self.conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        if cur.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # 旧版本的 docs 与 entries 没有对应的 rowid，缓存可重新生成，直接重建
+            cur.execute("DROP TABLE IF EXISTS entries")
+            cur.execute("DROP TABLE IF EXISTS docs")
+            cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE,
+                subcommand TEXT NOT NULL,
+                argument TEXT NOT NULL,
+                version TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        cur.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS versions (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                version TEXT NOT NULL
+            )""")
+        try:
+            cur.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(
+                    key UNINDEXED, subcommand UNINDEXED, argument, kind UNINDEXED, content
+                )""")
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite 未编译 FTS5，退化为 LIKE 检索
+            self.has_fts = False
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(subcommand, argument, version, kind):
+        """生成缓存键"""
+        return '\x1f'.join([subcommand, argument, version or '', kind])
+
+    def get(self, subcommand, argument, version, kind):
+        """读取缓存，过期或不存在返回 None"""
+        key = self.make_key(subcommand, argument, version, kind)
+        row = self.conn.execute(
+            "SELECT content, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+
+        content, created = row
+        now = time.time()
+        if self.ttl > 0 and now - created > self.ttl:
+            self._delete_keys([key])
+            self.conn.commit()
+            return None
+
+        self.conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        return content
+
+    def put(self, subcommand, argument, version, kind, content):
+        """写入缓存并按需淘汰"""
+        if not content:
+            return
+        key = self.make_key(subcommand, argument, version, kind)
+        now = time.time()
+        size = len(content.encode('utf-8'))
+
+        self._delete_keys([key])
+        cur = self.conn.execute(
+            "INSERT INTO entries (key, subcommand, argument, version, kind, content, size, created, accessed) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, subcommand, argument, version or '', kind, content, size, now, now))
+        if self.has_fts:
+            self.conn.execute(
+                "INSERT INTO docs (rowid, key, subcommand, argument, kind, content) VALUES (?, ?, ?, ?, ?, ?)",
+                (cur.lastrowid, key, subcommand, argument, kind, content))
+        self.evict()
+        self.conn.commit()
+
+    def _delete_keys(self, keys):
+        """删除指定缓存项（含全文索引）"""
+        for key in keys:
+            row = self.conn.execute("SELECT id FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row:
+                continue
+            self.conn.execute("DELETE FROM entries WHERE id = ?", row)
+            if self.has_fts:
+                self.conn.execute("DELETE FROM docs WHERE rowid = ?", row)
+
+    def evict(self):
+        """淘汰过期项，并在超出大小上限时删除最久未访问的项"""
+        if self.ttl > 0:
+            expired = [row[0] for row in self.conn.execute(
+                "SELECT key FROM entries WHERE created < ?", (time.time() - self.ttl,))]
+            self._delete_keys(expired)
+
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        victims = []
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+            if total <= self.max_bytes:
+                break
+            victims.append(key)
+            total -= size
+        self._delete_keys(victims)
+
+    def search(self, query, limit=5):
+        """离线全文检索，返回 [(subcommand, argument, kind, 摘要)]"""
+        terms = [t for t in re.findall(r'\w+', query) if t]
+        if not terms:
+            return []
+
+        if self.has_fts:
+            match = ' OR '.join('"{}"'.format(t.replace('"', '""')) for t in terms)
+            try:
+                rows = self.conn.execute(
+                    "SELECT subcommand, argument, kind, snippet(docs, 4, '', '', '...', 16) "
+                    "FROM docs WHERE docs MATCH ? ORDER BY bm25(docs) LIMIT ?",
+                    (match, limit)).fetchall()
+                return rows
+            except sqlite3.OperationalError:
+                pass
+
+        like = '%' + terms[0] + '%'
+        rows = self.conn.execute(
+            "SELECT subcommand, argument, kind, substr(content, 1, 120) FROM entries "
+            "WHERE argument LIKE ? OR content LIKE ? ORDER BY accessed DESC LIMIT ?",
+            (like, like, limit)).fetchall()
+        return rows
+
+    def tool_version(self, command):
+        """获取工具版本（按可执行文件路径和修改时间缓存）"""
+        path = shutil.which(command)
+        if not path:
+            return ''
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return ''
+
+        row = self.conn.execute(
+            "SELECT mtime, version FROM versions WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == mtime:
+            return row[1]
+
+        version = ''
+        try:
+            result = proc_group.run(
+                [path, '--version'],
+                capture_output=True,
+                text=True,
+                timeout=3
+            )
+            output = (result.stdout or result.stderr).strip()
+            version = output.split('\n')[0][:200] if output else ''
+        except Exception:
+            version = ''
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO versions (path, mtime, version) VALUES (?, ?, ?)",
+            (path, mtime, version))
+        self.conn.commit()
+        return version
+
+    def stats(self):
+        """缓存统计信息"""
+        count, total = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        by_kind = dict(self.conn.execute(
+            "SELECT kind, COUNT(*) FROM entries GROUP BY kind").fetchall())
+        return {
+            'path': str(self.path),
+            'entries': count,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'fts': self.has_fts,
+            'by_kind': by_kind,
+        }
+
+    def clear(self):
+        """清空缓存"""
+        self.conn.execute("DELETE FROM entries")
+        self.conn.execute("DELETE FROM versions")
+        if self.has_fts:
+            self.conn.execute("DELETE FROM docs")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+_cache = None
+
+
+def get_cache():
+    """获取全局缓存实例，禁用或打开失败时返回 None"""
+    global _cache
+    if not cache_enabled():
+        return None
+    if _cache is None:
+        try:
+            _cache = QueryCache()
+        except (sqlite3.Error, OSError):
+            return None
+    return _cache
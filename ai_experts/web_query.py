@@ -7,14 +7,19 @@ AI 专家联网查询工具
 - 搜索最佳实践和教程
 - 获取官方文档
 - 查找社区讨论和问题解决方案
+- 本地缓存文档和回答，离线检索历史结果
 """
 
 import sys
-import json
-import subprocess
-import os
 from pathlib import Path
 
+from query_cache import get_cache, KIND_MAN, KIND_HELP, KIND_ANSWER
+
+# 共享的 AI 后端和辅助进程管理模块位于仓库根目录
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ai_backend import stream_ai
+import proc_group
+
 # 颜色定义
 class Colors:
     RESET = '\033[0m'
@@ -30,25 +35,27 @@ def color_print(text, color=Colors.RESET, bold=False):
     prefix = Colors.BOLD if bold else ''
     print(f"{prefix}{color}{text}{Colors.RESET}")
 
-def call_ai(prompt):
-    """调用 iZsh 的 AI 功能"""
+def call_ai(prompt, on_chunk=None):
+    """调用 iZsh 的 AI 功能
+
+    on_chunk: 可选回调，回复文本到达时逐块调用（流式显示）
+    """
+    chunks = []
     try:
-        # 使用 ai_suggest 函数
-        result = subprocess.run(
-            [os.path.expanduser('~/.local/bin/izsh'), '-c',
-             f'source ~/.izshrc 2>/dev/null && ai_suggest "{prompt}"'],
-            capture_output=True,
-            text=True,
-            timeout=30,
-            env={**os.environ,
-                 'DYLD_LIBRARY_PATH': '/Users/zhangzhen/anaconda3/lib',
-                 'OBJC_DISABLE_INITIALIZE_FORK_SAFETY': 'YES'}
-        )
-        return result.stdout.strip()
+        for chunk in stream_ai(prompt, timeout=30):
+            chunks.append(chunk)
+            if on_chunk:
+                on_chunk(chunk)
+        return ''.join(chunks).strip()
     except Exception as e:
         return f"AI 调用失败: {e}"
 
-def web_search(query):
+def print_chunk(chunk):
+    """流式输出回调：立即写到终端"""
+    sys.stdout.write(chunk)
+    sys.stdout.flush()
+
+def web_search(query, on_chunk=None):
     """
     使用 AI 进行网络搜索
 
@@ -68,7 +75,84 @@ def web_search(query):
 
 如果无法联网，请基于你的知识库提供信息，并注明可能不是最新的。"""
 
-    return call_ai(search_prompt)
+    return call_ai(search_prompt, on_chunk)
+
+def cached_ai_answer(subcommand, argument, version, query_fn):
+    """显示 AI 回答：优先读取缓存，未命中时流式调用 query_fn(on_chunk) 并写入缓存"""
+    cache = get_cache()
+    if cache:
+        answer = cache.get(subcommand, argument, version, KIND_ANSWER)
+        if answer:
+            color_print("⚡ 命中本地缓存", Colors.GREEN)
+            color_print("\nAI 搜索结果：", Colors.GREEN, True)
+            print(answer)
+            return answer
+
+        related = [row for row in cache.search(argument, limit=5) if row[1] != argument][:3]
+        if related:
+            color_print("\n📦 本地相关结果：", Colors.GREEN)
+            for sub, arg, kind, snippet in related:
+                print(f"  [{sub} {arg} · {kind}] {snippet.strip()}")
+
+    color_print("\n正在搜索...", Colors.YELLOW)
+    color_print("\nAI 搜索结果：", Colors.GREEN, True)
+    streamed = []
+
+    def on_chunk(chunk):
+        streamed.append(chunk)
+        print_chunk(chunk)
+
+    answer = query_fn(on_chunk)
+    if streamed:
+        print()
+    else:
+        print(answer)
+
+    if cache and answer and not answer.startswith("AI 调用失败"):
+        cache.put(subcommand, argument, version, KIND_ANSWER, answer)
+    return answer
+
+def read_man_page(command, version):
+    """读取 man 手册（优先使用缓存），找不到返回 None"""
+    cache = get_cache()
+    if cache:
+        text = cache.get('command', command, version, KIND_MAN)
+        if text:
+            return text
+
+    result = proc_group.run(
+        ['man', command],
+        capture_output=True,
+        text=True,
+        timeout=5
+    )
+    if result.returncode != 0:
+        return None
+    if cache:
+        cache.put('command', command, version, KIND_MAN, result.stdout)
+    return result.stdout
+
+def read_help_text(command, version):
+    """读取 --help 输出（优先使用缓存），找不到返回 None"""
+    cache = get_cache()
+    if cache:
+        text = cache.get('command', command, version, KIND_HELP)
+        if text:
+            return text
+
+    for help_flag in ['--help', '-h', 'help']:
+        result = proc_group.run(
+            [command, help_flag],
+            capture_output=True,
+            text=True,
+            timeout=5
+        )
+        if result.returncode == 0 or result.stdout:
+            text = result.stdout if result.stdout else result.stderr
+            if cache:
+                cache.put('command', command, version, KIND_HELP, text)
+            return text
+    return None
 
 def query_command_usage(command):
     """查询命令用法"""
@@ -77,17 +161,15 @@ def query_command_usage(command):
     color_print(f"  查询命令用法: {command}", Colors.CYAN, True)
     color_print(f"{'='*70}", Colors.CYAN, True)
 
+    cache = get_cache()
+    version = cache.tool_version(command) if cache else ''
+
     # 先尝试本地 man 手册
     color_print("\n📖 本地文档查询...", Colors.BLUE)
     try:
-        result = subprocess.run(
-            ['man', command],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        if result.returncode == 0:
-            lines = result.stdout.split('\n')
+        text = read_man_page(command, version)
+        if text is not None:
+            lines = text.split('\n')
             # 显示 man 手册的前 30 行
             color_print("\n本地 man 手册摘要：", Colors.GREEN)
             for line in lines[:30]:
@@ -102,21 +184,14 @@ def query_command_usage(command):
     # 尝试 --help
     color_print(f"\n📋 运行 {command} --help...", Colors.BLUE)
     try:
-        for help_flag in ['--help', '-h', 'help']:
-            result = subprocess.run(
-                [command, help_flag],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0 or result.stdout:
-                lines = result.stdout.split('\n') if result.stdout else result.stderr.split('\n')
-                color_print("\n帮助信息摘要：", Colors.GREEN)
-                for line in lines[:20]:
-                    print(line)
-                if len(lines) > 20:
-                    print("...")
-                break
+        text = read_help_text(command, version)
+        if text is not None:
+            lines = text.split('\n')
+            color_print("\n帮助信息摘要：", Colors.GREEN)
+            for line in lines[:20]:
+                print(line)
+            if len(lines) > 20:
+                print("...")
     except Exception:
         pass
 
@@ -124,11 +199,7 @@ def query_command_usage(command):
     color_print("\n🌐 联网查询最新用法...", Colors.BLUE)
     query = f"{command} 命令用法、示例和最佳实践"
 
-    color_print("\n正在搜索...", Colors.YELLOW)
-    result = web_search(query)
-
-    color_print("\nAI 搜索结果：", Colors.GREEN, True)
-    print(result)
+    cached_ai_answer('command', command, version, lambda on_chunk: web_search(query, on_chunk))
 
     color_print(f"\n{'='*70}", Colors.CYAN, True)
 
@@ -143,12 +214,8 @@ def query_expert_usage(expert_name):
     query = f"{expert_name} 工具的最新功能、用法、最佳实践和示例"
 
     color_print("\n🌐 联网查询最新文档...", Colors.BLUE)
-    color_print("正在搜索...", Colors.YELLOW)
 
-    result = web_search(query)
-
-    color_print("\nAI 搜索结果：", Colors.GREEN, True)
-    print(result)
+    cached_ai_answer('expert', expert_name, '', lambda on_chunk: web_search(query, on_chunk))
 
     # 如果是 Claude Code 或 GitHub Copilot，提供额外的资源链接
     resources = {
@@ -184,12 +251,8 @@ def search_best_practices(topic):
     query = f"{topic} 的最佳实践、常见陷阱、性能优化建议和实战经验"
 
     color_print("\n🌐 联网搜索...", Colors.BLUE)
-    color_print("正在搜索...", Colors.YELLOW)
-
-    result = web_search(query)
 
-    color_print("\nAI 搜索结果：", Colors.GREEN, True)
-    print(result)
+    cached_ai_answer('best', topic, '', lambda on_chunk: web_search(query, on_chunk))
 
     color_print(f"\n{'='*70}", Colors.CYAN, True)
 
@@ -213,15 +276,51 @@ def find_solutions(problem):
 如果无法联网搜索，请基于常见情况提供建议。"""
 
     color_print("\n🌐 联网搜索解决方案...", Colors.BLUE)
-    color_print("正在搜索...", Colors.YELLOW)
 
-    result = call_ai(query)
+    cached_ai_answer('solve', problem, '', lambda on_chunk: call_ai(query, on_chunk))
 
-    color_print("\nAI 搜索结果：", Colors.GREEN, True)
-    print(result)
+    color_print(f"\n{'='*70}", Colors.CYAN, True)
+
+def search_local(keywords):
+    """离线检索本地缓存的文档和回答"""
+    cache = get_cache()
+    if not cache:
+        color_print("\n❌ 本地缓存未启用（IZSH_QUERY_CACHE=0）", Colors.RED)
+        return
+
+    color_print(f"\n{'='*70}", Colors.CYAN, True)
+    color_print(f"  离线检索: {keywords}", Colors.CYAN, True)
+    color_print(f"{'='*70}", Colors.CYAN, True)
+
+    results = cache.search(keywords, limit=10)
+    if not results:
+        color_print("\n未找到相关的本地结果", Colors.YELLOW)
+    for sub, arg, kind, snippet in results:
+        color_print(f"\n[{sub} {arg} · {kind}]", Colors.GREEN, True)
+        print(snippet.strip())
 
     color_print(f"\n{'='*70}", Colors.CYAN, True)
 
+def manage_cache(action):
+    """查看或清空本地缓存"""
+    cache = get_cache()
+    if not cache:
+        color_print("\n❌ 本地缓存未启用（IZSH_QUERY_CACHE=0）", Colors.RED)
+        return
+
+    if action == 'clear':
+        cache.clear()
+        color_print("\n✅ 本地缓存已清空", Colors.GREEN)
+        return
+
+    stats = cache.stats()
+    color_print("\n📦 本地缓存", Colors.CYAN, True)
+    print(f"  文件: {stats['path']}")
+    print(f"  条目: {stats['entries']} ({', '.join(f'{k}={v}' for k, v in stats['by_kind'].items()) or '空'})")
+    print(f"  大小: {stats['bytes'] / 1024:.1f} KB / {stats['max_bytes'] / 1024 / 1024:.0f} MB")
+    print(f"  有效期: {stats['ttl'] // 3600} 小时")
+    print(f"  全文索引: {'FTS5' if stats['fts'] else 'LIKE（未编译 FTS5）'}")
+
 def show_help():
     """显示帮助信息"""
     help_text = f"""
@@ -235,6 +334,8 @@ def show_help():
     expert <name>          查询专家工具用法（如 claude, copilot）
     best <topic>           搜索最佳实践
     solve <problem>        查找问题解决方案
+    search <keywords>      离线检索本地缓存的文档和回答
+    cache [stats|clear]    查看或清空本地缓存
     help                   显示此帮助
 
 {Colors.YELLOW}示例:{Colors.RESET}
@@ -242,6 +343,7 @@ def show_help():
     ai-query expert claude         # 查询 Claude Code 用法
     ai-query best "Python async"   # 搜索 Python 异步最佳实践
     ai-query solve "npm install 失败"  # 查找 npm 安装失败的解决方案
+    ai-query search "docker volume"    # 离线检索历史结果
 
 {Colors.YELLOW}快捷别名（可添加到 ~/.izshrc）:{Colors.RESET}
     alias cmd-help='ai-query command'
@@ -253,6 +355,9 @@ def show_help():
     - 然后使用 AI 联网搜索最新信息
     - 如果 AI 无法联网，会基于知识库提供信息
     - 搜索结果会突出显示关键信息
+    - 文档和回答缓存在 ~/.izsh/cache/ai_query.db，按工具版本区分
+    - 缓存配置: IZSH_QUERY_CACHE=0 关闭，IZSH_QUERY_CACHE_TTL（秒），
+      IZSH_QUERY_CACHE_MAX_MB（大小上限）
 """
     print(help_text)
 
@@ -295,6 +400,16 @@ def main():
         problem = ' '.join(sys.argv[2:])
         find_solutions(problem)
 
+    elif command == 'search':
+        if len(sys.argv) < 3:
+            color_print("\n❌ 请指定关键词", Colors.RED)
+            print("用法: ai-query search <关键词>")
+            return
+        search_local(' '.join(sys.argv[2:]))
+
+    elif command == 'cache':
+        manage_cache(sys.argv[2] if len(sys.argv) > 2 else 'stats')
+
     elif command == 'help' or command == '-h' or command == '--help':
         show_help()
 
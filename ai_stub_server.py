@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+本地 AI 桩服务和决策负载测试
+
+serve：在本地启动 HTTP 服务，请求/响应格式与 zsh/ai 模块（Src/Modules/ai.c 的
+ai_build_request_json / ai_parse_response_json）以及 ai_backend 的流式 HTTP 一致：
+- POST <url>/messages          Anthropic 格式 {"content":[{"type":"text","text":...}]}
+- POST <url>/chat/completions  OpenAI 格式 {"choices":[{"message":{"content":...}}]}
+- 请求带 "stream": true 时以 SSE 逐块返回（Anthropic content_block_delta / OpenAI delta + [DONE]）
+- GET <url>/stats              请求数、各类注入次数等统计（JSON）
+
+把 izsh 或包装器指向桩服务即可离线测试，不需要真实的 API：
+    IZSH_AI_API_URL=http://127.0.0.1:8765/v1 IZSH_AI_API_KEY=stub
+
+回答来源（按顺序）：
+1. --script 指定的 JSON 文件：[{"match": 正则, "answer": 文本}, ...]，对用户提示做 re.search
+2. 批量决策提示（ai_decision.build_batch_prompt）：每个编号回答第一个选项
+3. 决策提示（以 "A:" 结尾）：第一个选项键
+4. 其他提示：--answer 指定的文本
+
+延迟（首字节之前）：fixed:秒 | uniform:下限,上限 | lognormal:中位数,sigma | exp:均值
+错误注入（各为 0~1 的概率）：--error（HTTP 500）、--ratelimit（HTTP 429）、
+--hang（挂起 --hang-time 秒，模拟超时）、--malformed（返回无法解析的响应）
+
+load：启动桩服务（或用 --url 指向已有服务），以多个并发线程执行决策，
+统计端到端吞吐量和延迟分位数。--mode：
+- decide   ai_decision.decide（流式 HTTP）
+- batched  ai_decision.decide_batched（经批处理代理合并；IZSH_AI_BATCH_WINDOW 未设置时用 30 毫秒）
+- engine   wrapper_engine.Decider（含熔断器，使用临时状态文件，不写决策日志）
+- text     ai_backend.call_ai_text（完整回复）
+
+用法:
+    ai_stub_server.py serve [--port 8765] [--latency lognormal:0.3,0.5] [--error 0.05] ...
+    ai_stub_server.py load [--requests 200] [--concurrency 8] [--mode decide] [--url URL] [服务选项]
+"""
+
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8765
+
+# 默认回答（非决策提示，如命令翻译）
+DEFAULT_ANSWER = "echo 'stub answer'"
+
+# 流式响应每块的字符数
+STREAM_CHUNK = 4
+
+# 按 max_tokens 截断回答时每个 token 约对应的字符数
+CHARS_PER_TOKEN = 4
+
+# 决策提示中的选项行："键) 文本"
+OPTION_LINE = re.compile(r'^(\S+)\)', re.MULTILINE)
+
+# 批量决策提示中的编号行："[n]"
+BATCH_HEADER = re.compile(r'^\[(\d+)\]$', re.MULTILINE)
+
+# 负载测试使用的决策提示（问题, 选项）
+LOAD_PROMPTS = [
+    ('Do you want to proceed?', [('1', 'Yes'), ('2', "Yes, and don't ask again"), ('3', 'No')]),
+    ('Allow Edit to modify src/parser.py?', [('Y', 'yes'), ('n', 'no')]),
+    ('Run pytest -q?', [('1', 'Yes'), ('2', 'No, tell Claude what to do differently')]),
+    ('Overwrite existing file?', [('y', ''), ('N', '')]),
+    ('Select a model', [('1', 'opus'), ('2', 'sonnet'), ('3', 'haiku')]),
+]
+
+
+def parse_latency(spec):
+    """延迟分布描述 -> 无参数的采样函数（秒）"""
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v] if params else []
+    if kind == 'fixed':
+        delay = values[0] if values else 0.0
+        return lambda: delay
+    if kind == 'uniform':
+        low, high = values[:2] if len(values) >= 2 else (0.0, values[0] if values else 0.0)
+        return lambda: random.uniform(low, high)
+    if kind == 'lognormal':
+        median = values[0] if values else 0.3
+        sigma = values[1] if len(values) > 1 else 0.5
+        mu = math.log(median) if median > 0 else 0.0
+        return lambda: random.lognormvariate(mu, sigma)
+    if kind in ('exp', 'exponential'):
+        mean = values[0] if values else 0.3
+        return lambda: random.expovariate(1 / mean) if mean > 0 else 0.0
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+def load_script(path):
+    """读取脚本化回答：[(正则, 回答)]"""
+    with open(path) as f:
+        rules = json.load(f)
+    return [(re.compile(rule['match'], re.IGNORECASE), rule['answer']) for rule in rules]
+
+
+def first_option(block):
+    match = OPTION_LINE.search(block)
+    return match.group(1) if match else None
+
+
+def answer_for(prompt, script=(), default=DEFAULT_ANSWER):
+    """按脚本、批量决策、单个决策、默认文本的顺序生成回答"""
+    for pattern, answer in script:
+        if pattern.search(prompt):
+            return answer
+
+    headers = list(BATCH_HEADER.finditer(prompt))
+    if headers:
+        lines = []
+        for i, header in enumerate(headers):
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(prompt)
+            key = first_option(prompt[header.end():end])
+            if key:
+                lines.append(f"{header.group(1)}: {key}")
+        return '\n'.join(lines)
+
+    if prompt.rstrip().endswith('A:'):
+        key = first_option(prompt)
+        if key:
+            return key
+
+    return default
+
+
+class StubConfig:
+    """桩服务行为：延迟、错误注入概率、回答来源"""
+
+    def __init__(self, latency='fixed:0', token_delay=0.0, error=0.0, ratelimit=0.0, hang=0.0,
+                 malformed=0.0, hang_time=60.0, script=None, answer=DEFAULT_ANSWER, seed=None):
+        self.latency_spec = latency
+        self.latency = parse_latency(latency)
+        self.token_delay = token_delay
+        self.error = error
+        self.ratelimit = ratelimit
+        self.hang = hang
+        self.malformed = malformed
+        self.hang_time = hang_time
+        self.script = load_script(script) if script else []
+        self.answer = answer
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def fault(self):
+        """抽取本次请求的注入类型（None 表示正常响应）"""
+        with self.lock:
+            roll = self.random.random()
+        for kind in ('error', 'ratelimit', 'hang', 'malformed'):
+            rate = getattr(self, kind)
+            if roll < rate:
+                return kind
+            roll -= rate
+        return None
+
+
+class StubStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+def request_prompt(body):
+    """取最后一条用户消息的文本"""
+    for message in reversed(body.get('messages') or []):
+        if message.get('role') != 'user':
+            continue
+        content = message.get('content')
+        if isinstance(content, list):
+            return ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+        return content or ''
+    return ''
+
+
+def truncate_tokens(text, max_tokens):
+    if not max_tokens:
+        return text
+    return text[:max(1, int(max_tokens)) * CHARS_PER_TOKEN]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """处理 /messages、/chat/completions 和 /stats"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'):
+            self.send_json(200, self.server.stats.snapshot())
+        else:
+            self.send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        if path.endswith('/messages'):
+            api_type = 'anthropic'
+        elif path.endswith('/chat/completions'):
+            api_type = 'openai'
+        else:
+            self.send_json(404, {'error': {'message': f'unknown endpoint {self.path}'}})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': {'message': 'invalid JSON'}})
+            return
+
+        config = self.server.config
+        stats = self.server.stats
+        stats.add('requests')
+        stats.add(f'{api_type}_requests')
+        fault = config.fault()
+        time.sleep(config.latency())
+
+        if fault == 'error':
+            stats.add('injected_error')
+            self.send_json(500, {'error': {'message': 'stub injected error'}})
+            return
+        if fault == 'ratelimit':
+            stats.add('injected_ratelimit')
+            self.send_json(429, {'error': {'message': 'stub rate limit'}}, {'Retry-After': '1'})
+            return
+        if fault == 'hang':
+            stats.add('injected_hang')
+            time.sleep(config.hang_time)
+
+        prompt = request_prompt(body)
+        answer = truncate_tokens(answer_for(prompt, config.script, config.answer), body.get('max_tokens'))
+
+        if fault == 'malformed':
+            stats.add('injected_malformed')
+            if body.get('stream'):
+                self.send_stream(['data: {"choices": [{"delta": \n\n'])
+            else:
+                self.send_raw(200, b'{"id": "stub", "content": ', 'application/json')
+            return
+
+        if body.get('stream'):
+            stats.add('streamed')
+            self.send_stream(self.sse_events(api_type, answer, body.get('model', 'stub')))
+        else:
+            self.send_json(200, self.full_response(api_type, answer, body.get('model', 'stub')))
+        stats.add('answered')
+
+    @staticmethod
+    def full_response(api_type, answer, model):
+        if api_type == 'anthropic':
+            return {'id': 'msg_stub', 'type': 'message', 'role': 'assistant', 'model': model,
+                    'content': [{'type': 'text', 'text': answer}], 'stop_reason': 'end_turn'}
+        return {'id': 'chatcmpl-stub', 'object': 'chat.completion', 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer},
+                             'finish_reason': 'stop'}]}
+
+    def sse_events(self, api_type, answer, model):
+        """逐块生成 SSE 事件文本（每块之间等待 token_delay）"""
+        chunks = [answer[i:i + STREAM_CHUNK] for i in range(0, len(answer), STREAM_CHUNK)]
+
+        def event(name, data):
+            prefix = f"event: {name}\n" if api_type == 'anthropic' else ''
+            return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        if api_type == 'anthropic':
+            yield event('message_start', {'type': 'message_start',
+                                          'message': {'id': 'msg_stub', 'model': model, 'content': []}})
+            yield event('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                                'content_block': {'type': 'text', 'text': ''}})
+        for i, chunk in enumerate(chunks):
+            if i and self.server.config.token_delay:
+                time.sleep(self.server.config.token_delay)
+            if api_type == 'anthropic':
+                yield event('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                                    'delta': {'type': 'text_delta', 'text': chunk}})
+            else:
+                yield event('chunk', {'choices': [{'index': 0, 'delta': {'content': chunk}}]})
+        if api_type == 'anthropic':
+            yield event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+            yield event('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}})
+            yield event('message_stop', {'type': 'message_stop'})
+        else:
+            yield "data: [DONE]\n\n"
+
+    def send_json(self, status, data, headers=None):
+        self.send_raw(status, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json', headers)
+
+    def send_raw(self, status, payload, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_stream(self, events):
+        """以分块传输编码发送 SSE 事件，每个事件立即刷新"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for text in events:
+                data = text.encode('utf-8')
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端读到第一个选项后就关闭连接
+            self.server.stats.add('client_closed')
+            self.close_connection = True
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 监听队列长度：socketserver 默认只有 5，并发连接超出时客户端 SYN 重传（约 1 秒），
+    # 测到的是监听队列而不是决策路径的尾延迟
+    request_queue_size = 128
+
+    def __init__(self, config, host='127.0.0.1', port=DEFAULT_PORT, verbose=False):
+        super().__init__((host, port), StubHandler)
+        self.config = config
+        self.stats = StubStats()
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """在后台线程中运行，返回 API 地址"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.url
+
+
+def option(args, name, default=None, convert=str):
+    """取 --name 值（没有时返回 default）"""
+    if name in args:
+        return convert(args[args.index(name) + 1])
+    return default
+
+
+def config_from_args(args):
+    return StubConfig(
+        latency=option(args, '--latency', 'fixed:0'),
+        token_delay=option(args, '--token-delay', 0.0, float),
+        error=option(args, '--error', 0.0, float),
+        ratelimit=option(args, '--ratelimit', 0.0, float),
+        hang=option(args, '--hang', 0.0, float),
+        malformed=option(args, '--malformed', 0.0, float),
+        hang_time=option(args, '--hang-time', 60.0, float),
+        script=option(args, '--script'),
+        answer=option(args, '--answer', DEFAULT_ANSWER),
+        seed=option(args, '--seed', None, int),
+    )
+
+
+def serve(args):
+    server = StubServer(config_from_args(args), option(args, '--host', '127.0.0.1'),
+                        option(args, '--port', DEFAULT_PORT, int), verbose='--verbose' in args)
+    print(f"AI 桩服务: {server.url}（延迟 {server.config.latency_spec}）")
+    print(f"  IZSH_AI_API_URL={server.url} IZSH_AI_API_KEY=stub")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats.snapshot(), ensure_ascii=False))
+
+
+def load_call(mode, timeout):
+    """按测试模式返回单次调用函数：(问题, 选项) -> 'ok' / 'invalid' / 'skipped'"""
+    if mode == 'engine':
+        from wrapper_engine import Decider
+        decider = Decider(timeout=timeout, use_ai=True, log=False)
+
+        def call(question, options):
+            # Decider 实例共享 ai_skipped，这里按返回值区分熔断跳过（无请求）和无效回答
+            choice = decider.call_ai(question, options)
+            if choice:
+                return 'ok'
+            return 'skipped' if decider.breaker_open() else 'invalid'
+        return call
+
+    import ai_decision
+    if mode == 'text':
+        from ai_backend import call_ai_text
+
+        def call(question, options):
+            return 'ok' if call_ai_text(ai_decision.build_decision_prompt(question, options), timeout) else 'invalid'
+        return call
+
+    decide = ai_decision.decide_batched if mode == 'batched' else ai_decision.decide
+    return lambda question, options: 'invalid' if decide(question, options, timeout) is None else 'ok'
+
+
+def run_load(args):
+    from decision_log import LatencyHistogram
+
+    total = option(args, '--requests', 200, int)
+    concurrency = option(args, '--concurrency', 8, int)
+    mode = option(args, '--mode', 'decide')
+    timeout = option(args, '--timeout', 5.0, float)
+    url = option(args, '--url')
+
+    server = None
+    if not url:
+        server = StubServer(config_from_args(args), port=0)
+        url = server.start()
+
+    os.environ['IZSH_AI_API_URL'] = url
+    os.environ.setdefault('IZSH_AI_API_KEY', 'stub')
+    os.environ['IZSH_AI_API_TYPE'] = option(args, '--type', os.environ.get('IZSH_AI_API_TYPE', 'anthropic'))
+    breaker_dir = tempfile.TemporaryDirectory()
+    os.environ['IZSH_AI_BREAKER_FILE'] = os.path.join(breaker_dir.name, 'breaker.json')
+
+    if mode == 'batched':
+        # 包装器默认不额外等待（只合并调用进行中排队的请求），这里同时测量窗口的效果
+        os.environ.setdefault('IZSH_AI_BATCH_WINDOW', '30')
+    call = load_call(mode, timeout)
+    latency = LatencyHistogram()
+    outcomes = {'ok': 0, 'invalid': 0, 'skipped': 0, 'error': 0}
+    lock = threading.Lock()
+
+    def one(i):
+        question, options = LOAD_PROMPTS[i % len(LOAD_PROMPTS)]
+        start = time.perf_counter()
+        try:
+            outcome = call(question, options)
+        except Exception:
+            outcome = 'error'
+        elapsed = time.perf_counter() - start
+        with lock:
+            latency.add(elapsed)
+            outcomes[outcome] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+
+    print(f"模式 {mode}，{total} 次决策，并发 {concurrency}，{url}")
+    print(f"  吞吐量: {total / wall:.1f} 次/秒（{wall:.2f} 秒）")
+    print(f"  延迟: 平均 {latency.mean * 1000:.1f} ms  p50 {latency.percentile(50) * 1000:.1f} ms  "
+          f"p95 {latency.percentile(95) * 1000:.1f} ms  p99 {latency.percentile(99) * 1000:.1f} ms  "
+          f"最大 {latency.max * 1000:.1f} ms")
+    print(f"  结果: 有效 {outcomes['ok']}  无效 {outcomes['invalid']}  熔断跳过 {outcomes['skipped']}  "
+          f"异常 {outcomes['error']}")
+    if server:
+        print(f"  服务端: {json.dumps(server.stats.snapshot(), ensure_ascii=False)}")
+        server.shutdown()
+        server.server_close()
+    breaker_dir.cleanup()
+
+
+def main():
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args:
+        print(__doc__.strip())
+        return
+    if not args or args[0] not in ('serve', 'load'):
+        print(__doc__.strip().split('用法:')[-1].strip())
+        sys.exit(1)
+    if args[0] == 'serve':
+        serve(args[1:])
+    else:
+        run_load(args[1:])
+
+
+if __name__ == '__main__':
+    main()
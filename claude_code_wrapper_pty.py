@@ -6,109 +6,174 @@ Claude Code AI 自动确认包装器（PTY 版本）
 自动检测确认提示，并使用 iZsh 的 AI 功能自动选择最佳选项
 """
 
+import time
+
+# 启动计时起点（需在其他导入之前记录）
+_STARTUP_T0 = time.perf_counter()
+
 import sys
 import os
 import pty
 import select
-import subprocess
 import re
 import signal
-import time
 import termios
 import tty
 import fcntl
 import struct
+import queue
+import threading
+
+from pattern_guard import format_report
+from proc_state import INPUT_BUSY, INPUT_UNKNOWN, INPUT_WAITING, InputProbe
+from wrapper_engine import WrapperEngine, WrapperStates, all_matchers
+
+# 检测、决策和注入逻辑在 wrapper_engine 中（与管道版本共用），本模块只负责 PTY 传输
+
+# 每次从 PTY 读取的最大字节数
+READ_SIZE = 65536
+
+# 直通模式：两次读取间隔小于 PASSTHROUGH_GAP 秒的连续读取达到 PASSTHROUGH_BURST_READS 次时进入，
+# 输出停顿 PASSTHROUGH_IDLE 秒或出现提示标记时退出；期间最多暂存 PASSTHROUGH_TAIL 字节待分析
+PASSTHROUGH_GAP = 0.05
+PASSTHROUGH_BURST_READS = 8
+PASSTHROUGH_IDLE = 0.3
+PASSTHROUGH_TAIL = 16384
+PASSTHROUGH_SENTINELS = re.compile(rb'\?|\xe2\x9d\xaf|\[[Yy]/[Nn]\]|\([Yy]/[Nn]\)|\[yes/no\]')
+
+# 输出停顿后 /proc 显示前台进程仍在忙碌时，最多推迟检测的时间（秒），防止误判导致漏掉提示
+PROBE_MAX_DEFER = 2.0
+
+# 发往子进程的待写缓冲超过该字节数时暂停读取用户输入（反压）
+MAX_OUTBOUND = 1024 * 1024
+
+# 窗口大小变化（SIGWINCH）的去抖时间：拖动窗口时只把最后一次尺寸转发给子进程
+RESIZE_DEBOUNCE = 0.05
+
+# 分析线程的消息类型
+ANALYZE_DATA = 'data'     # 分析数据并检测提示
+ANALYZE_FEED = 'feed'     # 只分析数据（直通期间暂存的输出）
+ANALYZE_IDLE = 'idle'     # 输出停顿，强制检测提示
+ANALYZE_RESET = 'reset'   # 丢弃当前未完成行
+ANALYZE_STOP = 'stop'
+
+class StartupProfile:
+    """启动耗时剖析（IZSH_STARTUP_PROFILE=1 时在退出后输出）
+
+    输出格式参考 python -X importtime：每个阶段的自身耗时和累计耗时（微秒）。
+    模块级导入耗时可用 python3 -X importtime claude_code_wrapper_pty.py 查看。
+    """
+
+    def __init__(self, t0):
+        self.t0 = t0
+        self.marks = []
+        self.enabled = os.environ.get('IZSH_STARTUP_PROFILE', '0') == '1'
+
+    def mark(self, phase):
+        """记录一个阶段的完成时间（只记录第一次）"""
+        if not any(name == phase for name, _ in self.marks):
+            self.marks.append((phase, time.perf_counter()))
+
+    def elapsed(self, phase):
+        """某阶段距启动的耗时（秒），未记录返回 None"""
+        for name, t in self.marks:
+            if name == phase:
+                return t - self.t0
+        return None
 
-# Claude Code 特定的确认提示模式
-CLAUDE_CODE_PATTERNS = [
-    (r'Do you want to.*\?', 'permission_request'),
-    (r'Can I.*\?', 'permission_request'),
-    (r'Should I.*\?', 'permission_request'),
-    (r'May I.*\?', 'permission_request'),
-    (r'Allow.*\?', 'permission_request'),
-    (r'create.*\?', 'file_operation'),
-    (r'edit.*\?', 'file_operation'),
-    (r'delete.*\?', 'file_operation'),
-    (r'overwrite.*\?', 'file_operation'),
-    (r'Run.*command.*\?', 'command_execution'),
-    (r'Execute.*\?', 'command_execution'),
-]
-
-# 通用确认提示模式
-CONFIRM_PATTERNS = [
-    (r'\[Y/n\]|\[y/N\]', 'Y/n'),
-    (r'\[yes/no\]', 'yes/no'),
-    (r'\(Y/n\)|\(y/N\)', 'Y/n'),
-    (r'\(yes/no\)', 'yes/no'),
-    (r'\[1/2/3/4/5\]', '1/2/3/4/5'),
-    (r'\[1/2/3/4\]', '1/2/3/4'),
-    (r'\[1/2/3\]', '1/2/3'),
-    (r'\[1/2\]', '1/2'),
-    (r'❯\s*\d+\.', 'numbered_menu'),
-    (r'\d+\)\s+\w+.*?\d+\)\s+\w+', 'numbered_options'),
-]
-
-# 箭头键的 ANSI 转义序列
-ARROW_KEYS = {
-    'UP': '\x1b[A',
-    'DOWN': '\x1b[B',
-    'ENTER': '\n',
-}
-
-class ClaudeCodeWrapperPTY:
-    # 状态定义 - 完整版
-    # 1. 启动和初始化
-    STATE_STARTING = "starting"           # 🚀 启动中
-    STATE_INITIALIZING = "initializing"   # 🔄 初始化
-
-    # 2. 正常工作状态
-    STATE_THINKING = "thinking"           # 🤔 思考中
-    STATE_READING = "reading"             # 📖 读取文件
-    STATE_WRITING = "writing"             # ✏️ 编写代码
-    STATE_EXECUTING = "executing"         # ⚙️ 执行命令
-    STATE_SEARCHING = "searching"         # 🔍 搜索分析
-    STATE_MONITORING = "monitoring"       # 🟢 监控中
-
-    # 3. 交互和等待状态
-    STATE_WAITING_TASK = "waiting_task"   # 🔵 等待任务
-    STATE_WAITING_CONFIRM = "waiting_confirm"  # 🟡 等待确认
-    STATE_WAITING_CHOICE = "waiting_choice"    # 🟠 等待选择
-    STATE_COUNTDOWN = "countdown"         # ⏱️ 倒计时 Ns
-
-    # 4. AI 决策状态
-    STATE_AI_ANALYZING = "ai_analyzing"   # 🧠 AI分析中
-    STATE_AI_SELECTED = "ai_selected"     # ✅ AI已选择
-    STATE_AI_EXECUTING = "ai_executing"   # 🎯 AI执行中
-
-    # 5. 特殊和异常状态
-    STATE_WARNING = "warning"             # ⚠️ 需要注意
-    STATE_ERROR = "error"                 # ❌ 错误发生
-    STATE_PAUSED = "paused"               # ⏸️ 用户暂停
-    STATE_INTERRUPTED = "interrupted"     # 🛑 用户中断
-    STATE_DEBUG = "debug"                 # 🔧 调试模式
-
-    # 6. 完成和结束状态
-    STATE_TASK_DONE = "task_done"         # ✨ 任务完成
-    STATE_ALL_DONE = "all_done"           # 🎉 全部完成
-    STATE_EXITED = "exited"               # 👋 已退出
-
-    def __init__(self, timeout=3):
+    def report(self, stream):
+        """输出剖析结果"""
+        if not self.enabled:
+            return
+        stream.write("startup: self [us] | cumulative | phase\n")
+        previous = self.t0
+        for name, t in self.marks:
+            stream.write(f"startup: {(t - previous) * 1e6:9.0f} | {(t - self.t0) * 1e6:10.0f} | {name}\n")
+            previous = t
+        first_byte = self.elapsed('first child byte')
+        if first_byte is not None:
+            stream.write(f"startup: time-to-first-child-byte {first_byte * 1000:.1f} ms\n")
+        stream.flush()
+
+class LatencyStats:
+    """按键回显延迟统计：从转发用户输入到收到子进程下一次输出的时间"""
+
+    def __init__(self):
+        self.samples = []
+        self.pending_since = None
+
+    def input_sent(self):
+        if self.pending_since is None:
+            self.pending_since = time.perf_counter()
+
+    def output_received(self):
+        if self.pending_since is not None:
+            self.samples.append(time.perf_counter() - self.pending_since)
+            self.pending_since = None
+
+    def report(self, stream):
+        """输出 p50/p95/最大值（毫秒）"""
+        if not self.samples:
+            return
+        ordered = sorted(self.samples)
+        pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+        stream.write(f"echo latency: n={len(ordered)} p50={pick(0.5):.1f}ms "
+                     f"p95={pick(0.95):.1f}ms max={ordered[-1] * 1000:.1f}ms\n")
+        stream.flush()
+
+class ClaudeCodeWrapperPTY(WrapperStates):
+    def __init__(self, timeout=3, profile=None):
         self.timeout = timeout
+        self.profile = profile or StartupProfile(time.perf_counter())
         self.master_fd = None
         self.pid = None
-        self.recent_lines = []
-        self.max_context_lines = 10
-        self.current_line = ""
+        self.engine = WrapperEngine(self.deliver, timeout, on_state=self.on_detected_state)
         self.last_check_time = time.time()
         self.current_state = self.STATE_STARTING
         self.countdown_value = 0
+        # 状态字段和终端输出由 I/O 线程和分析线程共用，读改写和写终端都在这把锁内进行
+        self.state_lock = threading.RLock()
         self.terminal_width = 80  # 默认终端宽度
+        self.window_size = None    # 已转发给 PTY 的 (宽度, 高度)
+        self.resize_pending = 0.0  # 最近一次 SIGWINCH 的时间（0 表示无待处理）
+        self.outbound = bytearray()  # 待写入 PTY 的数据（用户输入和 AI 回答）
+        self.countdown_elapsed = 0.0  # 最近一次决策的倒计时耗时（写入决策日志）
         self.last_state_update = time.time()
         self.state_duration = 0  # 当前状态持续时间
+        # 直通模式（连续输出时跳过检测，IZSH_PASSTHROUGH=0 关闭）
+        self.passthrough_enabled = os.environ.get('IZSH_PASSTHROUGH', '1') == '1'
+        self.passthrough = False
+        self.burst_reads = 0
+        self.last_output_time = 0.0
+        self.idle_checked = True
+        self.deferred = bytearray()
+        self.deferred_truncated = False
+        # 前台进程是否阻塞在终端输入上（Linux /proc 采样，fork 后创建）
+        self.input_probe = None
+        # 分析线程（IZSH_ANALYZER_THREAD=0 时在 I/O 线程中同步分析）
+        self.use_analyzer = os.environ.get('IZSH_ANALYZER_THREAD', '1') == '1'
+        self.analyzer = None
+        self.analysis_queue = queue.SimpleQueue()
+        self.decisions = queue.SimpleQueue()
+        self.wake_r = self.wake_w = None
+        # 交给分析线程的数据序号：注入回答前排队的输出已过时，不再检测提示
+        self.submitted = 0
+        self.answered_seq = 0
+        self.awaiting_answer = False
+        self.user_override = threading.Event()
+        # 按键回显延迟统计（IZSH_LATENCY_REPORT=1 时退出后输出）
+        self.echo_latency = LatencyStats()
+        self.latency_report = os.environ.get('IZSH_LATENCY_REPORT', '0') == '1'
+        # 正则耗时统计（IZSH_PATTERN_PROFILE=1 时退出后输出最慢的模式）
+        self.pattern_profile = os.environ.get('IZSH_PATTERN_PROFILE', '0') == '1'
         # 调试模式
         self.debug_mode = os.environ.get('IZSH_DEBUG_MODE', '0') == '1'
         # 状态指示器默认启用，显示在终端标题栏（不干扰屏幕内容）
         self.show_indicator = os.environ.get('IZSH_SHOW_INDICATOR', '1') == '1'
+        # 渲染模式：IZSH_RENDER_MODE=frame 时经屏幕模型按 IZSH_RENDER_FPS 限速绘制（慢速终端/SSH），
+        # 默认 passthrough 原样输出（frame_renderer 只在帧渲染模式下导入）
+        self.frame_mode = os.environ.get('IZSH_RENDER_MODE', 'passthrough') == 'frame'
+        self.renderer = None
 
     def get_terminal_size(self):
         """获取终端大小"""
@@ -118,393 +183,428 @@ class ClaudeCodeWrapperPTY:
         except:
             return 80, 24
 
+    def apply_window_size(self):
+        """把当前终端大小转发给 PTY（尺寸未变时跳过），返回是否发生了变化"""
+        self.resize_pending = 0.0
+        width, height = self.get_terminal_size()
+        self.terminal_width = width
+        if (width, height) == self.window_size:
+            return False
+        winsize = struct.pack('HHHH', height, width, 0, 0)
+        fcntl.ioctl(self.master_fd, termios.TIOCSWINSZ, winsize)
+        self.window_size = (width, height)
+        if self.renderer is not None:
+            self.renderer.resize(width, height)
+        if self.debug_mode:
+            print(f"[DEBUG] Set PTY window size: {width}x{height}")
+        return True
+
+    def on_sigwinch(self, signum, frame):
+        """SIGWINCH 处理：只记录时间，由主循环去抖后转发"""
+        self.resize_pending = time.monotonic()
+
+    def check_resize(self):
+        """去抖时间已过时转发新尺寸；子进程会按新宽度重绘，丢弃旧宽度下的未完成行"""
+        if not self.resize_pending or time.monotonic() - self.resize_pending < RESIZE_DEBOUNCE:
+            return
+        try:
+            if self.apply_window_size():
+                self.submit_analysis(ANALYZE_RESET)
+        except OSError as e:
+            if self.debug_mode:
+                print(f"[DEBUG] Failed to set window size: {e}")
+
     def show_status_indicator(self):
         """在终端标题栏显示状态指示器（不干扰屏幕内容）"""
         # 如果禁用状态指示器，直接返回
         if not self.show_indicator:
             return
 
-        # 状态映射表
-        state_indicators = {
-            # 1. 启动和初始化
-            self.STATE_STARTING: "🚀 启动中",
-            self.STATE_INITIALIZING: "🔄 初始化",
-
-            # 2. 正常工作状态
-            self.STATE_THINKING: "🤔 思考中",
-            self.STATE_READING: "📖 读取文件",
-            self.STATE_WRITING: "✏️ 编写代码",
-            self.STATE_EXECUTING: "⚙️ 执行命令",
-            self.STATE_SEARCHING: "🔍 搜索分析",
-            self.STATE_MONITORING: "🟢 监控中",
-
-            # 3. 交互和等待状态
-            self.STATE_WAITING_TASK: "🔵 等待任务",
-            self.STATE_WAITING_CONFIRM: "🟡 等待确认",
-            self.STATE_WAITING_CHOICE: "🟠 等待选择",
-
-            # 4. AI 决策状态
-            self.STATE_AI_ANALYZING: "🧠 AI分析中",
-            self.STATE_AI_SELECTED: "✅ AI已选择",
-            self.STATE_AI_EXECUTING: "🎯 AI执行中",
-
-            # 5. 特殊和异常状态
-            self.STATE_WARNING: "⚠️ 需要注意",
-            self.STATE_ERROR: "❌ 错误发生",
-            self.STATE_PAUSED: "⏸️ 用户暂停",
-            self.STATE_INTERRUPTED: "🛑 用户中断",
-            self.STATE_DEBUG: "🔧 调试模式",
-
-            # 6. 完成和结束状态
-            self.STATE_TASK_DONE: "✨ 任务完成",
-            self.STATE_ALL_DONE: "🎉 全部完成",
-            self.STATE_EXITED: "👋 已退出",
-        }
-
-        # 特殊处理倒计时状态
-        if self.current_state == self.STATE_COUNTDOWN:
-            indicator = f"⏱️ 倒计时 {self.countdown_value}s"
-        else:
-            indicator = state_indicators.get(self.current_state, "🟢 监控中")
-
-        # 使用终端标题栏显示状态（完全不占用屏幕空间）
-        # \033]0; 设置终端标题
-        # \007 结束标题设置
-        title = f"Claude Code - {indicator}"
-        sys.stderr.write(f"\033]0;{title}\007")
-        sys.stderr.flush()
-
-    def update_state(self, new_state, countdown=0):
-        """更新状态并显示"""
-        self.current_state = new_state
-        self.countdown_value = countdown
-        self.show_status_indicator()
-
-    def strip_ansi(self, text):
-        """移除 ANSI 转义序列"""
-        # 移除 ANSI 颜色和控制序列
-        ansi_escape = re.compile(r'\x1b\[[0-9;]*[A-Za-z]|\x1b\][^\x07]*\x07|\x1b[=>]|[\x00-\x1f]', re.UNICODE)
-        return ansi_escape.sub('', text)
-
-    def add_to_context(self, line):
-        """添加行到上下文缓冲区"""
-        self.recent_lines.append(line)
-        if len(self.recent_lines) > self.max_context_lines:
-            self.recent_lines.pop(0)
-
-    def get_context(self):
-        """获取上下文（最近几行）"""
-        return '\n'.join(self.recent_lines)
-
-    def detect_waiting_for_input(self, text):
-        """检测是否在等待用户输入新任务"""
-        # Claude Code 等待输入的常见模式
-        waiting_patterns = [
-            r'How can I help you\?',
-            r'What would you like me to do\?',
-            r'What can I help you with\?',
-            r'>\s*$',  # 单独的 > 提示符
-            r'What\'s next\?',
-            # Claude Code 2.0 的提示格式
-            r'>\s+Try\s+"write',  # > Try "write a test for <filepath>"
-            r'>\s+.*for shortcuts',  # Claude Code 的输入提示行
-            r'Claude Code.*v\d+\.\d+',  # Claude Code 欢迎界面
-        ]
-
-        for pattern in waiting_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                return True
-
-        return False
-
-    def detect_state_from_output(self, text):
-        """从输出文本智能检测当前状态"""
-        text_lower = text.lower()
-
-        # 思考和规划
-        thinking_keywords = ['analyzing', 'planning', 'considering', 'let me', 'i\'ll', 'i will',
-                            '分析', '规划', '让我', '我将', '我会']
-        if any(kw in text_lower for kw in thinking_keywords):
-            return self.STATE_THINKING
-
-        # 读取文件
-        reading_keywords = ['reading', 'read', 'looking at', 'checking', 'reviewing',
-                          '读取', '查看', '检查', '审查']
-        if any(kw in text_lower for kw in reading_keywords):
-            if 'file' in text_lower or 'code' in text_lower or '文件' in text:
-                return self.STATE_READING
-
-        # 编写代码
-        writing_keywords = ['writing', 'creating', 'modifying', 'editing', 'updating',
-                          '编写', '创建', '修改', '更新']
-        if any(kw in text_lower for kw in writing_keywords):
-            if any(w in text_lower for w in ['file', 'code', 'function', '文件', '代码', '函数']):
-                return self.STATE_WRITING
-
-        # 执行命令
-        executing_keywords = ['running', 'executing', 'command', 'bash', 'git', 'npm',
-                            '运行', '执行', '命令']
-        if any(kw in text_lower for kw in executing_keywords):
-            return self.STATE_EXECUTING
-
-        # 搜索分析
-        searching_keywords = ['searching', 'finding', 'looking for', 'grep', 'search',
-                            '搜索', '查找', '寻找']
-        if any(kw in text_lower for kw in searching_keywords):
-            return self.STATE_SEARCHING
-
-        # 错误检测（更严格，避免误报）
-        # 只检测真正的错误消息格式，而非包含关键词的普通文本
-        error_patterns = [
-            r'(?:^|\s)error:',           # "Error:" 开头的消息
-            r'(?:^|\s)fatal:',           # "Fatal:" 开头的消息
-            r'failed with.*error',       # "failed with error" 格式
-            r'exception.*occurred',      # "exception occurred" 格式
-            r'traceback',                # Python traceback
-            r'错误：',                    # 中文错误消息
-            r'失败：',                    # 中文失败消息
-            r'异常：',                    # 中文异常消息
-        ]
-        if any(re.search(pattern, text_lower) for pattern in error_patterns):
-            return self.STATE_ERROR
-
-        # 警告检测
-        warning_keywords = ['warning', 'caution', 'notice', 'important',
-                          '警告', '注意', '重要']
-        if any(kw in text_lower for kw in warning_keywords):
-            return self.STATE_WARNING
-
-        # 任务完成
-        done_keywords = ['done', 'completed', 'finished', 'success',
-                       '完成', '成功']
-        if any(kw in text_lower for kw in done_keywords):
-            return self.STATE_TASK_DONE
-
-        return None  # 未检测到特定状态
-
-    def detect_confirm_prompt(self, line):
-        """检测是否是确认提示"""
-        for pattern, options in CONFIRM_PATTERNS:
-            if re.search(pattern, line, re.IGNORECASE):
-                return options
-        return None
-
-    def detect_menu(self, context):
-        """检测是否是交互式菜单"""
-        # 检测 Claude Code 菜单格式：❯ 1. Yes
-        claude_menu_pattern = r'❯\s*\d+\.'
-        if re.search(claude_menu_pattern, context):
-            lines = context.split('\n')
-            menu_items = []
-
-            for line in lines:
-                match = re.search(r'(❯)?\s*(\d+)\.\s+(.+?)$', line)
-                if match:
-                    menu_items.append({
-                        'number': match.group(2),
-                        'text': match.group(3).strip(),
-                        'format': 'claude_code'
-                    })
-
-            if menu_items:
-                return True, menu_items
-
-        return False, []
-
-    def call_ai_suggest(self, prompt):
-        """调用 AI 获取建议"""
-        try:
-            result = subprocess.run(
-                [os.path.expanduser('~/.local/bin/izsh'), '-c',
-                 f'source ~/.izshrc 2>/dev/null && ai_suggest "{prompt}"'],
-                capture_output=True,
-                text=True,
-                timeout=self.timeout + 3,
-                env={**os.environ,
-                     'DYLD_LIBRARY_PATH': '/Users/zhangzhen/anaconda3/lib',
-                     'OBJC_DISABLE_INITIALIZE_FORK_SAFETY': 'YES'}
-            )
-
-            output = result.stdout.strip()
-            # 提取数字或文本
-            match = re.search(r'(\d+|[YyNn]|yes|no)', output)
-            if match:
-                return match.group(1)
-
-        except Exception as e:
-            print(f"\n❌ AI 决策失败: {e}", file=sys.stderr)
-
-        return None
-
-    def handle_menu(self, menu_items):
-        """处理菜单选择"""
-        # 构造 AI prompt
-        options_text = ' | '.join([f"{item['number']}: {item['text']}" for item in menu_items])
-        ai_prompt = f"""这是一个菜单选择界面，请选择最佳选项：
-
-{options_text}
-
-选择原则：
-1. 选择最完整、功能最全面的选项
-2. 有'推荐'或'默认'标记的优先
-3. 避免'跳过'、'取消'等消极选项
-4. 选择能让程序继续运行的选项
-
-只输出选项编号（1、2、3 等），不要任何解释。"""
-
-        choice = self.call_ai_suggest(ai_prompt)
-        if choice and choice.isdigit():
-            return choice
-
-        # 默认选择第一个
-        return menu_items[0]['number'] if menu_items else '1'
-
-    def handle_confirm(self, prompt, options):
-        """处理确认提示"""
-        ai_prompt = f"""这是一个确认提示：'{prompt}'
-可选项：'{options}'
-
-请选择最佳选项。选择原则：
-1. 如果是 Y/n 类型，通常选择 Y（继续）
-2. 如果是数字选项，分析后选择最佳
-3. 选择能让程序继续执行的选项
-
-只输出选项字符（如 Y、n、1、2 等），不要任何解释。"""
-
-        choice = self.call_ai_suggest(ai_prompt)
-        if choice:
-            return choice
-
-        # 默认选择第一个选项
-        first_option = options.split('/')[0].strip('[]()')
-        match = re.search(r'\d+|[Yy]', first_option)
-        return match.group() if match else 'Y'
+        with self.state_lock:
+            indicator = self.indicator(self.current_state, self.countdown_value)
+
+            # 使用终端标题栏显示状态（完全不占用屏幕空间）
+            # \033]0; 设置终端标题
+            # \007 结束标题设置
+            title = f"Claude Code - {indicator}"
+            sys.stderr.write(f"\033]0;{title}\007")
+            sys.stderr.flush()
+
+    def update_state(self, new_state, countdown=0, only_from=None):
+        """更新状态并显示，返回是否更新
+
+        给出 only_from 时只在当前状态属于其中时更新（判断和更新在同一把锁内）。
+        """
+        with self.state_lock:
+            if only_from is not None and self.current_state not in only_from:
+                return False
+            self.current_state = new_state
+            self.countdown_value = countdown
+            self.show_status_indicator()
+            return True
+
+    def state_in(self, states):
+        """当前状态是否属于 states"""
+        with self.state_lock:
+            return self.current_state in states
 
     def process_output(self, data):
-        """处理输出数据"""
-        # 显示输出
-        sys.stdout.write(data)
-        sys.stdout.flush()
-
-        # 更新当前行
-        self.current_line += data
-
-        # 检测换行
-        if '\n' in data or '\r' in data:
-            lines = self.current_line.split('\n')
-            for line in lines[:-1]:
-                if line.strip():
-                    self.add_to_context(line.strip())
-
-                    # 清理 ANSI 转义序列后再检测
-                    clean_line = self.strip_ansi(line)
-
-                    if self.debug_mode and clean_line.strip():
-                        # 只在前几行显示清理后的文本
-                        if len(self.recent_lines) <= 10:
-                            print(f"[DEBUG] Clean line: {repr(clean_line[:80])}")
-
-                    # 检测是否在等待用户输入新任务
-                    if self.detect_waiting_for_input(clean_line):
-                        if self.debug_mode:
-                            print(f"[DEBUG] Detected waiting for input")
-                        self.update_state(self.STATE_WAITING_TASK)
-                        continue
-
-                    # 智能检测状态（在等待确认、等待选择、倒计时时不检测）
-                    if self.current_state not in [self.STATE_WAITING_CONFIRM,
-                                                   self.STATE_WAITING_CHOICE,
-                                                   self.STATE_COUNTDOWN]:
-                        detected_state = self.detect_state_from_output(clean_line)
-                        if detected_state:
-                            if self.debug_mode:
-                                print(f"[DEBUG] State changed to: {detected_state}")
-                            self.update_state(detected_state)
+        """处理输出数据（bytes）：显示、分析并检测提示"""
+        self.display(data)
+        self.engine.feed(data)
+        self.check_prompts()
+
+    def display(self, data):
+        """把输出原样写到终端（一次 write）；帧渲染模式下只更新屏幕模型，由主循环按帧率绘制"""
+        if self.renderer is not None:
+            with self.state_lock:
+                self.renderer.feed(data)
+                replies = self.renderer.take_replies()
+            if replies:
+                self.queue_write(replies)
+            self.paint_frame()
+            return
+        with self.state_lock:
+            stdout = sys.stdout.buffer
+            stdout.write(data)
+            stdout.flush()
+
+    def paint_frame(self, force=False):
+        """绘制屏幕模型的最新一帧（未到刷新时间时不输出，期间的中间帧被丢弃）"""
+        with self.state_lock:
+            frame = self.renderer.render(force)
+            if frame:
+                stdout = sys.stdout.buffer
+                stdout.write(frame)
+                stdout.flush()
+
+    def message(self, text):
+        """输出包装器自己的提示信息（帧渲染模式下写入屏幕模型，避免与绘制内容错位）"""
+        with self.state_lock:
+            if self.renderer is None:
+                print(text)
+                return
+            self.renderer.feed((text + '\n').replace('\n', '\r\n').encode('utf-8'))
+
+    def on_detected_state(self, state):
+        """引擎从输出中检测到状态（在等待确认、等待选择、倒计时时只接受等待输入）"""
+        with self.state_lock:
+            if state != self.STATE_WAITING_TASK and self.current_state in [self.STATE_WAITING_CONFIRM,
+                                                                           self.STATE_WAITING_CHOICE,
+                                                                           self.STATE_COUNTDOWN]:
+                return
+            if self.debug_mode:
+                print(f"[DEBUG] State changed to: {state}")
+            self.update_state(state)
 
-            self.current_line = lines[-1]
+    def check_prompts(self, force=False):
+        """检测菜单和确认提示（定期执行，避免过于频繁），决策后经 deliver 发送回答
 
-        # 定期检测（避免过于频繁）
+        在分析线程中运行：倒计时和 AI 调用不会阻塞 I/O。
+        倒计时期间用户有输入时放弃本次自动选择。
+        """
         now = time.time()
-        if now - self.last_check_time > 0.5:
-            self.last_check_time = now
+        if not force and now - self.last_check_time <= 0.5:
+            return
+        self.last_check_time = now
 
-            # 检测菜单
-            context = self.get_context()
-            is_menu, menu_items = self.detect_menu(context)
+        # 前台进程仍在运行时，看起来像提示的输出只是普通文本，不做检测也不调用 AI
+        # （强制检测来自 on_idle，已按进程状态决定过时机）
+        if not force and self.child_input_state() == INPUT_BUSY:
+            return
 
-            if is_menu:
-                self.update_state(self.STATE_WAITING_CHOICE)
-                print("\n🔍 检测到交互式菜单，AI 正在分析...")
+        prompt = self.engine.find_prompt()
+        if prompt is None:
+            return
 
-                # AI 分析状态
-                self.update_state(self.STATE_AI_ANALYZING)
-                time.sleep(0.5)
+        if prompt.menu_items:
+            self.update_state(self.STATE_WAITING_CHOICE)
+            self.message("\n🔍 检测到交互式菜单，AI 正在分析...")
+        else:
+            self.update_state(self.STATE_WAITING_CONFIRM)
+            self.message(f"\n⏰ 检测到确认提示，倒计时 {self.timeout} 秒...")
+        if not self.countdown():
+            self.engine.skip(prompt, self.countdown_elapsed)
+            return
 
-                # 倒计时
-                for i in range(self.timeout, 0, -1):
-                    self.update_state(self.STATE_COUNTDOWN, i)
-                    time.sleep(1)
+        # AI 执行
+        self.update_state(self.STATE_AI_EXECUTING)
+        choice = self.engine.decide(prompt, self.countdown_elapsed)
+
+        if self.engine.decider.ai_skipped:
+            # AI 后端熔断，直接使用了默认选项
+            self.update_state(self.STATE_AI_UNAVAILABLE)
+            self.message(f"⛔ AI 后端熔断中，使用默认选项: {choice}")
+        elif self.engine.decider.reused:
+            self.update_state(self.STATE_AI_SELECTED)
+            self.message(f"♻️ 复用相似提示的决策: {choice}")
+        else:
+            # AI 已选择
+            self.update_state(self.STATE_AI_SELECTED)
+            self.message(f"✅ AI {'选择' if prompt.menu_items else '自动选择'}: {choice}")
+        time.sleep(1)
 
-                # AI 执行
-                self.update_state(self.STATE_AI_EXECUTING)
-                choice = self.handle_menu(menu_items)
+        # 恢复监控
+        self.update_state(self.STATE_MONITORING)
 
-                # AI 已选择
-                self.update_state(self.STATE_AI_SELECTED)
-                print(f"✅ AI 选择: {choice}")
-                time.sleep(1)
+        # 发送选择：回答写出之前排队的输出仍含本次提示，标记为过时（见 is_stale）
+        if self.analyzer is not None:
+            with self.state_lock:
+                self.awaiting_answer = True
+        self.engine.inject(prompt, choice)
 
-                # 恢复监控
-                self.update_state(self.STATE_MONITORING)
+    def countdown(self):
+        """AI 分析和倒计时；用户在此期间输入时返回 False（放弃自动选择）"""
+        self.user_override.clear()
+        start = time.monotonic()
 
-                # 发送选择
-                return choice + '\n'
+        try:
+            # AI 分析状态（后端熔断时显示熔断状态）
+            if self.engine.decider.breaker_open():
+                self.update_state(self.STATE_AI_UNAVAILABLE)
+            else:
+                self.update_state(self.STATE_AI_ANALYZING)
+            if self.user_override.wait(0.5):
+                return self.cancel_decision()
+
+            # 倒计时
+            for i in range(self.timeout, 0, -1):
+                self.update_state(self.STATE_COUNTDOWN, i)
+                if self.user_override.wait(1):
+                    return self.cancel_decision()
+            return True
+        finally:
+            self.countdown_elapsed = time.monotonic() - start
 
-            # 检测确认提示
-            if self.current_line.strip():
-                options = self.detect_confirm_prompt(self.current_line)
-                if options:
-                    self.update_state(self.STATE_WAITING_CONFIRM)
-                    prompt = re.sub(r'\s*[\[\(].*?[\]\)].*$', '', self.current_line).strip()
-                    print(f"\n⏰ 检测到确认提示，倒计时 {self.timeout} 秒...")
+    def cancel_decision(self):
+        """用户已手动响应，放弃本次自动选择"""
+        self.message("\n✋ 用户已输入，取消 AI 自动选择")
+        self.update_state(self.STATE_MONITORING)
+        return False
 
-                    # AI 分析状态
-                    self.update_state(self.STATE_AI_ANALYZING)
-                    time.sleep(0.5)
+    # ---------- 分析线程 ----------
+    # I/O 线程（run 中的主循环）只搬运字节：读子进程输出、写终端、转发键盘输入。
+    # 行切分、ANSI 清理、状态检测、提示检测和 AI 决策都在分析线程中进行，
+    # 通过 SimpleQueue 传入数据，决策结果经 decisions 队列和唤醒管道交回 I/O 线程发送。
+    # 队列中的数据带序号：决策注入后，回答写出之前产生的输出（倒计时期间重绘的同一个提示）
+    # 直接丢弃，避免在回答之后再次检测到它。
+
+    def start_analyzer(self):
+        """启动分析线程和唤醒管道"""
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.analyzer = threading.Thread(target=self.analyzer_loop, daemon=True)
+        self.analyzer.start()
+
+    def stop_analyzer(self):
+        """停止分析线程"""
+        if self.analyzer is None:
+            return
+        self.user_override.set()
+        self.analysis_queue.put((ANALYZE_STOP, None, 0))
+        self.analyzer.join(timeout=1)
+        self.analyzer = None
+        for fd in (self.wake_r, self.wake_w):
+            os.close(fd)
+
+    def analyzer_loop(self):
+        """分析线程主循环"""
+        while True:
+            kind, data, seq = self.analysis_queue.get()
+            try:
+                if kind == ANALYZE_STOP:
+                    return
+                if kind == ANALYZE_RESET:
+                    self.engine.reset_line()
+                    continue
+                if self.is_stale(seq):
+                    continue
+                if kind == ANALYZE_FEED:
+                    self.engine.feed(data)
+                    continue
+                if kind == ANALYZE_DATA:
+                    self.engine.feed(data)
+                    self.check_prompts()
+                else:
+                    self.check_prompts(force=True)
+            except Exception as e:
+                if self.debug_mode:
+                    print(f"[DEBUG] Analyzer error: {e}")
+
+    def submit_analysis(self, kind, data=None):
+        """把数据交给分析线程（无分析线程时同步处理）"""
+        if self.analyzer is not None:
+            self.submitted += 1
+            self.analysis_queue.put((kind, data, self.submitted))
+        elif kind == ANALYZE_RESET:
+            self.engine.reset_line()
+        elif kind == ANALYZE_FEED:
+            self.engine.feed(data)
+        elif kind == ANALYZE_DATA:
+            self.engine.feed(data)
+            self.check_prompts()
+        else:
+            self.check_prompts(force=True)
 
-                    # 倒计时
-                    for i in range(self.timeout, 0, -1):
-                        self.update_state(self.STATE_COUNTDOWN, i)
-                        time.sleep(1)
+    def is_stale(self, seq):
+        """序号为 seq 的数据是否在上一次回答写出之前产生（已过时）"""
+        with self.state_lock:
+            return self.awaiting_answer or seq <= self.answered_seq
 
-                    # AI 执行
-                    self.update_state(self.STATE_AI_EXECUTING)
-                    choice = self.handle_confirm(prompt, options)
+    def deliver(self, keys):
+        """引擎注入回答：分析线程中排队并唤醒 I/O 线程，同步分析时直接写入"""
+        if self.analyzer is None:
+            self.send_ai_response(keys)
+            return
+        self.decisions.put(keys)
+        try:
+            os.write(self.wake_w, b'!')
+        except OSError:
+            pass
 
-                    # AI 已选择
-                    self.update_state(self.STATE_AI_SELECTED)
-                    print(f"✅ AI 自动选择: {choice}")
-                    time.sleep(1)
+    def drain_decisions(self):
+        """取出分析线程交回的决策并发送"""
+        try:
+            os.read(self.wake_r, 4096)
+        except OSError:
+            pass
+        while True:
+            try:
+                response = self.decisions.get_nowait()
+            except queue.Empty:
+                break
+            self.send_ai_response(response)
+        # 此前提交的输出都早于回答，分析线程不再用它们检测提示
+        with self.state_lock:
+            self.answered_seq = self.submitted
+            self.awaiting_answer = False
+
+    def handle_child_output(self, data):
+        """处理子进程输出：连续大量输出时走直通路径，只显示不分析
+
+        直通期间的数据暂存在有界缓冲区中；当输出出现提示标记（?、❯、[Y/n] 等）
+        或输出停顿时（见 on_idle）才补做分析和提示检测。
+        """
+        now = time.monotonic()
+        if now - self.last_output_time < PASSTHROUGH_GAP:
+            self.burst_reads += 1
+        else:
+            self.burst_reads = 0
+        self.last_output_time = now
+        self.idle_checked = False
+
+        if (self.passthrough_enabled and not self.passthrough
+                and self.burst_reads >= PASSTHROUGH_BURST_READS
+                and not self.state_in([self.STATE_WAITING_CONFIRM,
+                                       self.STATE_WAITING_CHOICE,
+                                       self.STATE_COUNTDOWN])):
+            self.passthrough = True
+            if self.debug_mode:
+                print("[DEBUG] Entering passthrough mode")
+
+        self.display(data)
+        if self.passthrough:
+            if not PASSTHROUGH_SENTINELS.search(data):
+                self.defer_analysis(data)
+                return
+            # 出现提示标记，恢复完整检测
+            self.leave_passthrough()
+
+        self.submit_analysis(ANALYZE_DATA, data)
+
+    def defer_analysis(self, data):
+        """直通期间暂存待分析的输出（只保留末尾部分）"""
+        self.deferred += data
+        if len(self.deferred) > PASSTHROUGH_TAIL:
+            del self.deferred[:-PASSTHROUGH_TAIL]
+            self.deferred_truncated = True
+
+    def leave_passthrough(self):
+        """退出直通模式并补做暂存数据的分析"""
+        self.passthrough = False
+        self.burst_reads = 0
+        deferred = bytes(self.deferred)
+        self.deferred = bytearray()
+        if self.deferred_truncated:
+            # 缓冲区被截断，丢弃不完整的首行并重新开始当前行
+            self.deferred_truncated = False
+            self.submit_analysis(ANALYZE_RESET)
+            newline = deferred.find(b'\n')
+            deferred = deferred[newline + 1:] if newline >= 0 else b''
+        if deferred:
+            self.submit_analysis(ANALYZE_FEED, deferred)
+        if self.debug_mode:
+            print("[DEBUG] Leaving passthrough mode")
 
-                    # 恢复监控
-                    self.update_state(self.STATE_MONITORING)
+    def send_ai_response(self, ai_response):
+        """把 AI 的回答发送给程序"""
+        if not ai_response:
+            return
+        if self.debug_mode:
+            print(f"[DEBUG] Sending AI response: {repr(ai_response)}")
+        self.queue_write(ai_response.encode('utf-8'))
 
-                    # 发送选择
-                    self.current_line = ""
-                    return choice + '\n'
+    def queue_write(self, data):
+        """追加到发往子进程的写缓冲，并立即尝试写出"""
+        self.outbound += data
+        self.flush_writes()
 
-        return None
+    def flush_writes(self):
+        """尽量写出缓冲区：处理部分写入，PTY 写满（EAGAIN）时等待 select 报告可写"""
+        while self.outbound:
+            try:
+                written = os.write(self.master_fd, self.outbound)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # 子进程已退出等不可恢复的错误：丢弃缓冲，由读取端发现 EOF 后结束
+                if self.debug_mode:
+                    print(f"[DEBUG] Write to child failed: {e}")
+                self.outbound = bytearray()
+                return
+            del self.outbound[:written]
+
+    def child_input_state(self):
+        """前台进程的输入等待状态（INPUT_WAITING / INPUT_BUSY / INPUT_UNKNOWN）"""
+        if self.input_probe is None:
+            return INPUT_UNKNOWN
+        return self.input_probe.sample()
+
+    def on_idle(self):
+        """输出停顿时调用：退出直通模式并做一次完整检测
+
+        前台进程已阻塞在终端读取上时立即检测；仍在忙碌时推迟到它停下（最多 PROBE_MAX_DEFER 秒）；
+        无法判断时按原来的停顿时间 PASSTHROUGH_IDLE 检测。
+        """
+        if self.idle_checked:
+            return
+        silence = time.monotonic() - self.last_output_time
+        state = self.child_input_state()
+        if state != INPUT_WAITING:
+            if silence < PASSTHROUGH_IDLE:
+                return
+            if state == INPUT_BUSY and silence < PROBE_MAX_DEFER:
+                return
+        if self.debug_mode:
+            print(f"[DEBUG] Idle check after {silence * 1000:.0f} ms (child {state})")
+        self.idle_checked = True
+        if self.passthrough:
+            self.leave_passthrough()
+        self.submit_analysis(ANALYZE_IDLE)
 
     def run(self, command_args):
         """运行 Claude Code 并处理交互"""
-        # 清屏：清除之前的文字残留
-        print("\033[2J\033[H", end="", flush=True)
+        # 清屏（可选）：IZSH_CLEAR_SCREEN=1 时清除之前的文字残留
+        if os.environ.get('IZSH_CLEAR_SCREEN', '0') == '1':
+            print("\033[2J\033[H", end="", flush=True)
 
         # 不再显示启动提示，让 Claude Code 的信息完整呈现
 
         # 检查 stdin 是否是 TTY
         is_tty = sys.stdin.isatty()
         old_tty = None
+        old_sigwinch = None
 
         if self.debug_mode:
             print(f"[DEBUG] stdin is TTY: {is_tty}")
@@ -526,6 +626,7 @@ class ClaudeCodeWrapperPTY:
             if self.debug_mode:
                 print(f"[DEBUG] Creating PTY...")
 
+            self.profile.mark('tty setup')
             self.pid, self.master_fd = pty.fork()
 
             if self.pid == 0:  # 子进程
@@ -536,20 +637,19 @@ class ClaudeCodeWrapperPTY:
                 os.execvp(command_args[0], command_args)
 
             # 父进程：处理输入输出
+            self.profile.mark('pty fork')
+            self.input_probe = InputProbe(self.pid, self.master_fd, last_output=lambda: self.last_output_time)
             if self.debug_mode:
                 print(f"[DEBUG] Parent process, child PID: {self.pid}")
                 print(f"[DEBUG] Master FD: {self.master_fd}")
 
-            # 设置 PTY 窗口大小
+            # 设置 PTY 窗口大小，并在终端大小变化时同步
             try:
-                width, height = self.get_terminal_size()
-                winsize = struct.pack('HHHH', height, width, 0, 0)
-                fcntl.ioctl(self.master_fd, termios.TIOCSWINSZ, winsize)
-                if self.debug_mode:
-                    print(f"[DEBUG] Set PTY window size: {width}x{height}")
+                self.apply_window_size()
             except Exception as e:
                 if self.debug_mode:
                     print(f"[DEBUG] Failed to set window size: {e}")
+            old_sigwinch = signal.signal(signal.SIGWINCH, self.on_sigwinch)
 
             # 设置 master_fd 为非阻塞模式
             flags = fcntl.fcntl(self.master_fd, fcntl.F_GETFL)
@@ -562,12 +662,22 @@ class ClaudeCodeWrapperPTY:
                 if self.debug_mode:
                     print(f"[DEBUG] Set stdin to raw mode")
 
-            # 显示初始状态（初始化中）
+            # 帧渲染模式（仅在输出到终端时）
+            if self.frame_mode and sys.stdout.isatty():
+                from frame_renderer import DEFAULT_FPS, FrameRenderer
+                width, height = self.window_size or self.get_terminal_size()
+                fps = float(os.environ.get('IZSH_RENDER_FPS', DEFAULT_FPS))
+                self.renderer = FrameRenderer(width or 80, height or 24, fps)
+                sys.stdout.buffer.write(self.renderer.start())
+                sys.stdout.buffer.flush()
+
+            # 显示初始状态（初始化中），收到子进程第一个字节后切换到监控状态
             self.update_state(self.STATE_INITIALIZING)
-            time.sleep(0.5)
+            self.profile.mark('main loop')
 
-            # 切换到监控状态
-            self.update_state(self.STATE_MONITORING)
+            # 启动分析线程：I/O 线程只搬运字节
+            if self.use_analyzer:
+                self.start_analyzer()
 
             if self.debug_mode:
                 print(f"[DEBUG] Entering main loop...")
@@ -577,14 +687,27 @@ class ClaudeCodeWrapperPTY:
                 # 使用 select 监听输入和输出
                 # 只在 TTY 时监听 stdin
                 watch_fds = [self.master_fd]
-                if is_tty:
+                if is_tty and len(self.outbound) < MAX_OUTBOUND:
                     watch_fds.append(sys.stdin)
+                if self.wake_r is not None:
+                    watch_fds.append(self.wake_r)
 
                 if self.debug_mode and loop_count < 5:
                     print(f"[DEBUG] Loop {loop_count}: Waiting for I/O (watching {len(watch_fds)} fds)...")
                     loop_count += 1
 
-                r, w, e = select.select(watch_fds, [], [], 0.1)
+                # 有待转发的尺寸变化时缩短等待，按去抖时间及时处理
+                wait = RESIZE_DEBOUNCE if self.resize_pending else 0.1
+                if self.renderer is not None:
+                    # 屏幕模型有未绘制的变化时，等到下一帧的时间点
+                    due = self.renderer.due_in()
+                    if due is not None:
+                        wait = min(wait, due)
+                write_fds = [self.master_fd] if self.outbound else []
+                r, w, e = select.select(watch_fds, write_fds, [], wait)
+                self.check_resize()
+                if self.renderer is not None:
+                    self.paint_frame()
 
                 if self.debug_mode and r:
                     print(f"[DEBUG] Ready fds: {len(r)}")
@@ -596,14 +719,24 @@ class ClaudeCodeWrapperPTY:
                         if self.debug_mode:
                             print(f"[DEBUG] User input: {len(data)} bytes")
                         # 用户开始输入，更新状态
-                        if self.current_state == self.STATE_WAITING_TASK:
-                            self.update_state(self.STATE_THINKING)
-                        os.write(self.master_fd, data)
+                        self.update_state(self.STATE_THINKING, only_from=[self.STATE_WAITING_TASK])
+                        # 用户在倒计时期间手动响应，取消自动选择
+                        self.user_override.set()
+                        self.queue_write(data)
+                        self.echo_latency.input_sent()
+
+                # PTY 可写时继续写出缓冲
+                if self.master_fd in w:
+                    self.flush_writes()
+
+                # 分析线程交回的决策
+                if self.wake_r is not None and self.wake_r in r:
+                    self.drain_decisions()
 
                 # 处理程序输出
                 if self.master_fd in r:
                     try:
-                        data = os.read(self.master_fd, 1024)
+                        data = os.read(self.master_fd, READ_SIZE)
                         if not data:
                             if self.debug_mode:
                                 print(f"[DEBUG] No data from master_fd, child process may have exited")
@@ -611,29 +744,32 @@ class ClaudeCodeWrapperPTY:
 
                         if self.debug_mode:
                             print(f"[DEBUG] Received {len(data)} bytes from child")
+                        self.echo_latency.output_received()
 
-                        # 服务器开始返回数据，更新状态
-                        if self.current_state == self.STATE_WAITING_TASK:
-                            # 有数据返回说明服务器正在思考/生成回复
-                            self.update_state(self.STATE_THINKING)
+                        # 子进程就绪：第一个输出字节到达
+                        if self.state_in([self.STATE_INITIALIZING]):
+                            self.profile.mark('first child byte')
+                            if self.debug_mode:
+                                ttfb = self.profile.elapsed('first child byte') * 1000
+                                print(f"[DEBUG] Time to first child byte: {ttfb:.1f} ms")
+                            self.update_state(self.STATE_MONITORING, only_from=[self.STATE_INITIALIZING])
 
-                        # 处理输出并检测提示
-                        text = data.decode('utf-8', errors='replace')
-                        ai_response = self.process_output(text)
+                        # 服务器开始返回数据，更新状态
+                        # （有数据返回说明服务器正在思考/生成回复）
+                        self.update_state(self.STATE_THINKING, only_from=[self.STATE_WAITING_TASK])
 
-                        # 如果 AI 有响应，发送给程序
-                        if ai_response:
-                            if self.debug_mode:
-                                print(f"[DEBUG] Sending AI response: {repr(ai_response)}")
-                            time.sleep(0.2)
-                            os.write(self.master_fd, ai_response.encode('utf-8'))
-                            self.recent_lines = []
+                        # 处理输出并检测提示（直接处理字节，不逐块解码）
+                        self.handle_child_output(data)
 
                     except OSError as e:
                         if self.debug_mode:
                             print(f"[DEBUG] OSError in read loop: {e}")
                         break
 
+                # 输出停顿：恢复完整检测
+                if not r and not w:
+                    self.on_idle()
+
             # 等待子进程结束
             self.update_state(self.STATE_EXITED)
             pid, status = os.waitpid(self.pid, 0)
@@ -647,9 +783,22 @@ class ClaudeCodeWrapperPTY:
             return 130
 
         finally:
+            if old_sigwinch is not None:
+                signal.signal(signal.SIGWINCH, old_sigwinch)
+            self.stop_analyzer()
+            if self.renderer is not None:
+                sys.stdout.buffer.write(self.renderer.finish())
+                sys.stdout.buffer.flush()
             # 恢复终端设置（仅在之前保存了设置时）
             if old_tty is not None:
                 termios.tcsetattr(sys.stdin, termios.TCSAFLUSH, old_tty)
+            self.profile.report(sys.stderr)
+            if self.latency_report or self.debug_mode:
+                self.echo_latency.report(sys.stderr)
+                if self.renderer is not None:
+                    sys.stderr.write(self.renderer.stats() + '\n')
+            if self.pattern_profile:
+                sys.stderr.write(format_report(all_matchers()) + '\n')
 
 def main():
     if len(sys.argv) < 2:
@@ -657,7 +806,9 @@ def main():
         sys.exit(1)
 
     timeout = int(os.environ.get('IZSH_AI_CONFIRM_TIMEOUT', 3))
-    wrapper = ClaudeCodeWrapperPTY(timeout=timeout)
+    profile = StartupProfile(_STARTUP_T0)
+    profile.mark('imports')
+    wrapper = ClaudeCodeWrapperPTY(timeout=timeout, profile=profile)
     exit_code = wrapper.run(sys.argv[1:])
     sys.exit(exit_code)
 
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Claude Code AI 自动确认包装器（结构化事件流版本）
+
+以机器可读的流式模式启动 Claude Code（--output-format stream-json，每行一个 JSON 事件），
+增量解析事件，不抓取屏幕文本：
+- 工具调用、文本输出、结果事件直接映射为 STATE_* 状态（查表，热路径上没有正则）
+- 权限请求交给 wrapper_engine 的 Decider 决策（不需要 PromptDetector / Injector）
+
+事件流中没有权限请求，权限检查走 Claude Code 的 --permission-prompt-tool：
+包装器监听一个 Unix 套接字，用 --mcp-config 注册 claude_permission_mcp.py（MCP stdio 服务），
+并指定 --permission-prompt-tool mcp__izsh__approve。Claude Code 需要确认工具调用时调用该工具，
+MCP 服务把 {"tool_name", "input"} 转发到套接字，包装器倒计时、决策后回答允许或拒绝。
+命令行已指定 --permission-prompt-tool 时不注册（由用户自己的工具决定）。
+
+子进程的 stdin 为 /dev/null（claude -p 从管道 stdin 读取到 EOF 才开始）。
+
+可用 fake_claude_stream.py 模拟子进程测试：
+  python3 claude_code_wrapper_stream.py python3 fake_claude_stream.py
+"""
+
+import json
+import os
+import select
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from claude_permission_mcp import PERMISSION_TOOL, SERVER_NAME
+from wrapper_engine import PROMPT_CONFIRM, Decider, Prompt, WrapperStates
+
+# 单个事件（一行 JSON）的最大字节数，超出的行整行丢弃
+MAX_EVENT_BYTES = 4 * 1024 * 1024
+
+# 每次从管道读取的最大字节数
+READ_SIZE = 65536
+
+# 流式模式参数（命令行已指定 --output-format 时不追加）
+STREAM_ARGS = ['--output-format', 'stream-json', '--verbose']
+
+# 权限请求的选项（Y 为允许）
+PERMISSION_OPTIONS = [('Y', 'allow'), ('n', 'deny')]
+PERMISSION_ALLOW = 'Y'
+
+# 权限确认 MCP 服务脚本
+PERMISSION_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'claude_permission_mcp.py')
+
+# 读取 MCP 服务发来的一行权限请求的超时（秒）
+PERMISSION_READ_TIMEOUT = 5
+
+# 工具名 -> 状态
+TOOL_STATES = {
+    'Read': WrapperStates.STATE_READING,
+    'Glob': WrapperStates.STATE_READING,
+    'LS': WrapperStates.STATE_READING,
+    'NotebookRead': WrapperStates.STATE_READING,
+    'Write': WrapperStates.STATE_WRITING,
+    'Edit': WrapperStates.STATE_WRITING,
+    'MultiEdit': WrapperStates.STATE_WRITING,
+    'NotebookEdit': WrapperStates.STATE_WRITING,
+    'Bash': WrapperStates.STATE_EXECUTING,
+    'BashOutput': WrapperStates.STATE_EXECUTING,
+    'Grep': WrapperStates.STATE_SEARCHING,
+    'WebSearch': WrapperStates.STATE_SEARCHING,
+    'WebFetch': WrapperStates.STATE_SEARCHING,
+}
+
+# 工具调用摘要中显示的参数（按优先级）
+TOOL_SUMMARY_KEYS = ('command', 'file_path', 'notebook_path', 'pattern', 'path', 'url', 'query', 'description')
+
+
+class EventStreamParser:
+    """增量 NDJSON 解析器：按字节块喂入，返回已完整的事件（dict）
+
+    只在换行处切分，json.loads 直接解析 bytes；无法解析或不是对象的行计入 malformed，
+    超过 max_event 字节仍未结束的行整行丢弃并计入 oversized。
+    """
+
+    def __init__(self, max_event=MAX_EVENT_BYTES):
+        self.max_event = max_event
+        self.buffer = bytearray()
+        self.skipping = False   # 正在丢弃超长行的剩余部分
+        self.events = 0
+        self.malformed = 0
+        self.oversized = 0
+
+    def feed(self, data):
+        if self.skipping:
+            end = data.find(b'\n')
+            if end < 0:
+                return []
+            data = data[end + 1:]
+            self.skipping = False
+
+        self.buffer += data
+        events = []
+        start = 0
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end < 0:
+                break
+            line = bytes(self.buffer[start:end])
+            start = end + 1
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                self.malformed += 1
+                continue
+            if not isinstance(event, dict):
+                self.malformed += 1
+                continue
+            events.append(event)
+        del self.buffer[:start]
+
+        if len(self.buffer) > self.max_event:
+            self.buffer.clear()
+            self.skipping = True
+            self.oversized += 1
+        self.events += len(events)
+        return events
+
+
+def has_option(command_args, name):
+    return any(arg == name or arg.startswith(name + '=') for arg in command_args)
+
+
+def stream_command(command_args, permission_args=()):
+    """在命令行后追加流式输出参数（已指定 --output-format 时不追加）和权限工具参数"""
+    command = list(command_args)
+    if not has_option(command, '--output-format'):
+        command += STREAM_ARGS
+    return command + list(permission_args)
+
+
+def content_blocks(event):
+    """assistant/user 事件中的内容块列表"""
+    message = event.get('message')
+    content = message.get('content') if isinstance(message, dict) else None
+    if isinstance(content, str):
+        return [{'type': 'text', 'text': content}]
+    return [block for block in content or () if isinstance(block, dict)]
+
+
+def event_state(event):
+    """事件 -> 状态（不改变状态返回 None）"""
+    kind = event.get('type')
+    if kind == 'assistant':
+        state = None
+        for block in content_blocks(event):
+            if block.get('type') == 'tool_use':
+                state = TOOL_STATES.get(block.get('name'), WrapperStates.STATE_EXECUTING)
+            elif block.get('type') in ('text', 'thinking') and state is None:
+                state = WrapperStates.STATE_THINKING
+        return state
+    if kind == 'user':
+        for block in content_blocks(event):
+            if block.get('type') == 'tool_result' and block.get('is_error'):
+                return WrapperStates.STATE_ERROR
+        return WrapperStates.STATE_THINKING
+    if kind == 'result':
+        if event.get('is_error') or event.get('subtype', 'success') != 'success':
+            return WrapperStates.STATE_ERROR
+        return WrapperStates.STATE_TASK_DONE
+    if kind == 'system' and event.get('subtype') == 'init':
+        return WrapperStates.STATE_MONITORING
+    return None
+
+
+def tool_summary(block):
+    """工具调用的一行摘要：Name(主要参数)"""
+    params = block.get('input') if isinstance(block.get('input'), dict) else {}
+    for key in TOOL_SUMMARY_KEYS:
+        value = params.get(key)
+        if isinstance(value, str) and value:
+            value = ' '.join(value.split())
+            if len(value) > 80:
+                value = value[:77] + '...'
+            return f"{block.get('name', '?')}({value})"
+    return f"{block.get('name', '?')}()"
+
+
+def permission_prompt(request):
+    """权限请求 {"tool_name", "input"} -> Prompt（问题中带上命令/文件等主要参数）"""
+    block = {'name': str(request.get('tool_name') or '?'), 'input': request.get('input')}
+    question = f"Allow {tool_summary(block)}?"
+    return Prompt(PROMPT_CONFIRM, question, PERMISSION_OPTIONS, None, question)
+
+
+class PermissionBridge:
+    """包装器一侧的权限通道：监听 Unix 套接字，接收 claude_permission_mcp.py 转发的请求"""
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix='izsh-perm-')
+        self.path = os.path.join(self.directory, 'permission.sock')
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(8)
+
+    def fileno(self):
+        return self.listener.fileno()
+
+    def command_args(self):
+        """注册 MCP 服务并指定权限工具的 Claude Code 参数"""
+        config = {'mcpServers': {SERVER_NAME: {
+            'command': sys.executable,
+            'args': [PERMISSION_SERVER],
+            'env': {'IZSH_PERMISSION_SOCKET': self.path},
+        }}}
+        return ['--mcp-config', json.dumps(config), '--permission-prompt-tool', PERMISSION_TOOL]
+
+    def accept(self):
+        """接受一个连接，返回 (连接, 请求)；请求无效时关闭连接并返回 (None, None)"""
+        conn, _ = self.listener.accept()
+        conn.settimeout(PERMISSION_READ_TIMEOUT)
+        try:
+            with conn.makefile('rb') as reader:
+                request = json.loads(reader.readline())
+            if isinstance(request, dict):
+                return conn, request
+        except (OSError, ValueError):
+            pass
+        conn.close()
+        return None, None
+
+    @staticmethod
+    def reply(conn, allow, message=''):
+        try:
+            conn.sendall(json.dumps({'allow': allow, 'message': message}).encode('utf-8') + b'\n')
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self.listener.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class ClaudeCodeWrapperStream(WrapperStates):
+    def __init__(self, timeout=3):
+        self.timeout = timeout
+        self.process = None
+        self.decider = Decider(timeout)
+        self.parser = EventStreamParser()
+        self.bridge = None
+        self.current_state = self.STATE_STARTING
+        self.countdown_elapsed = 0.0  # 最近一次决策的倒计时耗时（写入决策日志）
+        self.exit_result = None       # 最后一个 result 事件
+        # 调试模式：原样输出无法识别的事件
+        self.debug_mode = os.environ.get('IZSH_DEBUG_MODE', '0') == '1'
+        # 状态指示器默认启用，显示在终端标题栏
+        self.show_indicator = os.environ.get('IZSH_SHOW_INDICATOR', '1') == '1'
+
+    def update_state(self, new_state, countdown=0):
+        """更新状态并显示在终端标题栏"""
+        self.current_state = new_state
+        if self.show_indicator:
+            sys.stderr.write(f"\033]0;Claude Code - {self.indicator(new_state, countdown)}\007")
+            sys.stderr.flush()
+
+    def handle_event(self, event):
+        """显示事件并更新状态；权限请求在此决策"""
+        state = event_state(event)
+        if state:
+            self.update_state(state)
+
+        kind = event.get('type')
+        if kind == 'assistant':
+            for block in content_blocks(event):
+                if block.get('type') == 'text' and block.get('text'):
+                    print(block['text'])
+                elif block.get('type') == 'tool_use':
+                    print(f"⏺ {tool_summary(block)}")
+        elif kind == 'user':
+            for block in content_blocks(event):
+                if block.get('type') == 'tool_result' and block.get('is_error'):
+                    text = block.get('content')
+                    text = text if isinstance(text, str) else json.dumps(text, ensure_ascii=False)
+                    print(f"  ⎿ ❌ {text.strip().splitlines()[0] if text.strip() else 'error'}")
+        elif kind == 'result':
+            self.exit_result = event
+            if isinstance(event.get('result'), str) and event['result'].strip():
+                print(event['result'])
+            cost = event.get('total_cost_usd')
+            duration = event.get('duration_ms')
+            details = [f"{event.get('num_turns', 0)} turns"]
+            if isinstance(duration, (int, float)):
+                details.append(f"{duration / 1000:.1f}s")
+            if isinstance(cost, (int, float)):
+                details.append(f"${cost:.4f}")
+            mark = '❌' if state == self.STATE_ERROR else '✨'
+            print(f"{mark} {event.get('subtype', 'done')} ({', '.join(details)})")
+        elif kind != 'system' and self.debug_mode:
+            print(f"[DEBUG] event: {json.dumps(event, ensure_ascii=False)[:200]}")
+
+    def handle_permission(self, request):
+        """权限请求：倒计时后由 AI 决策（倒计时内用户输入合法选项则采用用户的选择），返回选项键"""
+        self.update_state(self.STATE_WAITING_CONFIRM)
+        prompt = permission_prompt(request)
+        keys = '/'.join(key for key, _ in prompt.options)
+        print(f"\n⏰ {prompt.question} [{keys}] 倒计时 {self.timeout} 秒...")
+
+        choice = self.countdown(prompt)
+        if choice:
+            from decision_log import SOURCE_USER
+            self.decider.record(prompt, choice, SOURCE_USER, 0.0, self.countdown_elapsed)
+            print(f"👤 用户选择: {choice}")
+        else:
+            self.update_state(self.STATE_AI_EXECUTING)
+            choice = self.decider.decide(prompt, self.countdown_elapsed)
+            if self.decider.ai_skipped:
+                self.update_state(self.STATE_AI_UNAVAILABLE)
+                print(f"⛔ AI 后端熔断中，使用默认选项: {choice}")
+            elif self.decider.reused:
+                self.update_state(self.STATE_AI_SELECTED)
+                print(f"♻️ 复用相似提示的决策: {choice}")
+            else:
+                self.update_state(self.STATE_AI_SELECTED)
+                print(f"✅ AI 自动选择: {choice}")
+
+        self.update_state(self.STATE_MONITORING)
+        return choice
+
+    def serve_permission(self):
+        """处理一个权限连接：决策后回答 MCP 服务"""
+        conn, request = self.bridge.accept()
+        if conn is None:
+            return
+        choice = self.handle_permission(request)
+        allow = choice == PERMISSION_ALLOW
+        self.bridge.reply(conn, allow, '' if allow else 'Denied by the iZsh wrapper')
+
+    def countdown(self, prompt):
+        """倒计时；终端上输入合法选项并回车时返回该选项，否则返回 None"""
+        interactive = sys.stdin.isatty()
+        start = time.monotonic()
+        try:
+            if self.decider.breaker_open():
+                self.update_state(self.STATE_AI_UNAVAILABLE)
+            else:
+                self.update_state(self.STATE_AI_ANALYZING)
+            for i in range(self.timeout, 0, -1):
+                self.update_state(self.STATE_COUNTDOWN, i)
+                if not interactive:
+                    time.sleep(1)
+                    continue
+                ready, _, _ = select.select([sys.stdin], [], [], 1)
+                if ready:
+                    from ai_decision import match_option
+                    choice = match_option(sys.stdin.readline(), prompt.options)
+                    if choice:
+                        return choice
+            return None
+        finally:
+            self.countdown_elapsed = time.monotonic() - start
+
+    def run(self, command_args):
+        """运行 Claude Code（流式模式）并处理事件"""
+        print("🤖 AI 自动确认模式已启用（结构化事件流）")
+        print(f"提示：权限请求将在 {self.timeout} 秒后自动由 AI 选择")
+        print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+        print("")
+
+        try:
+            permission_args = []
+            if not has_option(command_args, '--permission-prompt-tool'):
+                self.bridge = PermissionBridge()
+                permission_args = self.bridge.command_args()
+            self.process = subprocess.Popen(
+                stream_command(command_args, permission_args),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+            )
+            fd = self.process.stdout.fileno()
+            sources = [fd] + ([self.bridge] if self.bridge else [])
+            while True:
+                ready, _, _ = select.select(sources, [], [])
+                # 先显示已输出的事件（工具调用），再处理它的权限请求
+                if fd in ready:
+                    data = os.read(fd, READ_SIZE)
+                    if not data:
+                        break
+                    for event in self.parser.feed(data):
+                        self.handle_event(event)
+                if self.bridge in ready:
+                    self.serve_permission()
+
+            exit_code = self.process.wait()
+            self.update_state(self.STATE_EXITED)
+            if self.parser.malformed or self.parser.oversized:
+                print(f"⚠️ 忽略了 {self.parser.malformed} 行无效事件、{self.parser.oversized} 行超长事件",
+                      file=sys.stderr)
+            if exit_code == 0 and self.exit_result and self.exit_result.get('is_error'):
+                return 1
+            return exit_code
+
+        except KeyboardInterrupt:
+            print("\n⚠️ 用户中断")
+            if self.process:
+                self.process.terminate()
+            return 130
+
+        except OSError as e:
+            print(f"❌ 错误: {e}", file=sys.stderr)
+            return 1
+
+        finally:
+            if self.bridge:
+                self.bridge.close()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: claude_code_wrapper_stream.py <claude 命令及参数>")
+        print("示例: claude_code_wrapper_stream.py claude -p \"修复测试\"")
+        sys.exit(1)
+
+    timeout = int(os.environ.get('IZSH_AI_CONFIRM_TIMEOUT', 3))
+    wrapper = ClaudeCodeWrapperStream(timeout=timeout)
+    sys.exit(wrapper.run(sys.argv[1:]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Claude Code 权限确认工具（MCP stdio 服务）
+
+claude -p --output-format stream-json 的事件流中没有权限请求事件；需要确认的工具调用
+由 --permission-prompt-tool 指定的 MCP 工具决定。claude_code_wrapper_stream.py 启动
+Claude Code 时通过 --mcp-config 注册本服务，并指定 --permission-prompt-tool mcp__izsh__approve：
+
+- Claude Code 以子进程启动本服务，在 stdin/stdout 上按行交换 JSON-RPC 2.0 消息
+- 每次权限检查调用 approve 工具，参数为 {"tool_name", "input", "tool_use_id"}
+- 本服务把请求转发到包装器监听的 Unix 套接字（IZSH_PERMISSION_SOCKET），
+  等待包装器倒计时、AI 决策后的回答 {"allow": true/false, "message": "..."}
+- 工具结果为一段 JSON 文本：{"behavior": "allow", "updatedInput": {...}}
+  或 {"behavior": "deny", "message": "..."}
+
+连接不上包装器或等待超时（IZSH_PERMISSION_TIMEOUT 秒，默认 600）时拒绝。
+"""
+
+import json
+import os
+import socket
+import sys
+
+SERVER_NAME = 'izsh'
+TOOL_NAME = 'approve'
+
+# Claude Code 中的工具全名（--permission-prompt-tool 的参数）
+PERMISSION_TOOL = f"mcp__{SERVER_NAME}__{TOOL_NAME}"
+
+DEFAULT_PROTOCOL_VERSION = '2024-11-05'
+DEFAULT_TIMEOUT = 600
+
+TOOL_SCHEMA = {
+    'name': TOOL_NAME,
+    'description': 'Ask the iZsh wrapper whether a tool call is allowed',
+    'inputSchema': {
+        'type': 'object',
+        'properties': {
+            'tool_name': {'type': 'string'},
+            'input': {'type': 'object'},
+            'tool_use_id': {'type': 'string'},
+        },
+        'required': ['tool_name', 'input'],
+    },
+}
+
+
+def ask_wrapper(request, path=None, timeout=None):
+    """把权限请求发给包装器，返回 (是否允许, 说明)"""
+    path = path or os.environ.get('IZSH_PERMISSION_SOCKET')
+    timeout = timeout or float(os.environ.get('IZSH_PERMISSION_TIMEOUT', DEFAULT_TIMEOUT))
+    if not path:
+        return False, 'iZsh wrapper socket is not configured'
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(timeout)
+            conn.connect(path)
+            conn.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+            with conn.makefile('rb') as reader:
+                reply = json.loads(reader.readline() or b'{}')
+    except (OSError, ValueError) as e:
+        return False, f'iZsh wrapper unavailable: {e}'
+    return bool(reply.get('allow')), str(reply.get('message') or '')
+
+
+def permission_result(arguments):
+    """approve 工具调用 -> 工具结果"""
+    tool_input = arguments.get('input') if isinstance(arguments.get('input'), dict) else {}
+    allow, message = ask_wrapper({
+        'tool_name': str(arguments.get('tool_name') or ''),
+        'input': tool_input,
+        'tool_use_id': str(arguments.get('tool_use_id') or ''),
+    })
+    if allow:
+        decision = {'behavior': 'allow', 'updatedInput': tool_input}
+    else:
+        decision = {'behavior': 'deny', 'message': message or 'Denied by the iZsh wrapper'}
+    return {'content': [{'type': 'text', 'text': json.dumps(decision, ensure_ascii=False)}]}
+
+
+def handle(message):
+    """处理一条 JSON-RPC 消息，返回响应（通知返回 None）"""
+    method = message.get('method')
+    if 'id' not in message:
+        return None
+    params = message.get('params') or {}
+    if method == 'initialize':
+        result = {
+            'protocolVersion': params.get('protocolVersion') or DEFAULT_PROTOCOL_VERSION,
+            'capabilities': {'tools': {}},
+            'serverInfo': {'name': SERVER_NAME, 'version': '1.0'},
+        }
+    elif method == 'tools/list':
+        result = {'tools': [TOOL_SCHEMA]}
+    elif method == 'tools/call' and params.get('name') == TOOL_NAME:
+        result = permission_result(params.get('arguments') or {})
+    elif method == 'ping':
+        result = {}
+    else:
+        return {'jsonrpc': '2.0', 'id': message['id'],
+                'error': {'code': -32601, 'message': f'Method not found: {method}'}}
+    return {'jsonrpc': '2.0', 'id': message['id'], 'result': result}
+
+
+def main():
+    for line in sys.stdin:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(message, dict):
+            continue
+        response = handle(message)
+        if response is not None:
+            sys.stdout.write(json.dumps(response, ensure_ascii=False) + '\n')
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+相似提示的决策复用（最近邻索引）
+
+精确匹配复用不了只在文件名、行数、命令参数上不同的提示。这里把提示（问题 + 选项文本）的词分为三类：
+- 套话：BOILERPLATE 常用词表中的词（do you want to proceed、yes、don't ask again ...），只参与模糊匹配
+- 槽位：允许泛化的相对路径和数字，替换为 <path.扩展名> / <num>
+- 具体内容：其余的词（可执行程序、子命令、选项、操作符、不允许泛化的路径和数字），必须逐词完全相同
+
+槽位的安全规则：
+- 工具类别：提示按 TOOL_COMMAND（bash/run/execute）、TOOL_FILE（edit/write/create/read/file）、
+  TOOL_PROMPT（其他）分类，类别是分区键的一部分；各类别允许的槽位见 TOOL_SLOTS
+  （TOOL_PROMPT 只泛化数字，例如 fetch 的域名不会泛化）
+- 命令提示中的可执行程序（第一个具体词、| && ; 之后的词、解释器和 env/xargs 等包装命令之后的词，
+  以及 ./ 开头或脚本扩展名的路径）永远原样比较，不同程序的提示不会共用回答
+- 提示中出现 UNSAFE_WORDS（rm、kill、delete、overwrite、--force、push、curl ...）时不使用任何槽位，
+  管道接到 shell（| sh）时同样如此
+- 只有相对路径可以泛化：不以 / ~ $ 开头、不含 .. 和 URL；隐藏文件和目录（.env、.git/、.ssh/）、
+  SENSITIVE_NAMES 和 SENSITIVE_EXTENSIONS（id_rsa、*.pem ...）原样比较；扩展名保留在槽位中，
+  批准编辑 .py 文件不会复用到 .bak 或 .sh 文件
+
+新提示只在选项键序列、工具类别和具体内容（含槽位）都相同的历史提示中查找，把套话编码为
+哈希字符 n-gram 的二值向量，余弦相似度达到阈值时直接复用其回答（决策来源 SOURCE_CACHE），否则调用 AI。
+
+- 去重：同一分区中套话相同的提示只保留一个向量（回答取最近一次）
+- 向量为 DIMS 位的二值位图。有 NumPy 时每个分区是一个按列存放的 uint8 位矩阵（每列一个提示），
+  查找只取查询向量非零的字节行做按位与和 popcount，扫描分区中最近加入的 MAX_SCAN_NUMPY 条；
+  没有 NumPy 时存为整数位图逐条计算，只扫描最近加入的 MAX_SCAN 条。更早的条目不参与查找；
+  分区按具体内容划分，通常只有几条，10 万条决策分散在各分区时查找约 30~50 微秒
+
+索引在进程内由决策日志（decision_log）中的 AI 决策后台构建，构建完成前的查找直接返回 None。
+n-gram 哈希使用进程内的 hash()，索引不持久化。
+
+环境变量：
+- IZSH_DECISION_REUSE=0               关闭
+- IZSH_DECISION_REUSE_THRESHOLD       相似度阈值（默认 0.9）
+- IZSH_DECISION_REUSE_MAX             索引的最大提示数（默认 100000，超出后不再加入）
+"""
+
+import os
+import re
+import threading
+
+from decision_log import MAX_PROMPT_BYTES, SOURCE_AI, iter_records, prompt_text
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 向量维度（n-gram 哈希桶数）
+DIMS = 4096
+
+# 每个向量的字节数（NumPy 矩阵的行数）
+BYTES = DIMS // 8
+
+# 字符 n-gram 长度
+NGRAM = 3
+
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_MAX_ENTRIES = 100000
+
+# 每次查找最多扫描的条数（分区中最近加入的）：没有 NumPy 时 / 有 NumPy 时（两者都在 1 毫秒左右）
+MAX_SCAN = 2000
+MAX_SCAN_NUMPY = 20000
+
+# 词尾去掉的标点；词首不去掉 .（./run.sh、.env 的点属于路径）
+PUNCTUATION = '.,:;!?()[]{}"\'`'
+LEADING_PUNCTUATION = PUNCTUATION.replace('.', '')
+
+# 提示中的常用词：只参与模糊匹配，其余的词（命令、路径、参数、数字）必须完全相同或按槽位泛化
+BOILERPLATE = frozenset("""
+    a an the this that these those it its to of for in on at by with from into as and or
+    not no yes y n ok okay cancel continue proceed abort skip allow deny approve reject
+    accept do does you your want would like wish should we i me my be is are will can
+    please again ask don't dont never always ever all any every time times session
+    option options command commands file files directory folder edit edits change changes
+    make run execute create write read delete remove overwrite update apply confirm
+    tell claude what differently how instead bash tool use using following below above
+    shortcuts esc tab enter select choose press
+""".split())
+
+# 工具类别（分区键的一部分）和各类别允许的槽位
+TOOL_COMMAND = 'command'
+TOOL_FILE = 'file'
+TOOL_PROMPT = 'prompt'
+
+SLOT_PATH = 'path'
+SLOT_NUMBER = 'num'
+
+TOOL_SLOTS = {
+    TOOL_COMMAND: {SLOT_PATH, SLOT_NUMBER},
+    TOOL_FILE: {SLOT_PATH, SLOT_NUMBER},
+    TOOL_PROMPT: {SLOT_NUMBER},
+}
+
+COMMAND_WORDS = frozenset({'bash', 'command', 'commands', 'run', 'execute', 'shell'})
+FILE_WORDS = frozenset({'edit', 'edits', 'write', 'create', 'read', 'file', 'files', 'directory', 'folder',
+                        'overwrite'})
+
+# 出现时整条提示不使用槽位：破坏性操作、强制选项、发布和访问网络
+UNSAFE_WORDS = frozenset("""
+    rm rmdir unlink shred dd mkfs kill killall pkill chmod chown chgrp mv truncate sudo su doas
+    reboot shutdown halt wipe erase purge drop destroy delete remove overwrite uninstall reset
+    revert clean prune force --force -f -rf -fr --hard --no-verify push publish deploy release
+    curl wget ssh scp rsync sftp ftp nc ncat telnet eval exec
+""".split())
+
+# 命令提示中的操作符（之后的词是新的可执行程序）
+OPERATORS = frozenset({'|', '||', '&&', ';', '&', '$(', '`'})
+
+# 之后的词（脚本或被包装的命令）也按可执行程序原样比较
+COMMAND_PREFIXES = frozenset("""
+    python python2 python3 node deno bun ruby perl php bash sh zsh fish source . npx uvx pipx
+    env nohup nice timeout time xargs watch
+""".split())
+
+SHELLS = frozenset({'sh', 'bash', 'zsh', 'fish', 'python', 'python3', 'node', 'perl', 'ruby'})
+
+SENSITIVE_NAMES = frozenset({'id_rsa', 'id_dsa', 'id_ecdsa', 'id_ed25519', 'authorized_keys', 'known_hosts',
+                             'credentials', 'passwd', 'shadow', 'sudoers'})
+SENSITIVE_EXTENSIONS = frozenset({'.pem', '.key', '.p12', '.pfx', '.keystore', '.kdbx'})
+
+# 命令提示中作为可执行文件的路径（./ 开头或脚本扩展名）原样比较
+SCRIPT_EXTENSIONS = frozenset({'.sh', '.bash', '.zsh', '.command', '.ps1', '.bat', '.cmd', '.exe'})
+
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+PATH = re.compile(r'[\w.@+-]+(?:/[\w.@+-]*)*')
+FILE_NAME = re.compile(r'[\w.@+-]*\w\.[A-Za-z0-9]{1,8}')
+
+
+def reuse_enabled():
+    return os.environ.get('IZSH_DECISION_REUSE', '1') == '1'
+
+
+def words(question, options):
+    """提示的词（小写），返回 (问题部分的词, 选项文本的词)
+
+    问题部分与决策日志记录的提示文本相同（prompt_text，截断到 MAX_PROMPT_BYTES），
+    从日志加载的历史提示和实时提示得到相同的词。
+    """
+    prompt = prompt_text(question, options).encode('utf-8')[:MAX_PROMPT_BYTES].decode('utf-8', errors='ignore')
+    option_text = ' '.join(text for _, text in options if text)
+    return prompt.lower().split(), option_text.lower().split()
+
+
+def strip_word(word):
+    """去掉词首尾的标点（词首的 . 保留），只由标点组成的词（| && >）原样保留"""
+    return word.lstrip(LEADING_PUNCTUATION).rstrip(PUNCTUATION) or word
+
+
+def tool_class(boilerplate):
+    """由提示中的套话判断工具类别"""
+    if COMMAND_WORDS.intersection(boilerplate):
+        return TOOL_COMMAND
+    if FILE_WORDS.intersection(boilerplate):
+        return TOOL_FILE
+    return TOOL_PROMPT
+
+
+def unsafe(tokens):
+    """提示是否含破坏性、强制或网络操作（或管道接到 shell），此时不使用槽位"""
+    previous = None
+    for token in tokens:
+        if token in UNSAFE_WORDS or (previous == '|' and token in SHELLS):
+            return True
+        previous = token
+    return False
+
+
+def path_slot(token):
+    """可泛化的相对路径 -> <path.扩展名>，其他返回 None"""
+    if '://' in token or token.startswith(('/', '~', '$', '-')) or not PATH.fullmatch(token):
+        return None
+    if '/' not in token and not FILE_NAME.fullmatch(token):
+        return None
+    parts = [part for part in token.split('/') if part]
+    if not parts or any(part == '..' or (part.startswith('.') and part != '.') for part in parts):
+        return None
+    name = parts[-1]
+    extension = os.path.splitext(name)[1] if not token.endswith('/') else ''
+    if name in SENSITIVE_NAMES or extension in SENSITIVE_EXTENSIONS:
+        return None
+    return f"<path{extension}>"
+
+
+def slot(token, tool, allowed):
+    """按允许的槽位泛化一个词，不能泛化时返回 None"""
+    if SLOT_NUMBER in allowed and NUMBER.fullmatch(token):
+        return '<num>'
+    if SLOT_PATH not in allowed:
+        return None
+    if tool == TOOL_COMMAND and (token.startswith('./') or os.path.splitext(token)[1] in SCRIPT_EXTENSIONS):
+        return None
+    return path_slot(token)
+
+
+def split_prompt(question, options):
+    """拆分提示，返回 (工具类别, 具体内容元组, 套话文本)
+
+    首尾标点去掉后在 BOILERPLATE 中的词是套话，其余是具体内容；具体内容中的相对路径和数字
+    按模块说明中的安全规则替换为槽位，可执行程序和其余的词原样保留。
+    """
+    parts = []
+    for part in words(question, options):
+        tokens, boilerplate = [], []
+        for word in part:
+            stripped = strip_word(word)
+            (boilerplate if stripped in BOILERPLATE else tokens).append(stripped)
+        parts.append((tokens, boilerplate))
+    (prompt_tokens, prompt_boilerplate), (option_tokens, option_boilerplate) = parts
+    boilerplate = prompt_boilerplate + option_boilerplate
+    # 工具类别只看问题部分（Claude Code 的选项文本总含 "don't ask again for this command"）
+    tool = tool_class(prompt_boilerplate)
+    allowed = set() if unsafe(prompt_tokens + option_tokens + boilerplate) else TOOL_SLOTS[tool]
+
+    specifics = []
+    command_position = tool == TOOL_COMMAND
+    for i, token in enumerate(prompt_tokens + option_tokens):
+        if i == len(prompt_tokens):
+            # 选项文本中没有可执行程序的位置
+            command_position = False
+        if token in OPERATORS:
+            specifics.append(token)
+            command_position = tool == TOOL_COMMAND
+            continue
+        if command_position:
+            # 可执行程序原样保留；解释器和包装命令之后（跳过选项）仍是可执行程序
+            specifics.append(token)
+            command_position = token in COMMAND_PREFIXES or token.startswith('-')
+            continue
+        specifics.append(slot(token, tool, allowed) or token)
+    return tool, tuple(specifics), ' '.join(boilerplate)
+
+
+def partition_key(options, tool, specifics):
+    """分区键：选项键序列 + 工具类别 + 具体内容（含槽位）"""
+    return tuple(key for key, _ in options), tool, specifics
+
+
+def ngram_buckets(text):
+    """文本中出现的哈希 n-gram 桶（二值特征，重复出现不加权）"""
+    padded = f" {text} "
+    return {hash(padded[i:i + NGRAM]) % DIMS for i in range(max(1, len(padded) - NGRAM + 1))}
+
+
+def bitset(text):
+    """二值向量的整数位图表示和 1/范数（相似度为 popcount(a & b) 乘以两者的 1/范数）"""
+    bits = 0
+    for bucket in ngram_buckets(text):
+        bits |= 1 << bucket
+    return bits, bits.bit_count() ** -0.5
+
+
+def packed(bits):
+    """整数位图 -> BYTES 个 uint8（需要 NumPy）"""
+    return np.frombuffer(bits.to_bytes(BYTES, 'little'), dtype=np.uint8)
+
+
+def column_popcounts(matrix):
+    """uint8 矩阵每列置位的个数（NumPy 2 的 bitwise_count，较早的版本用 unpackbits）"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(matrix).sum(axis=0, dtype=np.int64)
+    return np.unpackbits(matrix, axis=0).sum(axis=0, dtype=np.int64)
+
+
+class Partition:
+    """选项键序列、工具类别和具体内容都相同的一组提示"""
+
+    def __init__(self):
+        self.rows = {}       # 套话文本 -> 行号
+        self.answers = []    # 行号 -> 回答
+        if np is not None:
+            self.matrix = np.zeros((BYTES, 4), dtype=np.uint8)   # 每列一个提示
+            self.norms = np.zeros(4, dtype=np.float64)           # 行号 -> 1/范数
+        else:
+            self.vectors = []    # 行号 -> (位图, 1/范数)
+
+    def __len__(self):
+        return len(self.answers)
+
+    def add(self, text, answer):
+        row = self.rows.get(text)
+        if row is not None:
+            self.answers[row] = answer
+            return False
+        row = len(self.answers)
+        self.rows[text] = row
+        self.answers.append(answer)
+        bits, norm = bitset(text)
+        if np is not None:
+            if row == len(self.norms):
+                self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)], axis=1)
+                self.norms = np.concatenate([self.norms, np.zeros_like(self.norms)])
+            self.matrix[:, row] = packed(bits)
+            self.norms[row] = norm
+        else:
+            self.vectors.append((bits, norm))
+        return True
+
+    def nearest(self, text):
+        """最相似的 (回答, 相似度)；相似度相同时取最近加入的"""
+        row = self.rows.get(text)
+        if row is not None:
+            return self.answers[row], 1.0
+        if not self.answers:
+            return None, 0.0
+
+        query, query_norm = bitset(text)
+        if np is not None:
+            count = len(self.answers)
+            start = max(0, count - MAX_SCAN_NUMPY)
+            query = packed(query)
+            rows = np.flatnonzero(query)
+            block = self.matrix[rows, start:count] & query[rows, None]
+            scores = column_popcounts(block) * self.norms[start:count]
+            best_row = count - 1 - int(scores[::-1].argmax())
+            return self.answers[best_row], float(scores[best_row - start]) * query_norm
+
+        best_row, best = None, 0.0
+        start = max(0, len(self.vectors) - MAX_SCAN)
+        for row in range(len(self.vectors) - 1, start - 1, -1):
+            bits, norm = self.vectors[row]
+            score = (bits & query).bit_count() * norm
+            if score > best:
+                best_row, best = row, score
+        if best_row is None:
+            return None, 0.0
+        return self.answers[best_row], best * query_norm
+
+
+class DecisionIndex:
+    """按选项键序列、工具类别和具体内容分区的最近邻决策索引"""
+
+    def __init__(self, threshold=None, max_entries=None):
+        self.threshold = threshold or float(os.environ.get('IZSH_DECISION_REUSE_THRESHOLD', DEFAULT_THRESHOLD))
+        self.max_entries = max_entries or int(os.environ.get('IZSH_DECISION_REUSE_MAX', DEFAULT_MAX_ENTRIES))
+        self.partitions = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, question, options, answer):
+        """记录一次有效决策"""
+        if not options or not answer:
+            return
+        tool, specifics, text = split_prompt(question, options)
+        key = partition_key(options, tool, specifics)
+        with self.lock:
+            partition = self.partitions.get(key)
+            if partition is None:
+                if self.size >= self.max_entries:
+                    return
+                partition = self.partitions[key] = Partition()
+            elif self.size >= self.max_entries and text not in partition.rows:
+                return
+            if partition.add(text, answer):
+                self.size += 1
+
+    def lookup(self, question, options):
+        """返回可复用的 (回答, 相似度)，没有足够相似的历史决策（或索引未就绪）返回 None"""
+        if not options or not self.ready.is_set():
+            return None
+        tool, specifics, text = split_prompt(question, options)
+        with self.lock:
+            partition = self.partitions.get(partition_key(options, tool, specifics))
+            answer, score = partition.nearest(text) if partition else (None, 0.0)
+            if answer is not None and score >= self.threshold:
+                self.hits += 1
+                return answer, score
+            self.misses += 1
+            return None
+
+    def load(self, directory=None):
+        """从决策日志加入历史 AI 决策"""
+        try:
+            for record in iter_records(directory):
+                if record.source == SOURCE_AI and record.answer:
+                    self.add(record.prompt, record.options, record.answer)
+        except OSError:
+            pass
+        finally:
+            self.ready.set()
+
+    def load_async(self, directory=None):
+        threading.Thread(target=self.load, args=(directory,), daemon=True).start()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': self.size,
+                'partitions': len(self.partitions),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """进程内共享的索引（首次调用时后台从决策日志构建），关闭时返回 None"""
+    global _index
+    if not reuse_enabled():
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = DecisionIndex()
+            _index.load_async()
+        return _index
@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""
+自动决策日志（只追加、按大小轮转的分段文件）
+
+每个包装器进程写自己的分段文件（文件名含创建时间和 PID），无需跨进程加锁：
+- <时间>-<PID>.seg：决策记录，定长头部（struct）+ 提示文本、选项、回答
+- <时间>-<PID>.idx：定长索引项（时间、会话、提示哈希、记录偏移、延迟、倒计时、来源、标志、回答前缀）
+
+统计和扫描只需 mmap 索引文件并用 struct.iter_unpack 解码，不必解析变长记录；
+需要文本时再按偏移从分段文件读取。分段超过上限时轮转，总大小超过上限时删除最旧的分段。
+
+索引文件头标明格式：IZDIDX2（当前，带回答前缀）；IZDIDX1（旧格式，没有回答前缀）仍可读取，
+其索引项的回答前缀为 None。
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+# 日志位置和默认限制（可通过环境变量覆盖）
+LOG_DIR = Path.home() / ".izsh" / "decisions"
+DEFAULT_SEGMENT_BYTES = 8 * 1024 * 1024     # 8 MB
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024       # 256 MB
+
+SEGMENT_MAGIC = b'IZDLOG1\n'
+INDEX_MAGIC = b'IZDIDX2\n'
+INDEX_MAGIC_V1 = b'IZDIDX1\n'
+
+# 记录头：时间、会话、提示哈希、决策延迟(ms)、倒计时(ms)、来源、选项数、提示/选项/回答的字节长度
+RECORD = struct.Struct('<dQQffBBHHH')
+
+# 索引项：时间、会话、提示哈希、记录偏移、决策延迟(ms)、倒计时(ms)、来源、标志、回答前缀
+INDEX = struct.Struct('<dQQIffBB4s')
+
+# 旧格式（IZDIDX1）的索引项：没有回答前缀
+INDEX_V1 = struct.Struct('<dQQIffBB2x')
+
+# 索引项字段位置（iter_index 产出原始元组，按位置访问比命名元组快）
+I_TS, I_SESSION, I_HASH, I_OFFSET, I_LATENCY, I_COUNTDOWN, I_SOURCE, I_FLAGS, I_ANSWER = range(9)
+
+# 标志位：回答是第一个选项（默认项）
+FLAG_DEFAULT_ANSWER = 0x01
+
+# 决策来源
+SOURCE_AI = 1        # AI 回答
+SOURCE_DEFAULT = 2   # AI 失败或回答无效，使用默认选项
+SOURCE_USER = 3      # 用户在倒计时期间手动响应
+SOURCE_CACHE = 4     # 复用历史决策
+SOURCE_RULE = 5      # 规则直接回答
+
+SOURCE_NAMES = {
+    SOURCE_AI: 'ai',
+    SOURCE_DEFAULT: 'default',
+    SOURCE_USER: 'user',
+    SOURCE_CACHE: 'cache',
+    SOURCE_RULE: 'rule',
+}
+
+# 文本字段的最大字节数
+MAX_PROMPT_BYTES = 200
+MAX_OPTIONS_BYTES = 1000
+MAX_ANSWER_BYTES = 100
+
+DecisionRecord = namedtuple('DecisionRecord', [
+    'ts', 'session', 'prompt_hash', 'latency_ms', 'countdown_ms', 'source',
+    'prompt', 'options', 'answer',
+])
+
+
+def log_enabled():
+    """是否记录决策（IZSH_DECISION_LOG=0 关闭）"""
+    return os.environ.get('IZSH_DECISION_LOG', '1') != '0'
+
+
+def log_dir():
+    return Path(os.environ.get('IZSH_DECISION_LOG_DIR', LOG_DIR))
+
+
+def new_session_id():
+    return int.from_bytes(os.urandom(8), 'little')
+
+
+def prompt_text(question, options):
+    """用于展示和统计的提示文本：有问题文本时用问题，否则用选项列表（菜单）"""
+    if question and question.strip():
+        return ' '.join(question.split())
+    return ' / '.join(f"{key}) {text}" if text else key for key, text in options)
+
+
+def prompt_hash(question, options):
+    """提示哈希：问题文本 + 选项（相同的提示得到相同的哈希）"""
+    h = hashlib.blake2b(digest_size=8)
+    h.update(' '.join((question or '').split()).encode('utf-8'))
+    for key, text in options:
+        h.update(b'\x1e' + key.encode('utf-8') + b'\x1f' + text.encode('utf-8'))
+    return int.from_bytes(h.digest(), 'little')
+
+
+def encode_options(options):
+    return '\x1e'.join(f"{key}\x1f{text}" for key, text in options).encode('utf-8')[:MAX_OPTIONS_BYTES]
+
+
+def decode_options(data):
+    options = []
+    for item in data.decode('utf-8', errors='replace').split('\x1e'):
+        if item:
+            key, _, text = item.partition('\x1f')
+            options.append((key, text))
+    return options
+
+
+def _truncate(text, limit):
+    return text.encode('utf-8')[:limit].decode('utf-8', errors='ignore').encode('utf-8')
+
+
+class DecisionLog:
+    """决策日志写入端（每个进程一个会话、一组分段文件）"""
+
+    def __init__(self, directory=None, session=None, segment_bytes=None, max_bytes=None):
+        self.directory = Path(directory) if directory else log_dir()
+        self.session = session if session is not None else new_session_id()
+        self.segment_bytes = segment_bytes if segment_bytes is not None else int(
+            float(os.environ.get('IZSH_DECISION_LOG_SEGMENT_MB', DEFAULT_SEGMENT_BYTES / 1024 / 1024))
+            * 1024 * 1024)
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            float(os.environ.get('IZSH_DECISION_LOG_MAX_MB', DEFAULT_MAX_BYTES / 1024 / 1024))
+            * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.seg_fd = self.idx_fd = None
+        self.seg_size = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def record(self, question, options, answer, source, latency=0.0, countdown=0.0):
+        """追加一条决策记录（latency、countdown 单位为秒）"""
+        prompt = _truncate(prompt_text(question, options), MAX_PROMPT_BYTES)
+        opts = encode_options(options)
+        answer_bytes = _truncate(answer or '', MAX_ANSWER_BYTES)
+        flags = FLAG_DEFAULT_ANSWER if options and answer == options[0][0] else 0
+        ts = time.time()
+        digest = prompt_hash(question, options)
+
+        header = RECORD.pack(ts, self.session, digest, latency * 1000, countdown * 1000, source,
+                             min(len(options), 255), len(prompt), len(opts), len(answer_bytes))
+        data = header + prompt + opts + answer_bytes
+
+        with self.lock:
+            if self.seg_fd is None or self.seg_size + len(data) > self.segment_bytes:
+                self._rotate()
+            offset = self.seg_size
+            os.write(self.seg_fd, data)
+            self.seg_size += len(data)
+            # 先写记录再写索引：索引项指向的记录总是完整的
+            os.write(self.idx_fd, INDEX.pack(ts, self.session, digest, offset, latency * 1000,
+                                             countdown * 1000, source, flags, answer_bytes[:4]))
+
+    def _rotate(self):
+        """开始新的分段，并在总大小超限时删除最旧的分段"""
+        self.close()
+        base = self.directory / f"{time.time_ns():020d}-{os.getpid()}"
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        self.seg_fd = os.open(f"{base}.seg", flags, 0o600)
+        self.idx_fd = os.open(f"{base}.idx", flags, 0o600)
+        os.write(self.seg_fd, SEGMENT_MAGIC)
+        os.write(self.idx_fd, INDEX_MAGIC)
+        self.seg_size = len(SEGMENT_MAGIC)
+        prune(self.directory, self.max_bytes)
+
+    def close(self):
+        for fd in (self.seg_fd, self.idx_fd):
+            if fd is not None:
+                os.close(fd)
+        self.seg_fd = self.idx_fd = None
+
+
+def list_segments(directory=None):
+    """按时间顺序返回 [(分段文件, 索引文件)]"""
+    directory = Path(directory) if directory else log_dir()
+    if not directory.is_dir():
+        return []
+    segments = []
+    for seg in sorted(directory.glob('*.seg')):
+        idx = seg.with_suffix('.idx')
+        if idx.exists():
+            segments.append((seg, idx))
+    return segments
+
+
+def prune(directory, max_bytes):
+    """总大小超过上限时删除最旧的分段（至少保留最新的一个）"""
+    segments = list_segments(directory)
+    sizes = []
+    for seg, idx in segments:
+        try:
+            sizes.append(seg.stat().st_size + idx.stat().st_size)
+        except OSError:
+            sizes.append(0)
+    total = sum(sizes)
+    for (seg, idx), size in zip(segments[:-1], sizes):
+        if total <= max_bytes:
+            break
+        for path in (seg, idx):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        total -= size
+
+
+def _map(path):
+    """只读 mmap 文件，空文件返回 None"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def index_span(mm):
+    """按文件头确定索引格式，返回 (struct, 起始位置, 结束位置)；无法识别的文件返回 None
+
+    只包含完整的索引项（写入中的最后一项可能不完整）。
+    """
+    start = len(INDEX_MAGIC)
+    magic = mm[:start]
+    if magic == INDEX_MAGIC:
+        layout = INDEX
+    elif magic == INDEX_MAGIC_V1:
+        layout = INDEX_V1
+    else:
+        return None
+    return layout, start, start + (len(mm) - start) // layout.size * layout.size
+
+
+def index_entries(idx, since=None, session=None):
+    """流式产出一个索引文件中的索引项原始元组（字段位置见 I_*，旧格式的回答前缀为 None）"""
+    try:
+        mm = _map(idx)
+    except OSError:
+        return
+    if mm is None:
+        return
+    try:
+        span = index_span(mm)
+        if span is None:
+            return
+        layout, start, end = span
+        if end <= start:
+            return
+        if since is not None and layout.unpack_from(mm, end - layout.size)[I_TS] < since:
+            return
+        for entry in layout.iter_unpack(memoryview(mm)[start:end]):
+            if since is not None and entry[I_TS] < since:
+                continue
+            if session is not None and entry[I_SESSION] != session:
+                continue
+            yield entry if layout is INDEX else entry + (None,)
+    finally:
+        mm.close()
+
+
+def iter_index(directory=None, since=None, session=None):
+    """流式产出所有分段的索引项原始元组，可按起始时间和会话过滤"""
+    for _, idx in list_segments(directory):
+        yield from index_entries(idx, since, session)
+
+
+def read_record(mm, offset):
+    """从分段文件的 mmap 中按偏移解码一条记录"""
+    (ts, session, digest, latency, countdown, source, _,
+     prompt_len, options_len, answer_len) = RECORD.unpack_from(mm, offset)
+    pos = offset + RECORD.size
+    prompt = mm[pos:pos + prompt_len].decode('utf-8', errors='replace')
+    pos += prompt_len
+    options = decode_options(mm[pos:pos + options_len])
+    pos += options_len
+    answer = mm[pos:pos + answer_len].decode('utf-8', errors='replace')
+    return DecisionRecord(ts, session, digest, latency, countdown, source, prompt, options, answer)
+
+
+def read_record_at(seg, offset):
+    """从分段文件读取一条记录"""
+    mm = _map(seg)
+    try:
+        return read_record(mm, offset)
+    finally:
+        mm.close()
+
+
+def iter_records(directory=None, since=None, session=None):
+    """流式产出完整的决策记录（按索引定位，可按起始时间和会话过滤）"""
+    for seg, idx in list_segments(directory):
+        try:
+            seg_mm = _map(seg)
+            idx_mm = _map(idx)
+        except OSError:
+            continue
+        if seg_mm is None or idx_mm is None:
+            continue
+        try:
+            span = index_span(idx_mm)
+            if span is None:
+                continue
+            layout, start, end = span
+            for entry in layout.iter_unpack(memoryview(idx_mm)[start:end]):
+                if since is not None and entry[I_TS] < since:
+                    continue
+                if session is not None and entry[I_SESSION] != session:
+                    continue
+                if entry[I_OFFSET] + RECORD.size > len(seg_mm):
+                    break
+                yield read_record(seg_mm, entry[I_OFFSET])
+        finally:
+            seg_mm.close()
+            idx_mm.close()
+
+
+def tail_records(count, directory=None):
+    """最近的 count 条记录（从最新的分段向前读取）"""
+    records = []
+    for seg, idx in reversed(list_segments(directory)):
+        try:
+            seg_mm = _map(seg)
+            idx_mm = _map(idx)
+        except OSError:
+            continue
+        if seg_mm is None or idx_mm is None:
+            continue
+        try:
+            span = index_span(idx_mm)
+            if span is None:
+                continue
+            layout, start, end = span
+            entries = list(layout.iter_unpack(memoryview(idx_mm)[start:end]))
+            for entry in reversed(entries[-(count - len(records)):]):
+                if entry[I_OFFSET] + RECORD.size <= len(seg_mm):
+                    records.append(read_record(seg_mm, entry[I_OFFSET]))
+        finally:
+            seg_mm.close()
+            idx_mm.close()
+        if len(records) >= count:
+            break
+    return list(reversed(records))
+
+
+def parse_since(value):
+    """把 '30m'、'12h'、'7d' 之类的时长转换为起始时间戳，无法解析时抛出 ValueError"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    value = value.strip()
+    if value and value[-1] in units:
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    return time.time() - float(value)
+
+
+def aggregate(directory=None, since=None):
+    """只扫描索引的汇总统计"""
+    count = 0
+    by_source = {}
+    sessions = set()
+    latency_total = countdown_total = 0.0
+    first = last = None
+    for entry in iter_index(directory, since):
+        count += 1
+        by_source[entry[I_SOURCE]] = by_source.get(entry[I_SOURCE], 0) + 1
+        sessions.add(entry[I_SESSION])
+        latency_total += entry[I_LATENCY]
+        countdown_total += entry[I_COUNTDOWN]
+        if first is None or entry[I_TS] < first:
+            first = entry[I_TS]
+        if last is None or entry[I_TS] > last:
+            last = entry[I_TS]
+    return {
+        'records': count,
+        'sessions': len(sessions),
+        'by_source': {SOURCE_NAMES.get(k, str(k)): v for k, v in sorted(by_source.items())},
+        'mean_latency_ms': latency_total / count if count else 0.0,
+        'countdown_s': countdown_total / 1000,
+        'first': first,
+        'last': last,
+        'segments': len(list_segments(directory)),
+    }
+
+
+_log = None
+
+
+def get_log():
+    """获取进程内共享的决策日志，禁用或打开失败时返回 None"""
+    global _log
+    if not log_enabled():
+        return None
+    if _log is None:
+        try:
+            _log = DecisionLog()
+        except OSError:
+            return None
+    return _log
+
+
+def log_decision(question, options, answer, source, latency=0.0, countdown=0.0):
+    """记录一次决策；日志不可用或写入失败时静默忽略（不影响包装器）"""
+    log = get_log()
+    if log is None:
+        return
+    try:
+        log.record(question, options, answer, source, latency, countdown)
+    except OSError:
+        pass
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图：内存固定，分位数相对误差约 2%，适合流式统计海量记录"""
+
+    GROWTH = 1.02
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._log_growth = math.log(self.GROWTH)
+
+    def add(self, value):
+        bucket = int(math.log1p(max(value, 0.0)) / self._log_growth)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """第 p 百分位（取桶的上界，不超过最大值）"""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(math.expm1((bucket + 1) * self._log_growth), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+def build_report(directory=None, since=None, top=10):
+    """流式扫描索引生成分析报告：延迟分位数、倒计时耗时、高频提示、可由缓存/规则回答的比例
+
+    - 规则可回答：AI 的回答就是默认（第一个）选项
+    - 缓存可回答：同一提示此前出现过且 AI 给出了相同回答
+    """
+    latency = LatencyHistogram()
+    by_source = {}
+    sessions = set()
+    prompt_counts = {}
+    prompt_location = {}   # 提示哈希 -> (分段文件, 偏移)，用于读取提示文本
+    last_answer = {}       # 提示哈希 -> 最近一次回答
+    countdown_total = 0.0
+    countdown_default = 0.0
+    records = ai_decisions = rule_hits = cache_hits = either_hits = 0
+    first = last = None
+
+    for seg, idx in list_segments(directory):
+        for entry in index_entries(idx, since):
+            records += 1
+            ts = entry[I_TS]
+            if first is None or ts < first:
+                first = ts
+            if last is None or ts > last:
+                last = ts
+            source = entry[I_SOURCE]
+            by_source[source] = by_source.get(source, 0) + 1
+            sessions.add(entry[I_SESSION])
+            countdown_total += entry[I_COUNTDOWN]
+
+            digest = entry[I_HASH]
+            prompt_counts[digest] = prompt_counts.get(digest, 0) + 1
+            if digest not in prompt_location:
+                prompt_location[digest] = (seg, entry[I_OFFSET])
+
+            if source == SOURCE_USER:
+                continue
+            latency.add(entry[I_LATENCY])
+            is_default = bool(entry[I_FLAGS] & FLAG_DEFAULT_ANSWER)
+            if is_default:
+                countdown_default += entry[I_COUNTDOWN]
+            if source == SOURCE_AI:
+                ai_decisions += 1
+                # 旧格式索引没有回答前缀（None），不计入缓存可回答
+                previous = last_answer.get(digest)
+                cached = previous is not None and previous == entry[I_ANSWER]
+                rule_hits += is_default
+                cache_hits += cached
+                either_hits += is_default or cached
+            last_answer[digest] = entry[I_ANSWER]
+
+    top_prompts = []
+    for digest, count in sorted(prompt_counts.items(), key=lambda item: item[1], reverse=True)[:top]:
+        seg, offset = prompt_location[digest]
+        try:
+            text = read_record_at(seg, offset).prompt
+        except (OSError, struct.error, ValueError):
+            text = ''
+        top_prompts.append({'prompt': text, 'hash': f"{digest:016x}", 'count': count})
+
+    def fraction(n):
+        return n / ai_decisions if ai_decisions else 0.0
+
+    return {
+        'records': records,
+        'sessions': len(sessions),
+        'first': first,
+        'last': last,
+        'by_source': {SOURCE_NAMES.get(k, str(k)): v for k, v in sorted(by_source.items())},
+        'latency_ms': {
+            'mean': latency.mean,
+            'p50': latency.percentile(50),
+            'p95': latency.percentile(95),
+            'p99': latency.percentile(99),
+            'max': latency.max,
+        },
+        'countdown_s': {
+            'total': countdown_total / 1000,
+            'mean': countdown_total / 1000 / records if records else 0.0,
+            'on_default_answers': countdown_default / 1000,
+        },
+        'answerable': {
+            'ai_decisions': ai_decisions,
+            'rule': fraction(rule_hits),
+            'cache': fraction(cache_hits),
+            'rule_or_cache': fraction(either_hits),
+        },
+        'top_prompts': top_prompts,
+    }
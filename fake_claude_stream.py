@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+模拟 Claude Code 的结构化事件流（用于测试 claude_code_wrapper_stream.py）
+
+按脚本逐行输出 JSON 事件，权限检查与 claude -p 相同：assistant 事件中需要确认的工具调用
+（ASK_TOOLS）在输出其工具结果之前，调用 --permission-prompt-tool 指定的 MCP 工具
+（按 --mcp-config 启动对应的 MCP stdio 服务，JSON-RPC 2.0）。没有指定权限工具时直接拒绝。
+拒绝时该工具调用的结果标记为错误。其他命令行参数（--output-format 等）忽略。
+
+脚本来源：
+- IZSH_FAKE_STREAM 指向的 NDJSON 文件，每行一个事件；可选字段 "delay"（秒）在输出前等待，
+  输出前会被移除；不是 JSON 的行原样输出（用于测试包装器对无效事件的容错）
+- 未指定时使用内置场景（读文件、编辑、执行命令、结果）
+
+权限结果写到 stderr（"permission <tool_use_id> -> allow|deny"）。
+"""
+
+import copy
+import json
+import os
+import subprocess
+import sys
+import time
+
+SESSION_ID = 'fake-session'
+
+# 内置场景
+DEFAULT_SCRIPT = [
+    {'type': 'system', 'subtype': 'init', 'session_id': SESSION_ID, 'model': 'fake',
+     'tools': ['Read', 'Edit', 'Bash']},
+    {'type': 'assistant', 'delay': 0.2,
+     'message': {'content': [{'type': 'text', 'text': 'Let me look at the failing test first.'}]}},
+    {'type': 'assistant', 'delay': 0.1,
+     'message': {'content': [{'type': 'tool_use', 'id': 'tu1', 'name': 'Read',
+                              'input': {'file_path': 'tests/test_parser.py'}}]}},
+    {'type': 'user', 'delay': 0.1,
+     'message': {'content': [{'type': 'tool_result', 'tool_use_id': 'tu1', 'content': 'def test_parse(): ...'}]}},
+    {'type': 'assistant', 'delay': 0.1,
+     'message': {'content': [{'type': 'tool_use', 'id': 'tu2', 'name': 'Edit',
+                              'input': {'file_path': 'src/parser.py'}}]}},
+    {'type': 'user', 'delay': 0.1,
+     'message': {'content': [{'type': 'tool_result', 'tool_use_id': 'tu2', 'content': 'ok'}]}},
+    {'type': 'assistant', 'delay': 0.1,
+     'message': {'content': [{'type': 'tool_use', 'id': 'tu3', 'name': 'Bash',
+                              'input': {'command': 'pytest -q'}}]}},
+    {'type': 'user', 'delay': 0.3,
+     'message': {'content': [{'type': 'tool_result', 'tool_use_id': 'tu3', 'content': '12 passed'}]}},
+    {'type': 'result', 'subtype': 'success', 'is_error': False, 'num_turns': 4,
+     'duration_ms': 1200, 'total_cost_usd': 0.0123, 'session_id': SESSION_ID,
+     'result': 'Fixed the off-by-one in the parser; all tests pass.'},
+]
+
+# 需要权限确认的工具
+ASK_TOOLS = ('Edit', 'Write', 'MultiEdit', 'NotebookEdit', 'Bash', 'WebFetch')
+
+
+def option_value(args, name):
+    for i, arg in enumerate(args):
+        if arg == name and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith(name + '='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+class PermissionTool:
+    """按 --mcp-config 启动 MCP 服务，通过 JSON-RPC 调用权限工具"""
+
+    def __init__(self, config, tool):
+        _, server, self.tool = tool.split('__', 2)
+        if not config.lstrip().startswith('{'):
+            with open(config) as f:
+                config = f.read()
+        spec = json.loads(config)['mcpServers'][server]
+        self.process = subprocess.Popen(
+            [spec['command']] + list(spec.get('args', [])),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            env={**os.environ, **spec.get('env', {})},
+        )
+        self.next_id = 0
+        self.request('initialize', {'protocolVersion': '2024-11-05', 'capabilities': {},
+                                    'clientInfo': {'name': 'fake-claude', 'version': '0'}})
+        self.notify('notifications/initialized')
+        tools = [t['name'] for t in self.request('tools/list')['tools']]
+        if self.tool not in tools:
+            raise RuntimeError(f"permission tool {self.tool} not found in {tools}")
+
+    def notify(self, method, params=None):
+        self.process.stdin.write(json.dumps({'jsonrpc': '2.0', 'method': method, 'params': params or {}}) + '\n')
+        self.process.stdin.flush()
+
+    def request(self, method, params=None):
+        self.next_id += 1
+        self.process.stdin.write(json.dumps({'jsonrpc': '2.0', 'id': self.next_id, 'method': method,
+                                             'params': params or {}}) + '\n')
+        self.process.stdin.flush()
+        response = json.loads(self.process.stdout.readline())
+        if 'error' in response:
+            raise RuntimeError(response['error'].get('message'))
+        return response['result']
+
+    def check(self, block):
+        """返回 (是否允许, 说明)"""
+        result = self.request('tools/call', {'name': self.tool, 'arguments': {
+            'tool_name': block.get('name'), 'input': block.get('input', {}), 'tool_use_id': block.get('id')}})
+        decision = json.loads(result['content'][0]['text'])
+        return decision.get('behavior') == 'allow', decision.get('message', '')
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def load_script():
+    path = os.environ.get('IZSH_FAKE_STREAM')
+    if not path:
+        return DEFAULT_SCRIPT
+    script = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                script.append(json.loads(line))
+            except ValueError:
+                script.append(line.rstrip('\n'))
+    return script
+
+
+def emit(event):
+    sys.stdout.write(json.dumps(event, ensure_ascii=False) + '\n')
+    sys.stdout.flush()
+
+
+def main():
+    args = sys.argv[1:]
+    tool = option_value(args, '--permission-prompt-tool')
+    permission = PermissionTool(option_value(args, '--mcp-config'), tool) if tool else None
+    denied = {}   # tool_use_id -> 说明
+    try:
+        for event in load_script():
+            if not isinstance(event, dict):
+                sys.stdout.write(f"{event}\n")
+                sys.stdout.flush()
+                continue
+            event = copy.deepcopy(event)
+            time.sleep(event.pop('delay', 0))
+            if event.get('type') == 'user':
+                for block in event.get('message', {}).get('content', []):
+                    if block.get('type') == 'tool_result' and block.get('tool_use_id') in denied:
+                        block['is_error'] = True
+                        block['content'] = denied.pop(block['tool_use_id'])
+            emit(event)
+            if event.get('type') != 'assistant':
+                continue
+            for block in event.get('message', {}).get('content', []):
+                if block.get('type') != 'tool_use' or block.get('name') not in ASK_TOOLS:
+                    continue
+                allow, message = permission.check(block) if permission else (False, 'no permission prompt tool')
+                print(f"permission {block.get('id')} -> {'allow' if allow else 'deny'}", file=sys.stderr)
+                if not allow:
+                    denied[block.get('id')] = message or 'Permission denied'
+    finally:
+        if permission:
+            permission.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,743 @@
+#!/usr/bin/env python3
+"""
+丢帧式终端渲染器（慢速终端 / 高延迟 SSH）
+
+把子进程的 PTY 输出应用到内部屏幕模型上，按限定的刷新率只绘制最新一帧与上次绘制内容的差异：
+- 子进程的转圈动画、进度条重绘再快，两次绘制之间被覆盖的中间帧都直接丢弃
+- 每帧只重绘发生变化的行（绝对定位 + 行尾清除），输出量上限为一屏
+- 滚出屏幕顶部的行会在下一帧先绘制到终端再滚入回滚区，终端的历史记录不丢失（单帧最多
+  SCROLLBACK_LIMIT 行，超出的计入 dropped_lines）
+- 影响终端行为的模式切换（应用光标键、括号粘贴、鼠标、键盘模式、标题等）按原顺序转发
+- 光标位置查询（CSI 6n）由屏幕模型直接回答，通过 take_replies() 取出后写回子进程
+
+屏幕模型只实现 Claude Code（Ink）等 TUI 常用的控制序列：光标移动、擦除、插入/删除行和字符、
+滚动区域、SGR 属性、备用屏幕、自动换行；CJK 宽字符按两列处理。
+"""
+
+import codecs
+import re
+import threading
+import time
+import unicodedata
+
+# 默认刷新率（帧/秒）
+DEFAULT_FPS = 20
+
+# 单帧最多补画到回滚区的行数
+SCROLLBACK_LIMIT = 2000
+
+# 文本中需要逐个处理的字符：C0 控制字符、ESC、DEL、C1 CSI
+SPECIAL = re.compile(r'[\x00-\x1f\x7f\x9b]')
+
+# 未完成转义序列的最大保留长度
+MAX_PENDING_ESCAPE = 65536
+
+# 需要转发给终端的 DEC 私有模式（其余由屏幕模型处理或忽略）
+FORWARD_MODES = {
+    1,                                   # 应用光标键
+    9, 1000, 1001, 1002, 1003, 1004,     # 鼠标、焦点事件
+    1005, 1006, 1015, 1016,              # 鼠标编码
+    2004,                                # 括号粘贴
+}
+
+# 备用屏幕
+ALT_SCREEN_MODES = {47, 1047, 1049}
+
+SGR_FLAGS = {1, 2, 3, 4, 5, 7, 8, 9}
+SGR_RESETS = {21: (1,), 22: (1, 2), 23: (3,), 24: (4,), 25: (5,), 27: (7,), 28: (8,), 29: (9,)}
+
+
+def char_width(ch):
+    """字符占用的列数：组合字符 0，东亚宽字符 2，其余 1"""
+    if ch.isascii():
+        return 1
+    if unicodedata.combining(ch):
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+
+
+class Attr:
+    """当前 SGR 状态，canonical() 生成与单元格一起保存的规范化参数串"""
+
+    __slots__ = ('flags', 'fg', 'bg')
+
+    def __init__(self):
+        self.flags = set()
+        self.fg = ''
+        self.bg = ''
+
+    def apply(self, params):
+        if not params:
+            params = ['0']
+        i = 0
+        while i < len(params):
+            param = params[i]
+            i += 1
+            if ':' in param:
+                # 冒号形式的扩展颜色（38:2::r:g:b）或下划线样式，整体保留
+                head = param.split(':', 1)[0]
+                if head == '38':
+                    self.fg = param
+                elif head == '48':
+                    self.bg = param
+                elif head == '4':
+                    self.flags.add(4)
+                continue
+            code = int(param) if param.isdigit() else 0
+            if code == 0:
+                self.flags.clear()
+                self.fg = self.bg = ''
+            elif code in SGR_FLAGS:
+                self.flags.add(code)
+            elif code in SGR_RESETS:
+                self.flags.difference_update(SGR_RESETS[code])
+            elif 30 <= code <= 37 or 90 <= code <= 97:
+                self.fg = str(code)
+            elif 40 <= code <= 47 or 100 <= code <= 107:
+                self.bg = str(code)
+            elif code == 39:
+                self.fg = ''
+            elif code == 49:
+                self.bg = ''
+            elif code in (38, 48):
+                # 38;5;n / 38;2;r;g;b
+                if i < len(params) and params[i] == '5':
+                    value = ';'.join([str(code)] + params[i:i + 2])
+                    i += 2
+                elif i < len(params) and params[i] == '2':
+                    value = ';'.join([str(code)] + params[i:i + 4])
+                    i += 4
+                else:
+                    continue
+                if code == 38:
+                    self.fg = value
+                else:
+                    self.bg = value
+
+    def canonical(self):
+        parts = [str(flag) for flag in sorted(self.flags)]
+        if self.fg:
+            parts.append(self.fg)
+        if self.bg:
+            parts.append(self.bg)
+        return ';'.join(parts)
+
+
+class Buffer:
+    """一个屏幕缓冲区（主屏幕或备用屏幕）"""
+
+    def __init__(self, cols, rows):
+        self.cols = cols
+        self.rows = rows
+        self.chars = [[' '] * cols for _ in range(rows)]
+        self.attrs = [[''] * cols for _ in range(rows)]
+
+    def blank_row(self, attr=''):
+        return [' '] * self.cols, [attr] * self.cols
+
+    def resize(self, cols, rows):
+        for y in range(len(self.chars)):
+            if cols > self.cols:
+                self.chars[y].extend([' '] * (cols - self.cols))
+                self.attrs[y].extend([''] * (cols - self.cols))
+            else:
+                del self.chars[y][cols:]
+                del self.attrs[y][cols:]
+        self.cols = cols
+        if rows < self.rows:
+            # 保留底部内容（光标通常在底部）
+            del self.chars[:self.rows - rows]
+            del self.attrs[:self.rows - rows]
+        else:
+            for _ in range(rows - self.rows):
+                chars, attrs = self.blank_row()
+                self.chars.append(chars)
+                self.attrs.append(attrs)
+        self.rows = rows
+
+
+class FrameRenderer:
+    """屏幕模型 + 限速差量绘制"""
+
+    def __init__(self, cols, rows, fps=DEFAULT_FPS):
+        self.cols = max(cols, 1)
+        self.rows = max(rows, 1)
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.lock = threading.Lock()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.main = Buffer(self.cols, self.rows)
+        self.alt = None
+        self.screen = self.main
+        self.attr = Attr()
+        self.attr_key = ''
+        self.x = self.y = 0
+        self.wrap_pending = False
+        self.autowrap = True
+        self.cursor_visible = True
+        self.saved = (0, 0, '')
+        self.top, self.bottom = 0, self.rows - 1
+        self.pending = ''            # 未完成的转义序列
+        self.forward = []            # 待转发给终端的模式切换（按到达顺序）
+        self.replies = []            # 待写回子进程的应答
+        self.scrolled = []           # 滚出屏幕顶部、尚未绘制的行
+        self.dirty = set(range(self.rows))
+        self.painted = [None] * self.rows
+        self.changed = True
+        self.last_paint = 0.0
+        # 统计
+        self.frames = 0
+        self.fed_bytes = 0
+        self.painted_bytes = 0
+        self.dropped_lines = 0
+
+    # ---------- 输入 ----------
+
+    def feed(self, data):
+        """应用一段子进程输出（bytes）"""
+        with self.lock:
+            self.fed_bytes += len(data)
+            text = self.pending + self.decoder.decode(data)
+            self.pending = ''
+            self.changed = True
+            self._process(text)
+
+    def take_replies(self):
+        """取出需要写回子进程的应答（bytes）"""
+        with self.lock:
+            replies, self.replies = self.replies, []
+        return ''.join(replies).encode('utf-8')
+
+    def _process(self, text):
+        i = 0
+        n = len(text)
+        while i < n:
+            match = SPECIAL.search(text, i)
+            end = match.start() if match else n
+            if end > i:
+                self._print(text[i:end])
+                i = end
+                if not match:
+                    break
+            ch = text[i]
+            if ch == '\x1b' or ch == '\x9b':
+                consumed = self._escape(text, i)
+                if consumed is None:
+                    # 转义序列不完整，留到下次（未结束的字符串序列过长时丢弃）
+                    if n - i <= MAX_PENDING_ESCAPE:
+                        self.pending = text[i:]
+                    return
+                i = consumed
+            else:
+                self._control(ch)
+                i += 1
+
+    def _control(self, ch):
+        if ch == '\r':
+            self.x = 0
+            self.wrap_pending = False
+        elif ch in '\n\x0b\x0c':
+            self._linefeed()
+        elif ch == '\b':
+            if self.x > 0:
+                self.x -= 1
+            self.wrap_pending = False
+        elif ch == '\t':
+            self.x = min((self.x // 8 + 1) * 8, self.cols - 1)
+        elif ch == '\x07':
+            self.forward.append(ch)
+
+    def _print(self, text):
+        screen = self.screen
+        attr = self.attr_key
+        if text.isascii():
+            while text:
+                if self.wrap_pending:
+                    self._wrap()
+                row_chars = screen.chars[self.y]
+                row_attrs = screen.attrs[self.y]
+                take = text[:self.cols - self.x]
+                end = self.x + len(take)
+                self._split_wide(row_chars, self.x, end)
+                row_chars[self.x:end] = take
+                row_attrs[self.x:end] = [attr] * len(take)
+                self.dirty.add(self.y)
+                text = text[len(take):]
+                if end >= self.cols:
+                    self.x = self.cols - 1
+                    self.wrap_pending = self.autowrap
+                else:
+                    self.x = end
+            return
+
+        for ch in text:
+            width = char_width(ch)
+            if width == 0:
+                # 组合字符附加到前一个单元格
+                x = self.x - 1 if not self.wrap_pending else self.x
+                if x > 0 and screen.chars[self.y][x] == '':
+                    x -= 1
+                if x >= 0:
+                    screen.chars[self.y][x] += ch
+                    self.dirty.add(self.y)
+                continue
+            if self.wrap_pending:
+                self._wrap()
+            if width > self.cols:
+                width = 1
+            if width == 2 and self.x == self.cols - 1:
+                # 宽字符放不下，先换行
+                screen.chars[self.y][self.x] = ' '
+                if not self.autowrap:
+                    continue
+                self._wrap()
+            row_chars = screen.chars[self.y]
+            row_attrs = screen.attrs[self.y]
+            self._split_wide(row_chars, self.x, self.x + width)
+            row_chars[self.x] = ch
+            row_attrs[self.x] = attr
+            if width == 2:
+                row_chars[self.x + 1] = ''
+                row_attrs[self.x + 1] = attr
+            self.dirty.add(self.y)
+            end = self.x + width
+            if end >= self.cols:
+                self.x = self.cols - 1
+                self.wrap_pending = self.autowrap
+            else:
+                self.x = end
+
+    def _split_wide(self, chars, start, end):
+        """覆盖 [start, end) 前，把被切开的宽字符的另一半替换为空格"""
+        if 0 < start < self.cols and chars[start] == '':
+            chars[start - 1] = ' '
+        if end < self.cols and chars[end] == '':
+            chars[end] = ' '
+
+    def _wrap(self):
+        self.wrap_pending = False
+        self.x = 0
+        self._linefeed()
+
+    def _linefeed(self):
+        self.wrap_pending = False
+        if self.y == self.bottom:
+            self._scroll_up(1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+
+    def _scroll_up(self, count):
+        screen = self.screen
+        count = min(count, self.bottom - self.top + 1)
+        capture = screen is self.main and self.top == 0 and self.bottom == self.rows - 1
+        for _ in range(count):
+            chars = screen.chars.pop(self.top)
+            attrs = screen.attrs.pop(self.top)
+            if capture:
+                if len(self.scrolled) < SCROLLBACK_LIMIT:
+                    self.scrolled.append((chars, attrs))
+                else:
+                    self.dropped_lines += 1
+            chars, attrs = screen.blank_row(self._erase_attr())
+            screen.chars.insert(self.bottom, chars)
+            screen.attrs.insert(self.bottom, attrs)
+        self.dirty.update(range(self.top, self.bottom + 1))
+
+    def _scroll_down(self, count):
+        screen = self.screen
+        count = min(count, self.bottom - self.top + 1)
+        for _ in range(count):
+            del screen.chars[self.bottom]
+            del screen.attrs[self.bottom]
+            chars, attrs = screen.blank_row(self._erase_attr())
+            screen.chars.insert(self.top, chars)
+            screen.attrs.insert(self.top, attrs)
+        self.dirty.update(range(self.top, self.bottom + 1))
+
+    def _erase_attr(self):
+        """擦除时使用的属性：只保留背景色"""
+        return f"{self.attr.bg}" if self.attr.bg else ''
+
+    def _erase(self, y, start, end):
+        attr = self._erase_attr()
+        chars = self.screen.chars[y]
+        attrs = self.screen.attrs[y]
+        # 擦除宽字符的一半时整个字符变为空格
+        if start > 0 and chars[start] == '':
+            start -= 1
+        if end < self.cols and chars[end] == '':
+            end += 1
+        chars[start:end] = [' '] * (end - start)
+        attrs[start:end] = [attr] * (end - start)
+        self.dirty.add(y)
+
+    def _escape(self, text, i):
+        """处理从 i 开始的转义序列，返回序列之后的位置；不完整时返回 None"""
+        if text[i] == '\x9b':
+            return self._csi(text, i + 1)
+        if i + 1 >= len(text):
+            return None
+        kind = text[i + 1]
+        if kind == '[':
+            return self._csi(text, i + 2)
+        if kind == ']':
+            return self._string(text, i + 2, osc=True)
+        if kind in 'PX^_':
+            return self._string(text, i + 2, osc=False)
+        if kind in '()*+-./#%':
+            # 字符集选择等带一个参数字符的序列
+            return i + 3 if i + 2 < len(text) else None
+        if kind == '7':
+            self.saved = (self.x, self.y, self.attr_key)
+        elif kind == '8':
+            self._restore_cursor()
+        elif kind == 'D':
+            self._linefeed()
+        elif kind == 'E':
+            self.x = 0
+            self._linefeed()
+        elif kind == 'M':
+            self.wrap_pending = False
+            if self.y == self.top:
+                self._scroll_down(1)
+            elif self.y > 0:
+                self.y -= 1
+        elif kind == 'c':
+            self._reset()
+        elif kind in '=>':
+            self.forward.append(text[i:i + 2])
+        return i + 2
+
+    def _string(self, text, start, osc):
+        """OSC / DCS 等字符串序列：以 BEL 或 ESC \\ 结束；OSC 0/1/2（标题）转发，其余丢弃"""
+        end = start
+        while True:
+            bel = text.find('\x07', end)
+            st = text.find('\x1b\\', end)
+            if bel < 0 and st < 0:
+                return None
+            if st < 0 or (0 <= bel < st):
+                stop, after = bel, bel + 1
+            else:
+                stop, after = st, st + 2
+            body = text[start:stop]
+            if osc and body.split(';', 1)[0] in ('0', '1', '2'):
+                self.forward.append(text[start - 2:after])
+            return after
+
+    def _csi(self, text, start):
+        j = start
+        n = len(text)
+        while j < n and not ('\x40' <= text[j] <= '\x7e'):
+            j += 1
+        if j >= n:
+            return None
+        final = text[j]
+        body = text[start:j]
+        prefix = ''
+        if body and body[0] in '?>=<':
+            prefix, body = body[0], body[1:]
+        intermediate = ''
+        while body and '\x20' <= body[-1] <= '\x2f':
+            intermediate = body[-1] + intermediate
+            body = body[:-1]
+        params = body.split(';') if body else []
+        raw = text[start - (2 if text[start - 1] == '[' else 1):j + 1]
+        self._dispatch(final, prefix, intermediate, params, raw)
+        return j + 1
+
+    def _num(self, params, index=0, default=1):
+        try:
+            value = int(params[index].split(':', 1)[0])
+        except (IndexError, ValueError):
+            return default
+        return value if value > 0 else default
+
+    def _dispatch(self, final, prefix, intermediate, params, raw):
+        if intermediate:
+            # 光标形状（DECSCUSR）和模式查询（DECRQM）交给真实终端
+            if (final, intermediate) in (('q', ' '), ('p', '$')):
+                self.forward.append(raw)
+            return
+        if prefix == '?' and final in 'hl':
+            self._private_mode(params, final == 'h', raw)
+            return
+        if prefix:
+            # 设备属性查询等交给真实终端回答
+            if final in 'cmnpqu':
+                self.forward.append(raw)
+            return
+
+        if final == 'm':
+            self.attr.apply(params)
+            self.attr_key = self.attr.canonical()
+            return
+
+        self.wrap_pending = False
+        rows, cols = self.rows, self.cols
+        if final == 'A':
+            self.y = max(self.top if self.y >= self.top else 0, self.y - self._num(params))
+        elif final in 'Be':
+            self.y = min(self.bottom if self.y <= self.bottom else rows - 1, self.y + self._num(params))
+        elif final in 'Ca':
+            self.x = min(cols - 1, self.x + self._num(params))
+        elif final == 'D':
+            self.x = max(0, self.x - self._num(params))
+        elif final == 'E':
+            self.y = min(self.bottom, self.y + self._num(params))
+            self.x = 0
+        elif final == 'F':
+            self.y = max(self.top, self.y - self._num(params))
+            self.x = 0
+        elif final in 'G`':
+            self.x = min(cols - 1, self._num(params) - 1)
+        elif final == 'd':
+            self.y = min(rows - 1, self._num(params) - 1)
+        elif final in 'Hf':
+            self.y = min(rows - 1, self._num(params, 0) - 1)
+            self.x = min(cols - 1, self._num(params, 1) - 1)
+        elif final == 'J':
+            mode = self._num(params, default=0) if params else 0
+            if mode == 0:
+                self._erase(self.y, self.x, cols)
+                for y in range(self.y + 1, rows):
+                    self._erase(y, 0, cols)
+            elif mode == 1:
+                for y in range(self.y):
+                    self._erase(y, 0, cols)
+                self._erase(self.y, 0, self.x + 1)
+            elif mode in (2, 3):
+                for y in range(rows):
+                    self._erase(y, 0, cols)
+        elif final == 'K':
+            mode = self._num(params, default=0) if params else 0
+            if mode == 0:
+                self._erase(self.y, self.x, cols)
+            elif mode == 1:
+                self._erase(self.y, 0, self.x + 1)
+            elif mode == 2:
+                self._erase(self.y, 0, cols)
+        elif final == 'X':
+            self._erase(self.y, self.x, min(cols, self.x + self._num(params)))
+        elif final in 'LM':
+            if self.top <= self.y <= self.bottom:
+                top = self.top
+                self.top = self.y
+                if final == 'L':
+                    self._scroll_down(self._num(params))
+                else:
+                    self._scroll_region_up(self._num(params))
+                self.top = top
+                self.x = 0
+        elif final in '@P':
+            count = min(self._num(params), cols - self.x)
+            chars = self.screen.chars[self.y]
+            attrs = self.screen.attrs[self.y]
+            if final == '@':
+                chars[self.x:self.x] = [' '] * count
+                attrs[self.x:self.x] = [self._erase_attr()] * count
+                del chars[cols:]
+                del attrs[cols:]
+            else:
+                del chars[self.x:self.x + count]
+                del attrs[self.x:self.x + count]
+                chars.extend([' '] * count)
+                attrs.extend([self._erase_attr()] * count)
+            self.dirty.add(self.y)
+        elif final == 'S':
+            self._scroll_region_up(self._num(params))
+        elif final == 'T':
+            self._scroll_down(self._num(params))
+        elif final == 'r':
+            top = self._num(params, 0) - 1
+            bottom = self._num(params, 1, rows) - 1
+            if 0 <= top < bottom < rows:
+                self.top, self.bottom = top, bottom
+            else:
+                self.top, self.bottom = 0, rows - 1
+            self.x = self.y = 0
+        elif final == 's':
+            self.saved = (self.x, self.y, self.attr_key)
+        elif final == 'u':
+            self._restore_cursor()
+        elif final == 'n':
+            mode = self._num(params, default=0)
+            if mode == 6:
+                self.replies.append(f"\x1b[{self.y + 1};{self.x + 1}R")
+            elif mode == 5:
+                self.replies.append("\x1b[0n")
+        elif final in 'ct':
+            # 设备属性查询、窗口操作交给真实终端
+            self.forward.append(raw)
+
+    def _scroll_region_up(self, count):
+        """在滚动区域内上滚（不进入回滚区）"""
+        top, bottom = self.top, self.bottom
+        screen = self.screen
+        count = min(count, bottom - top + 1)
+        for _ in range(count):
+            del screen.chars[top]
+            del screen.attrs[top]
+            chars, attrs = screen.blank_row(self._erase_attr())
+            screen.chars.insert(bottom, chars)
+            screen.attrs.insert(bottom, attrs)
+        self.dirty.update(range(top, bottom + 1))
+
+    def _private_mode(self, params, enable, raw):
+        forward = []
+        for param in params:
+            try:
+                mode = int(param)
+            except ValueError:
+                continue
+            if mode == 25:
+                self.cursor_visible = enable
+            elif mode == 7:
+                self.autowrap = enable
+            elif mode in ALT_SCREEN_MODES:
+                self._alt_screen(enable, mode)
+            elif mode in FORWARD_MODES:
+                forward.append(str(mode))
+        if forward:
+            self.forward.append(f"\x1b[?{';'.join(forward)}{'h' if enable else 'l'}")
+
+    def _alt_screen(self, enable, mode):
+        if enable and self.screen is self.main:
+            if mode == 1049:
+                self.saved = (self.x, self.y, self.attr_key)
+            self.alt = Buffer(self.cols, self.rows)
+            self.screen = self.alt
+        elif not enable and self.screen is not self.main:
+            self.screen = self.main
+            self.alt = None
+            if mode == 1049:
+                self._restore_cursor()
+        else:
+            return
+        self.dirty.update(range(self.rows))
+
+    def _restore_cursor(self):
+        x, y, attr_key = self.saved
+        self.x = min(x, self.cols - 1)
+        self.y = min(y, self.rows - 1)
+        self.wrap_pending = False
+
+    def _reset(self):
+        self.main = Buffer(self.cols, self.rows)
+        self.alt = None
+        self.screen = self.main
+        self.attr = Attr()
+        self.attr_key = ''
+        self.x = self.y = 0
+        self.top, self.bottom = 0, self.rows - 1
+        self.cursor_visible = True
+        self.autowrap = True
+        self.dirty.update(range(self.rows))
+
+    def resize(self, cols, rows):
+        """终端大小变化：调整模型并在下一帧全屏重绘"""
+        with self.lock:
+            cols, rows = max(cols, 1), max(rows, 1)
+            if (cols, rows) == (self.cols, self.rows):
+                return
+            shift = max(0, self.rows - rows)
+            self.main.resize(cols, rows)
+            if self.alt is not None:
+                self.alt.resize(cols, rows)
+            self.cols, self.rows = cols, rows
+            self.y = min(max(0, self.y - shift), rows - 1)
+            self.x = min(self.x, cols - 1)
+            self.top, self.bottom = 0, rows - 1
+            self.painted = [None] * rows
+            self.dirty = set(range(rows))
+            self.changed = True
+            # 终端重排后已无法知道回滚区之外的内容，补画整屏
+            self.forward.append("\x1b[H\x1b[2J")
+
+    # ---------- 输出 ----------
+
+    def start(self):
+        """进入渲染模式时写给终端的内容：把当前屏幕内容推入回滚区并清屏"""
+        return ("\r\n" * self.rows + "\x1b[H\x1b[2J").encode()
+
+    def due_in(self, now=None):
+        """距离下一帧还需等待的秒数（无变化时返回 None）"""
+        if not self.changed:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.last_paint + self.interval - now)
+
+    def _render_row(self, chars, attrs, y):
+        """绘制一行：逐段输出属性变化，末尾默认属性的空白用行尾清除代替"""
+        end = self.cols
+        while end > 0 and chars[end - 1] == ' ' and attrs[end - 1] == '':
+            end -= 1
+        out = [f"\x1b[{y + 1};1H\x1b[0m"]
+        current = ''
+        for x in range(end):
+            attr = attrs[x]
+            if attr != current:
+                out.append(f"\x1b[0;{attr}m" if attr else "\x1b[0m")
+                current = attr
+            out.append(chars[x])
+        if current:
+            out.append("\x1b[0m")
+        if end < self.cols:
+            out.append("\x1b[K")
+        return ''.join(out)
+
+    def render(self, force=False):
+        """生成一帧（bytes），未到刷新时间或没有变化时返回 b''"""
+        with self.lock:
+            now = time.monotonic()
+            if not self.changed or (not force and now - self.last_paint < self.interval):
+                return b''
+            self.changed = False
+            self.last_paint = now
+
+            out = ["\x1b[?2026h\x1b[?25l"]
+            out.extend(self.forward)
+            self.forward = []
+
+            # 先把滚出顶部的行补画并滚入终端的回滚区
+            scrolled, self.scrolled = self.scrolled, []
+            for offset in range(0, len(scrolled), self.rows):
+                chunk = scrolled[offset:offset + self.rows]
+                for y, (chars, attrs) in enumerate(chunk):
+                    out.append(self._render_row(chars, attrs, y))
+                out.append(f"\x1b[{self.rows};1H" + "\n" * len(chunk))
+            if scrolled:
+                count = len(scrolled)
+                if count < self.rows:
+                    # 终端上未被补画覆盖的行随滚动上移，底部滚入空行
+                    blank = (tuple(' ' * self.cols), ('',) * self.cols)
+                    self.painted = self.painted[count:] + [blank] * count
+                else:
+                    self.painted = [None] * self.rows
+
+            screen = self.screen
+            for y in sorted(self.dirty):
+                if y >= self.rows:
+                    continue
+                row = (tuple(screen.chars[y]), tuple(screen.attrs[y]))
+                if self.painted[y] == row:
+                    continue
+                out.append(self._render_row(screen.chars[y], screen.attrs[y], y))
+                self.painted[y] = row
+            self.dirty = set()
+
+            out.append(f"\x1b[{self.y + 1};{self.x + 1}H")
+            if self.cursor_visible:
+                out.append("\x1b[?25h")
+            out.append("\x1b[?2026l")
+            data = ''.join(out).encode('utf-8')
+            self.frames += 1
+            self.painted_bytes += len(data)
+            return data
+
+    def finish(self):
+        """退出渲染模式：绘制最后一帧并恢复光标显示"""
+        return self.render(force=True) + b"\x1b[0m\x1b[?25h"
+
+    def stats(self):
+        return (f"frame renderer: {self.frames} frames, {self.fed_bytes} bytes in, "
+                f"{self.painted_bytes} bytes painted, {self.dropped_lines} scrollback lines dropped")
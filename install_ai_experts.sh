@@ -75,6 +75,13 @@ if [ -d "$SOURCE_DIR/templates" ]; then
     echo "  ✓ $template_count 个专家模板"
 fi
 
+# 复制专家提示词分节检索脚本
+if [ -f "$SOURCE_DIR/expert_sections.py" ]; then
+    cp "$SOURCE_DIR/expert_sections.py" "$TARGET_DIR/"
+    chmod +x "$TARGET_DIR/expert_sections.py"
+    echo "  ✓ expert_sections.py"
+fi
+
 # 复制自动加载脚本
 if [ -f "$AUTO_LOAD_SCRIPT" ]; then
     cp "$AUTO_LOAD_SCRIPT" "$TARGET_DIR/"
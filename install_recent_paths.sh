@@ -18,18 +18,22 @@ NC='\033[0m' # No Color
 
 # 源文件
 SOURCE_SCRIPT="$HOME/Documents/ClaudeCode/zsh/zsh/recent_paths.sh"
+SOURCE_STORE="$HOME/Documents/ClaudeCode/zsh/zsh/recent_paths.py"
 
 # 目标位置
 TARGET_DIR="$HOME/.izsh"
 TARGET_SCRIPT="$TARGET_DIR/recent_paths.sh"
+TARGET_STORE="$TARGET_DIR/recent_paths.py"
 IZSHRC="$HOME/.izshrc"
 
 # 检查源文件
 echo -e "${BLUE}1. 检查源文件...${NC}"
-if [ ! -f "$SOURCE_SCRIPT" ]; then
-    echo -e "${RED}❌ 源文件不存在: $SOURCE_SCRIPT${NC}"
-    exit 1
-fi
+for source_file in "$SOURCE_SCRIPT" "$SOURCE_STORE"; do
+    if [ ! -f "$source_file" ]; then
+        echo -e "${RED}❌ 源文件不存在: $source_file${NC}"
+        exit 1
+    fi
+done
 echo -e "${GREEN}✅ 源文件检查通过${NC}"
 echo ""
 
@@ -44,6 +48,9 @@ echo -e "${BLUE}3. 安装脚本文件...${NC}"
 cp "$SOURCE_SCRIPT" "$TARGET_SCRIPT"
 chmod +x "$TARGET_SCRIPT"
 echo -e "  ✓ recent_paths.sh -> $TARGET_SCRIPT"
+cp "$SOURCE_STORE" "$TARGET_STORE"
+chmod +x "$TARGET_STORE"
+echo -e "  ✓ recent_paths.py -> $TARGET_STORE"
 echo -e "${GREEN}✅ 脚本安装完成${NC}"
 echo ""
 
@@ -54,6 +61,11 @@ INTEGRATION_BLOCK="# iZsh 路径记录功能
 if [ -f \"\$HOME/.izsh/recent_paths.sh\" ]; then
     source \"\$HOME/.izsh/recent_paths.sh\"
 
+    # 切换目录时记录（后台执行，不阻塞提示符）
+    autoload -Uz add-zsh-hook
+    _izsh_record_path() { save_current_path &! }
+    add-zsh-hook chpwd _izsh_record_path
+
     # 注册 zshexit hook（退出时保存路径）
     zshexit() {
         save_current_path
@@ -91,11 +103,12 @@ echo "==========================================${NC}"
 echo ""
 echo -e "${BLUE}📁 安装位置：${NC}"
 echo "  - 脚本文件: $TARGET_SCRIPT"
-echo "  - 记录文件: ~/.izsh/recent_paths"
+echo "  - 记录存储: $TARGET_STORE"
+echo "  - 记录数据库: ~/.izsh/recent_paths.db（首次使用时导入旧的 ~/.izsh/recent_paths）"
 echo ""
 echo -e "${CYAN}🎯 功能说明：${NC}"
-echo "  ✅ 每次关闭 iZsh 窗口时自动记录当前路径"
-echo "  ✅ 最多保存最近 10 个路径"
+echo "  ✅ 切换目录和关闭 iZsh 窗口时自动记录当前路径"
+echo "  ✅ 按访问频度和时效排序，多个窗口同时写入不丢记录"
 echo "  ✅ 自动跳过 HOME 目录和无效路径"
 echo ""
 echo -e "${BLUE}🚀 使用方式：${NC}"
@@ -106,6 +119,9 @@ echo ""
 echo "  # 回到第2个最近的路径"
 echo -e "  ${GREEN}最近路径 2${NC}"
 echo ""
+echo "  # 回到匹配关键词的最常用路径"
+echo -e "  ${GREEN}最近路径 proj api${NC}"
+echo ""
 echo "  # 查看所有最近的路径"
 echo -e "  ${GREEN}最近路径 list${NC}"
 echo -e "  ${GREEN}rpl${NC}              # 简写"
@@ -119,7 +135,7 @@ echo -e "  ${GREEN}source ~/.izshrc${NC}"
 echo ""
 echo -e "${YELLOW}💡 提示：${NC}"
 echo "  - 命令支持中文和英文"
-echo "  - 路径自动去重，最近的总在前面"
+echo "  - 常用且最近访问的路径排在前面"
 echo "  - 使用 'rp list' 快速查看所有记录"
 echo "  - 使用 'rp clean' 清理无效路径"
 echo ""
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+正则表达式安全检查与匹配预算
+
+用于 experts.json 中用户定义的 patterns 和包装器的提示检测模式：
+- 保存前检查：无法编译或含嵌套无界量词（如 (a+)+、(.*)*）的模式直接拒绝
+- 改写：无界的 .* / .+ / .*? 改为有上限的重复，避免长行上的回溯爆炸
+- 匹配时：超过 max_line 个字符的文本只取一个窗口参与匹配——一般取末尾（提示通常出现在行尾），
+  以 ^ / \A 开头的模式和 match() 取开头，部分分支锚定在开头的两处都试；
+  MULTILINE 模式的末尾窗口从完整行开始，避免 ^ 匹配到截断处
+- 时间预算只是建议性的：Python 的 re 无法中断正在进行的匹配，耗时在匹配结束后才统计；
+  单次匹配的最坏耗时靠保存前检查、改写和窗口长度限制
+- 用户定义的模式（can_disable=True）连续多次超出预算时停用 IZSH_PATTERN_COOLDOWN 秒（默认 60），
+  停用时在 stderr 提示，冷却结束后自动恢复；包装器内置的检测模式（compile_table）只统计不停用，
+  机器负载高或 GC 停顿不会让 [Y/n]、菜单检测失效
+- 统计每个模式的调用次数和耗时，输出最慢的模式
+"""
+
+import os
+import re
+import sys
+import time
+
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+# 单行参与匹配的最大长度（窗口的取法见 SafePattern._window）
+DEFAULT_MAX_LINE = int(os.environ.get('IZSH_PATTERN_MAX_LINE', 2000))
+
+# 单次匹配的时间预算（秒）和允许连续超出的次数（匹配结束后检查，超出不会中断匹配）
+DEFAULT_BUDGET = float(os.environ.get('IZSH_PATTERN_BUDGET_MS', 20)) / 1000
+DEFAULT_MAX_OVERRUNS = 3
+
+# 用户模式停用后恢复的时间（秒）
+DEFAULT_COOLDOWN = float(os.environ.get('IZSH_PATTERN_COOLDOWN', 60))
+
+# 改写无界通配时使用的重复上限
+WILDCARD_LIMIT = 200
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+_UNBOUNDED = sre_constants.MAXREPEAT
+
+
+class PatternError(ValueError):
+    """不安全或无效的正则表达式"""
+
+
+def _has_unbounded_repeat(parsed):
+    """子模式中是否含无界重复"""
+    for op, av in parsed:
+        if op in _REPEATS:
+            if av[1] == _UNBOUNDED:
+                return True
+            if _has_unbounded_repeat(av[2]):
+                return True
+        elif op == sre_constants.SUBPATTERN:
+            if _has_unbounded_repeat(av[-1]):
+                return True
+        elif op == sre_constants.BRANCH:
+            if any(_has_unbounded_repeat(branch) for branch in av[1]):
+                return True
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            if _has_unbounded_repeat(av[1]):
+                return True
+    return False
+
+
+def _find_nested_repeat(parsed):
+    """查找无界重复内部再嵌套无界重复的结构（灾难性回溯的典型来源）"""
+    for op, av in parsed:
+        if op in _REPEATS:
+            if av[1] == _UNBOUNDED and _has_unbounded_repeat(av[2]):
+                return True
+            if _find_nested_repeat(av[2]):
+                return True
+        elif op == sre_constants.SUBPATTERN:
+            if _find_nested_repeat(av[-1]):
+                return True
+        elif op == sre_constants.BRANCH:
+            if any(_find_nested_repeat(branch) for branch in av[1]):
+                return True
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            if _find_nested_repeat(av[1]):
+                return True
+    return False
+
+
+def _leading_anchor(parsed, flags):
+    """模式是否锚定在文本开头：True 全部分支锚定，False 都不锚定，None 部分分支锚定
+
+    MULTILINE 下的 ^ 可以匹配任一行首，不算锚定在开头（\A 仍然算）。
+    """
+    for op, av in parsed:
+        if op == sre_constants.AT:
+            if av == sre_constants.AT_BEGINNING_STRING:
+                return True
+            if av == sre_constants.AT_BEGINNING and not flags & re.MULTILINE:
+                return True
+            continue
+        if op == sre_constants.SUBPATTERN:
+            return _leading_anchor(av[-1], flags)
+        if op == sre_constants.BRANCH:
+            anchors = {_leading_anchor(branch, flags) for branch in av[1]}
+            return anchors.pop() if len(anchors) == 1 else None
+        return False
+    return False
+
+
+def _trailing_anchor(parsed, flags):
+    """模式是否以 $ / \Z 结尾（MULTILINE 下的 $ 不算）"""
+    items = list(parsed)
+    if not items:
+        return False
+    op, av = items[-1]
+    if op == sre_constants.AT:
+        return av == sre_constants.AT_END_STRING or (av == sre_constants.AT_END and not flags & re.MULTILINE)
+    if op == sre_constants.SUBPATTERN:
+        return _trailing_anchor(av[-1], flags)
+    if op == sre_constants.BRANCH:
+        return all(_trailing_anchor(branch, flags) for branch in av[1])
+    return False
+
+
+def rewrite_pattern(pattern):
+    """把无界的 .* / .+（含惰性形式）改写为有上限的重复（跳过转义和字符类）"""
+    out = []
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '\\':
+            out.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if in_class:
+            if ch == ']':
+                in_class = False
+            out.append(ch)
+            i += 1
+            continue
+        if ch == '[':
+            in_class = True
+            out.append(ch)
+            # 字符类开头的 ] 或 ^] 是字面量
+            if pattern[i + 1:i + 2] == '^':
+                out.append('^')
+                i += 1
+            if pattern[i + 1:i + 2] == ']':
+                out.append(']')
+                i += 1
+            i += 1
+            continue
+        if ch == '.' and pattern[i + 1:i + 2] in ('*', '+'):
+            low = 0 if pattern[i + 1] == '*' else 1
+            out.append(f".{{{low},{WILDCARD_LIMIT}}}")
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+def _parse(pattern, flags):
+    try:
+        return sre_parse.parse(pattern, flags)
+    except re.error as e:
+        raise PatternError(f"无法编译: {e}")
+
+
+def check_pattern(pattern, flags=0, parsed=None):
+    """检查模式，返回 (改写后的模式, 说明列表)；不安全时抛出 PatternError"""
+    if parsed is None:
+        parsed = _parse(pattern, flags)
+
+    if _find_nested_repeat(parsed):
+        raise PatternError("含嵌套的无界量词（如 (a+)+），可能导致灾难性回溯")
+
+    notes = []
+    rewritten = rewrite_pattern(pattern)
+    if rewritten != pattern:
+        notes.append(f"无界通配已限制为最多 {WILDCARD_LIMIT} 个字符")
+        try:
+            re.compile(rewritten, flags)
+        except re.error:
+            rewritten = pattern
+            notes.pop()
+    return rewritten, notes
+
+
+class SafePattern:
+    """带长度上限、时间预算和耗时统计的已编译模式
+
+    时间预算是建议性的：超出预算的匹配照常完成并返回结果。can_disable 为 True 时（用户定义的模式）
+    连续超出 DEFAULT_MAX_OVERRUNS 次后停用 cooldown 秒，期间 search/match 返回 None。
+    """
+
+    def __init__(self, pattern, flags=0, max_line=None, budget=None, label=None, can_disable=False,
+                 cooldown=None):
+        self.source = pattern
+        self.label = label
+        # 改写只限制通配的重复次数，不改变首尾锚点，用原模式的解析结果判断
+        parsed = _parse(pattern, flags)
+        rewritten, self.notes = check_pattern(pattern, flags, parsed)
+        self.regex = re.compile(rewritten, flags)
+        self.multiline = bool(flags & re.MULTILINE)
+        self.anchored = _leading_anchor(parsed, flags)
+        # 首尾都锚定的模式要求整段文本匹配，超长文本的任何窗口都不能代替
+        self.whole_text = self.anchored is True and _trailing_anchor(parsed, flags)
+        self.max_line = max_line or DEFAULT_MAX_LINE
+        self.budget = budget if budget is not None else DEFAULT_BUDGET
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.overruns = 0
+        self.overrun_streak = 0
+        self.can_disable = can_disable
+        self.cooldown = cooldown if cooldown is not None else DEFAULT_COOLDOWN
+        self.disabled_until = 0.0   # 停用到的时间（monotonic，0 表示启用）
+        self.disables = 0
+
+    @property
+    def disabled(self):
+        return bool(self.disabled_until) and time.monotonic() < self.disabled_until
+
+    def _window(self, text, anchored):
+        """超长文本参与匹配的窗口：锚定在开头时取开头，否则取末尾（MULTILINE 时从完整行开始）"""
+        if anchored:
+            return text[:self.max_line]
+        tail = text[-self.max_line:]
+        if self.multiline:
+            newline = tail.find('\n')
+            tail = tail[newline + 1:] if newline >= 0 else ''
+        return tail
+
+    def _run(self, method, text, anchored=None):
+        if self.disabled_until:
+            if time.monotonic() < self.disabled_until:
+                return None
+            # 冷却结束，恢复
+            self.disabled_until = 0.0
+            self.overrun_streak = 0
+        anchored = self.anchored if anchored is None else anchored
+        start = time.perf_counter()
+        if len(text) <= self.max_line:
+            result = method(text)
+        elif self.whole_text:
+            result = None
+        elif anchored is None:
+            result = method(self._window(text, True)) or method(self._window(text, False))
+        else:
+            result = method(self._window(text, anchored))
+        elapsed = time.perf_counter() - start
+
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if self.budget > 0 and elapsed > self.budget:
+            self.overruns += 1
+            self.overrun_streak += 1
+            if self.can_disable and self.overrun_streak >= DEFAULT_MAX_OVERRUNS:
+                self._disable()
+        else:
+            self.overrun_streak = 0
+        return result
+
+    def _disable(self):
+        self.disabled_until = time.monotonic() + self.cooldown
+        self.disables += 1
+        name = f"{self.label}: " if self.label else ''
+        print(f"⚠️ 正则模式连续 {self.overrun_streak} 次超出 {self.budget * 1000:g} ms 预算，"
+              f"停用 {self.cooldown:g} 秒: {name}{self.source!r}", file=sys.stderr)
+
+    def search(self, text):
+        return self._run(self.regex.search, text)
+
+    def match(self, text):
+        return self._run(self.regex.match, text, anchored=True)
+
+
+def compile_table(table, flags=0):
+    """编译内置的 [(模式, 标签)] 表，返回 [(SafePattern, 标签)]；不安全的模式会被跳过，超出预算不停用"""
+    compiled = []
+    for pattern, label in table:
+        try:
+            compiled.append((SafePattern(pattern, flags, label=label), label))
+        except PatternError:
+            continue
+    return compiled
+
+
+def slowest(patterns, top=10):
+    """按总耗时排序，返回最慢的模式"""
+    ranked = sorted(patterns, key=lambda p: p.total_time, reverse=True)
+    return [p for p in ranked if p.calls][:top]
+
+
+def format_report(patterns, top=10):
+    """格式化最慢模式报告"""
+    lines = ["pattern profile: total[ms]   max[ms]    calls  overruns  pattern"]
+    for p in slowest(patterns, top):
+        flag = ' (已停用)' if p.disabled else (f' (停用过 {p.disables} 次)' if p.disables else '')
+        lines.append(f"pattern profile: {p.total_time * 1000:9.2f} {p.max_time * 1000:9.3f} "
+                     f"{p.calls:8d} {p.overruns:9d}  {p.source!r}{flag}")
+    return '\n'.join(lines)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+辅助子进程管理（AI 调用、man/--help 查询等）
+
+subprocess.run(timeout=...) 超时只杀直接子进程，izsh 启动的 curl、shell 辅助进程等孙进程会成为孤儿，
+反复发生时耗尽进程数（见 BUG_FIX_进程耗尽.md）。这里统一：
+- 每个辅助进程在独立的会话/进程组中启动（start_new_session）
+- 超时或提前结束时向整个进程组发送 SIGTERM，宽限期后 SIGKILL，并等待直接子进程（不留僵尸）
+- 正常结束后同样清理进程组中残留的孙进程
+- 本机所有 izsh 进程同时运行的辅助进程数有上限（IZSH_MAX_HELPERS，默认 8）：名额记录在
+  ~/.izsh/helper_slots.json（IZSH_HELPER_SLOTS_FILE），读写时用 flock 加锁，已退出进程占用的名额
+  在下次读写时回收；达到上限时最多等待 IZSH_HELPER_WAIT 秒（默认 10），仍无空位则抛出 HelperLimitError。
+  名额文件不可用时退回进程内上限
+- metrics() 返回本进程和全机的存活数、峰值、超时和强制结束次数等统计；
+  IZSH_HELPER_METRICS=1 时进程退出前输出到 stderr
+
+交互式程序（编辑器、被包装的 Claude Code 本身）需要留在终端前台进程组，不要用这里的函数启动。
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import signal
+import sys
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+# 终止进程组时 SIGTERM 之后等待的时间（秒）
+KILL_GRACE = 1.0
+
+DEFAULT_SLOTS_FILE = os.path.expanduser('~/.izsh/helper_slots.json')
+
+# 全机名额已满时重新检查的间隔（秒）
+SLOT_POLL = 0.05
+
+
+class HelperLimitError(RuntimeError):
+    """同时运行的辅助进程数已达上限"""
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class SlotFile:
+    """全机共享的辅助进程名额：{名额: [所属进程 PID, 辅助进程 PID]}，以 flock 加锁的状态文件实现"""
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('IZSH_HELPER_SLOTS_FILE', DEFAULT_SLOTS_FILE)
+
+    def _update(self, change):
+        """加锁读取名额表（回收已退出进程的名额），调用 change(名额表) 修改后写回，
+        返回 change 的结果；文件不可用时返回 None"""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, 1 << 20, 0)
+            try:
+                slots = json.loads(raw) if raw else {}
+            except ValueError:
+                slots = {}
+            if not isinstance(slots, dict):
+                slots = {}
+            before = dict(slots)
+            for key, value in before.items():
+                if not isinstance(value, list) or not value or not process_alive(value[0]):
+                    del slots[key]
+            result = change(slots)
+            if slots != before:
+                data = json.dumps(slots).encode()
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, data, 0)
+            return result
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    def acquire(self, key, cap):
+        """名额未满时登记 key 并返回 True，已满返回 False，文件不可用时返回 None"""
+        def change(slots):
+            if len(slots) >= cap:
+                return False
+            slots[key] = [os.getpid(), None]
+            return True
+        return self._update(change)
+
+    def assign(self, key, pid):
+        """记录名额对应的辅助进程 PID"""
+        def change(slots):
+            if key in slots:
+                slots[key] = [slots[key][0], pid]
+        self._update(change)
+
+    def release(self, key):
+        self._update(lambda slots: slots.pop(key, None))
+
+    def counts(self):
+        """(全机占用的名额数, 占用名额的进程数)；文件不可用时返回 None"""
+        return self._update(lambda slots: (len(slots), len({value[0] for value in slots.values()})))
+
+
+class HelperPool:
+    """辅助进程登记表：并发上限和统计"""
+
+    def __init__(self, cap=None, wait=None, slot_file=None):
+        self.cap = cap or int(os.environ.get('IZSH_MAX_HELPERS', 8))
+        self.wait = wait if wait is not None else float(os.environ.get('IZSH_HELPER_WAIT', 10))
+        self.slots = threading.BoundedSemaphore(self.cap)
+        self.slot_file = slot_file or SlotFile()
+        self.keys = {}       # pid -> 全机名额
+        self.next_key = 0
+        self.lock = threading.Lock()
+        self.live = {}       # pid -> (进程组 ID, 参数)
+        self.waiting = 0
+        self.peak = 0
+        self.started = 0
+        self.timeouts = 0
+        self.group_kills = 0
+        self.rejected = 0
+
+    def acquire(self):
+        """取得进程内和全机名额，返回全机名额（名额文件不可用时为 None）；超时抛出 HelperLimitError"""
+        deadline = time.monotonic() + self.wait
+        with self.lock:
+            self.waiting += 1
+            self.next_key += 1
+            key = f"{os.getpid()}:{self.next_key}"
+        try:
+            if self.slots.acquire(timeout=self.wait):
+                while True:
+                    acquired = self.slot_file.acquire(key, self.cap)
+                    if acquired is not False:
+                        return key if acquired else None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    time.sleep(min(SLOT_POLL, remaining))
+                self.slots.release()
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        with self.lock:
+            self.rejected += 1
+        raise HelperLimitError(f"本机辅助进程数已达上限 {self.cap}")
+
+    def spawn(self, args, **kwargs):
+        """在新的进程组中启动辅助进程（占用一个并发名额，须用 release 归还）"""
+        key = self.acquire()
+        try:
+            proc = subprocess.Popen(args, start_new_session=True, **kwargs)
+        except BaseException:
+            if key is not None:
+                self.slot_file.release(key)
+            self.slots.release()
+            raise
+        if key is not None:
+            self.slot_file.assign(key, proc.pid)
+        with self.lock:
+            self.live[proc.pid] = (proc.pid, args[0] if args else '')
+            self.keys[proc.pid] = key
+            self.started += 1
+            self.peak = max(self.peak, len(self.live))
+        return proc
+
+    def release(self, proc, grace=KILL_GRACE):
+        """结束辅助进程：清理进程组中残留的进程，等待直接子进程并归还名额"""
+        try:
+            if kill_group(proc, grace):
+                with self.lock:
+                    self.group_kills += 1
+        finally:
+            with self.lock:
+                removed = self.live.pop(proc.pid, None)
+                key = self.keys.pop(proc.pid, None)
+            if removed is not None:
+                if key is not None:
+                    self.slot_file.release(key)
+                self.slots.release()
+
+    def metrics(self):
+        """辅助进程统计（group_members 为各进程组中仍存活的进程总数，需要 /proc；
+        global_live / global_owners 为全机占用的名额数和占用名额的进程数，名额文件不可用时为 None）"""
+        with self.lock:
+            groups = {pgid for pgid, _ in self.live.values()}
+            stats = {
+                'live': len(self.live),
+                'waiting': self.waiting,
+                'cap': self.cap,
+                'peak': self.peak,
+                'started': self.started,
+                'timeouts': self.timeouts,
+                'group_kills': self.group_kills,
+                'rejected': self.rejected,
+            }
+        stats['group_members'] = count_group_members(groups)
+        stats['global_live'], stats['global_owners'] = self.slot_file.counts() or (None, None)
+        return stats
+
+
+def group_alive(pgid):
+    """进程组中是否还有（非僵尸）进程
+
+    孙进程的僵尸由 init 回收，不算残留；有 /proc 时据此排除，否则只能用 killpg(0) 探测。
+    """
+    members = count_group_members({pgid})
+    if members is not None:
+        return members > 0
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def kill_group(proc, grace=KILL_GRACE):
+    """向进程的整个进程组发送 SIGTERM（宽限期后 SIGKILL），并等待直接子进程
+
+    进程组 ID 等于直接子进程的 PID（start_new_session）。返回是否确实有残留进程被终止。
+    """
+    pgid = proc.pid
+    killed = False
+    if proc.poll() is None or group_alive(pgid):
+        killed = True
+        try:
+            os.killpg(pgid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + grace
+        while time.monotonic() < deadline:
+            proc.poll()
+            if not group_alive(pgid) and proc.returncode is not None:
+                break
+            time.sleep(0.02)
+        else:
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    return killed
+
+
+def count_group_members(groups):
+    """统计属于给定进程组的非僵尸进程数（没有 /proc 时返回 None）"""
+    if not groups:
+        return 0
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return None
+    count = 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                data = f.read()
+            fields = data[data.rindex(b')') + 2:].split()
+            if fields[0] != b'Z' and int(fields[2]) in groups:
+                count += 1
+        except (OSError, ValueError, IndexError):
+            continue
+    return count
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """进程内共享的辅助进程登记表"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HelperPool()
+            if os.environ.get('IZSH_HELPER_METRICS', '0') == '1':
+                atexit.register(lambda: print(format_metrics(), file=sys.stderr))
+        return _pool
+
+
+def spawn(args, **kwargs):
+    return get_pool().spawn(args, **kwargs)
+
+
+def release(proc, grace=KILL_GRACE):
+    get_pool().release(proc, grace)
+
+
+@contextmanager
+def helper(args, **kwargs):
+    """with helper(args, stdout=PIPE) as proc: ...（离开时清理整个进程组）"""
+    proc = spawn(args, **kwargs)
+    try:
+        yield proc
+    finally:
+        release(proc)
+
+
+def run(args, timeout=None, input=None, capture_output=False, text=False, env=None, **kwargs):
+    """与 subprocess.run 相同的用法；超时时终止整个进程组后抛出 subprocess.TimeoutExpired"""
+    if capture_output:
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+    with helper(args, text=text, env=env, **kwargs) as proc:
+        try:
+            stdout, stderr = proc.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            pool = get_pool()
+            with pool.lock:
+                pool.timeouts += 1
+            kill_group(proc)
+            proc.communicate()
+            raise
+    return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+
+
+def metrics():
+    return get_pool().metrics()
+
+
+def format_metrics(stats=None):
+    """一行辅助进程统计"""
+    stats = stats or metrics()
+    members = stats['group_members']
+    global_live = stats['global_live']
+    return (f"helpers: live {stats['live']}/{stats['cap']} (group members "
+            f"{'?' if members is None else members}), machine-wide "
+            f"{'?' if global_live is None else global_live}/{stats['cap']} in "
+            f"{'?' if global_live is None else stats['global_owners']} processes, waiting {stats['waiting']}, peak {stats['peak']}, "
+            f"started {stats['started']}, timeouts {stats['timeouts']}, "
+            f"group kills {stats['group_kills']}, rejected {stats['rejected']}")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+子进程是否在等待输入（Linux /proc）
+
+采样 PTY 前台进程组中各进程的调度状态（/proc/<pid>/stat）和阻塞位置（/proc/<pid>/wchan）：
+- INPUT_WAITING：睡眠在终端读取（n_tty_read / wait_woken）中，且两次采样之间几乎不占 CPU；
+  睡眠在 select/poll/epoll 中的只有同时满足以下条件才算：终端输入队列为空、
+  上次采样以来没有输出（Node 等事件循环程序在生成回复时同样空闲在 epoll 中）
+- INPUT_BUSY：正在运行（R/D）、CPU 占用超过阈值，或睡眠在其他位置（nanosleep、futex、
+  不满足上述条件的 epoll 等）
+- INPUT_UNKNOWN：没有 /proc（如 macOS）、已关闭或读取失败，调用方按原来的纯文本检测处理
+
+内核隐藏 wchan（读到 0）时只依据调度状态和 CPU 占用判断。
+IZSH_PROC_PROBE=0 关闭。
+"""
+
+import fcntl
+import os
+import struct
+import termios
+import threading
+import time
+
+INPUT_WAITING = 'waiting'
+INPUT_BUSY = 'busy'
+INPUT_UNKNOWN = 'unknown'
+
+# 阻塞在终端读取上
+INPUT_WCHANS = {'n_tty_read', 'wait_woken'}
+
+# 阻塞在 I/O 多路复用上：事件循环程序（Node）无论是否在等待终端输入都停在这里，
+# 需要结合终端输入队列和输出判断
+POLL_WCHANS = {
+    'do_select', 'core_sys_select', 'do_sys_poll', 'do_poll', 'poll_schedule_timeout',
+    'ep_poll', 'do_epoll_wait',
+}
+
+# 等待子进程：由子进程自身的状态决定，不单独计为忙碌
+NEUTRAL_WCHANS = {'do_wait', 'kernel_wait4'}
+
+# 采样间隔内 CPU 占用达到该比例视为忙碌
+BUSY_CPU = 0.2
+
+# 同一结果的缓存时间（秒），I/O 线程和分析线程可能在同一时刻各采样一次
+SAMPLE_CACHE = 0.05
+
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def read_stat(pid):
+    """返回 (状态, 进程组, 累计 CPU 时钟数)"""
+    with open(f'/proc/{pid}/stat', 'rb') as f:
+        data = f.read()
+    # comm 可能含空格和括号，从最后一个 ')' 之后解析
+    fields = data[data.rindex(b')') + 2:].split()
+    return fields[0].decode(), int(fields[2]), int(fields[11]) + int(fields[12])
+
+
+def read_wchan(pid):
+    """进程阻塞所在的内核函数，无法读取或被隐藏时返回空字符串"""
+    try:
+        with open(f'/proc/{pid}/wchan') as f:
+            wchan = f.read().strip()
+    except OSError:
+        return ''
+    if wchan == '0':
+        return ''
+    # 去掉编译器生成的后缀（如 poll_schedule_timeout.constprop.0）
+    return wchan.split('.', 1)[0]
+
+
+def children(pid):
+    """直接子进程（需要内核支持 /proc/<pid>/task/<pid>/children）"""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def input_queued(pid):
+    """进程标准输入所在终端的输入队列中未读取的字节数（不是伪终端或无法读取时返回 None）
+
+    每次临时打开从设备再关闭：包装器一直持有从设备会使子进程退出后主设备读不到 EOF。
+    """
+    try:
+        path = os.readlink(f'/proc/{pid}/fd/0')
+        if not path.startswith('/dev/pts/'):
+            return None
+        fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        return struct.unpack('i', fcntl.ioctl(fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+class InputProbe:
+    """判断 PTY 前台进程是否阻塞在终端输入上
+
+    last_output 为返回子进程最近一次输出时间（time.monotonic()）的函数；
+    未提供时阻塞在 select/poll/epoll 中的进程一律视为忙碌。
+    """
+
+    def __init__(self, root_pid, tty_fd=None, busy_cpu=BUSY_CPU, cache=SAMPLE_CACHE, last_output=None):
+        self.root_pid = root_pid
+        self.tty_fd = tty_fd
+        self.last_output = last_output
+        self.busy_cpu = busy_cpu
+        self.cache = cache
+        self.enabled = (os.environ.get('IZSH_PROC_PROBE', '1') == '1'
+                        and os.path.isdir(f'/proc/{root_pid}'))
+        self.lock = threading.Lock()
+        self.ticks = {}          # pid -> 上次采样的 CPU 时钟数
+        self.ticks_at = 0.0
+        self.last = INPUT_UNKNOWN
+        self.sampled_at = 0.0
+
+    def foreground(self):
+        """子进程树中属于终端前台进程组的进程（无法取得前台进程组时返回整棵树）"""
+        pgid = None
+        if self.tty_fd is not None:
+            try:
+                pgid = os.tcgetpgrp(self.tty_fd)
+            except OSError:
+                pass
+
+        pids = []
+        stack = [self.root_pid]
+        while stack:
+            pid = stack.pop()
+            if pid in pids:
+                continue
+            pids.append(pid)
+            stack.extend(children(pid))
+        return pids, pgid
+
+    def sample(self):
+        """采样并返回 INPUT_WAITING / INPUT_BUSY / INPUT_UNKNOWN"""
+        if not self.enabled:
+            return INPUT_UNKNOWN
+        with self.lock:
+            now = time.monotonic()
+            if now - self.sampled_at >= self.cache:
+                self.last = self._sample(now)
+                self.sampled_at = now
+            return self.last
+
+    def _sample(self, now):
+        pids, pgid = self.foreground()
+        elapsed = now - self.ticks_at if self.ticks_at else 0.0
+        ticks = {}
+        busy = waiting = False
+
+        for pid in pids:
+            try:
+                state, pgrp, cpu = read_stat(pid)
+            except (OSError, ValueError, IndexError):
+                continue
+            if pgid is not None and pgrp != pgid:
+                continue
+            ticks[pid] = cpu
+
+            if state in ('R', 'D'):
+                busy = True
+                continue
+            if state not in ('S', 'I'):
+                # 僵尸、已停止的进程不参与判断
+                continue
+
+            previous = self.ticks.get(pid)
+            if previous is not None and elapsed > 0 and (cpu - previous) / CLK_TCK / elapsed >= self.busy_cpu:
+                busy = True
+                continue
+
+            wchan = read_wchan(pid)
+            if not wchan or wchan in INPUT_WCHANS:
+                waiting = True
+            elif wchan in POLL_WCHANS and self.poll_idle(pid):
+                waiting = True
+            elif wchan not in NEUTRAL_WCHANS:
+                busy = True
+
+        self.ticks = ticks
+        self.ticks_at = now
+        if not ticks:
+            return INPUT_UNKNOWN
+        if busy or not waiting:
+            return INPUT_BUSY
+        return INPUT_WAITING
+
+    def poll_idle(self, pid):
+        """阻塞在 select/poll/epoll 中的进程是否在等待输入：上次采样以来没有输出，且终端输入队列为空"""
+        if self.last_output is None or not self.ticks_at or self.last_output() >= self.ticks_at:
+            return False
+        return input_queued(pid) == 0
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+最近路径的频度+时效（frecency）索引
+
+原来的 recent_paths.sh 在每个 shell 退出时读出整个记录文件、逐个检查目录、清空后逐行重写，
+只保留 10 条；多个窗口同时关闭时相互覆盖，丢失记录。这里改为 SQLite 存储：
+- 每个路径一行（路径为主键），记录一次访问只按主键更新一行和一行总计（B 树更新，O(log n)）
+- WAL 模式 + busy_timeout，多个 shell 同时写入时由 SQLite 加锁串行化，不丢记录
+- 得分 = 累计权重 × 时效系数（1 小时内 ×4，1 天内 ×2，1 周内 ×0.5，更早 ×0.25）
+- 累计权重总和超过 MAX_AGE 时整体衰减（×0.9），权重低于 1 的路径删除；
+  路径数超过上限时删除得分最低的（定期压缩，不在每次写入时发生）
+- 查询：多个关键词按顺序出现在路径中（LIKE，ASCII 不区分大小写），最后一个关键词出现在
+  最后一级目录名中的路径加权，目录名以它开头的再加权；没有匹配时退化为字符子序列模糊匹配
+- 得分相同时最近访问的在前；get/query 可以排除当前目录（--exclude），避免“回到”原地
+- 只在返回结果时检查目录是否存在，不存在的顺便删除
+
+首次使用时导入旧的 ~/.izsh/recent_paths 文本记录（按原顺序给出递减的权重）。
+
+用法：
+    recent_paths.py add <路径>          记录一次访问
+    recent_paths.py list [N]            按得分列出前 N 个（默认 20）
+    recent_paths.py get [N]             第 N 个路径（默认 1）
+    recent_paths.py query <关键词...>   按关键词查找，输出最佳匹配（--all 输出全部）
+    get 和 query 可加 --exclude <路径>  结果中不包含该路径（通常为 $PWD）
+    recent_paths.py clean               删除不存在的目录
+
+环境变量：
+- IZSH_RECENT_PATHS_DB    数据库位置（默认 ~/.izsh/recent_paths.db）
+- IZSH_RECENT_PATHS_MAX   最多保存的路径数（默认 5000）
+"""
+
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+DB_PATH = Path.home() / ".izsh" / "recent_paths.db"
+LEGACY_FILE = Path.home() / ".izsh" / "recent_paths"
+DEFAULT_MAX_PATHS = 5000
+
+# 累计权重总和上限，超出后整体衰减
+MAX_AGE = 10000.0
+AGING_FACTOR = 0.9
+
+# 路径数超过上限时删减到上限的该比例，之后的多次写入不再触发压缩
+COMPACT_TO = 0.9
+
+# 时效系数（距上次访问的秒数上限, 系数）
+RECENCY = [(3600, 4.0), (86400, 2.0), (7 * 86400, 0.5)]
+RECENCY_OLD = 0.25
+
+# 查询匹配的加权
+MATCH_BASENAME = 4.0   # 最后一个关键词匹配最后一级目录名
+MATCH_PREFIX = 2.0     # 最后一级目录名以最后一个关键词开头
+
+# SQL 中计算得分的表达式（每个时效档位一个当前时间参数）
+SCORE_SQL = ("rank * CASE " + ' '.join(f"WHEN ? - last_access < {limit} THEN {factor}" for limit, factor in RECENCY)
+             + f" ELSE {RECENCY_OLD} END")
+
+
+def basename(path):
+    """最后一级目录名（小写，用于查询加权）"""
+    return os.path.basename(path.rstrip('/')).lower()
+
+
+def score_params():
+    return [time.time()] * len(RECENCY)
+
+
+def like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class RecentPaths:
+    """最近路径存储（SQLite）"""
+
+    def __init__(self, path=None, max_paths=None):
+        self.path = Path(path or os.environ.get('IZSH_RECENT_PATHS_DB', DB_PATH))
+        self.max_paths = max_paths or int(os.environ.get('IZSH_RECENT_PATHS_MAX', DEFAULT_MAX_PATHS))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+        self.conn.execute("PRAGMA busy_timeout = 5000")
+        self._init_schema()
+
+    def _init_schema(self):
+        cur = self.conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS paths (
+                    path TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    rank REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )""")
+            # 权重总和与路径数（每次写入增量维护，避免全表统计）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    rank REAL NOT NULL,
+                    count INTEGER NOT NULL
+                )""")
+            if not cur.execute("SELECT 1 FROM totals").fetchone():
+                # 首次创建：导入旧的文本记录
+                self._import_legacy(cur)
+                cur.execute("INSERT INTO totals (id, rank, count) "
+                            "SELECT 0, COALESCE(SUM(rank), 0), COUNT(*) FROM paths")
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+
+    def _import_legacy(self, cur):
+        """导入旧的文本记录（第一行最近）"""
+        try:
+            lines = [line.strip() for line in LEGACY_FILE.read_text(encoding='utf-8').splitlines()]
+        except (OSError, UnicodeDecodeError):
+            return
+        now = time.time()
+        paths = [line for line in dict.fromkeys(lines) if line]
+        for i, path in enumerate(paths):
+            cur.execute("INSERT OR IGNORE INTO paths (path, name, rank, last_access) VALUES (?, ?, ?, ?)",
+                        (path, basename(path), float(len(paths) - i), now - i * 60))
+
+    def add(self, path, now=None):
+        """记录一次访问"""
+        now = now or time.time()
+        cur = self.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("UPDATE paths SET rank = rank + 1.0, last_access = ? WHERE path = ?", (now, path))
+            added = 0
+            if not cur.rowcount:
+                cur.execute("INSERT INTO paths (path, name, rank, last_access) VALUES (?, ?, 1.0, ?)",
+                            (path, basename(path), now))
+                added = 1
+            cur.execute("UPDATE totals SET rank = rank + 1.0, count = count + ? WHERE id = 0", (added,))
+            self._maybe_compact(cur)
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+
+    def _maybe_compact(self, cur):
+        """累计权重或路径数超限时衰减并删除低分路径"""
+        total, count = cur.execute("SELECT rank, count FROM totals WHERE id = 0").fetchone()
+        if total <= MAX_AGE and count <= self.max_paths:
+            return
+        if total > MAX_AGE:
+            cur.execute("UPDATE paths SET rank = rank * ?", (AGING_FACTOR,))
+            cur.execute("DELETE FROM paths WHERE rank < 1.0")
+        count = cur.execute("SELECT COUNT(*) FROM paths").fetchone()[0]
+        if count > self.max_paths:
+            cur.execute(
+                f"DELETE FROM paths WHERE path IN (SELECT path FROM paths ORDER BY {SCORE_SQL} LIMIT ?)",
+                (*score_params(), count - int(self.max_paths * COMPACT_TO)))
+        self._recount(cur)
+
+    @staticmethod
+    def _recount(cur):
+        cur.execute("UPDATE totals SET rank = (SELECT COALESCE(SUM(rank), 0) FROM paths), "
+                    "count = (SELECT COUNT(*) FROM paths) WHERE id = 0")
+
+    def ranked(self, limit=None, like=None, name=None, exclude=None):
+        """按得分排序的 (路径, 得分)，得分相同时最近访问的在前
+
+        like 为可选的路径 LIKE 过滤模式；name 为查询的最后一个关键词，
+        出现在最后一级目录名中的路径得分加权，目录名以它开头的再加权；
+        exclude 为不返回的路径（当前目录）。
+        """
+        sql = f"SELECT path, {SCORE_SQL}"
+        params = score_params()
+        if name:
+            sql += " * CASE WHEN name LIKE ? ESCAPE '\\' THEN ? WHEN name LIKE ? ESCAPE '\\' THEN ? ELSE 1 END"
+            params += [like_escape(name) + '%', MATCH_BASENAME * MATCH_PREFIX, '%' + like_escape(name) + '%',
+                       MATCH_BASENAME]
+        sql += " AS score FROM paths"
+        where = []
+        if like:
+            where.append("path LIKE ? ESCAPE '\\'")
+            params.append(like)
+        if exclude:
+            where.append("path != ?")
+            params.append(exclude)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY score DESC, last_access DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self.conn.execute(sql, params).fetchall()
+
+    def existing(self, rows, limit=None):
+        """过滤掉不存在的目录（并从索引中删除）"""
+        result = []
+        stale = []
+        for path, score in rows:
+            if os.path.isdir(path):
+                result.append((path, score))
+                if limit and len(result) >= limit:
+                    break
+            else:
+                stale.append(path)
+        if stale:
+            self.remove(stale)
+        return result
+
+    def top(self, limit=20, exclude=None):
+        return self.existing(self.ranked(limit + 10, exclude=exclude), limit)
+
+    def get(self, n=1, exclude=None):
+        """第 n 个路径（从 1 开始，不计 exclude），没有返回 None"""
+        rows = self.top(n, exclude)
+        return rows[n - 1][0] if len(rows) >= n else None
+
+    def query(self, keywords, limit=20, exclude=None):
+        """按关键词查找，返回按匹配质量和得分排序的前 limit 个 (路径, 得分)，不含 exclude"""
+        keywords = [k.lower() for k in keywords if k]
+        if not keywords:
+            return self.top(limit, exclude)
+
+        # 多取一些候选，部分目录可能已不存在
+        fetch = limit + 10
+        pattern = '%' + '%'.join(like_escape(k) for k in keywords) + '%'
+        rows = self.ranked(fetch, pattern, keywords[-1], exclude)
+        if not rows:
+            # 字符子序列模糊匹配
+            chars = ''.join(keywords).replace('/', '')
+            rows = self.ranked(fetch, '%' + '%'.join(like_escape(c) for c in chars) + '%', exclude=exclude)
+        return self.existing(rows, limit)
+
+    def remove(self, paths):
+        cur = self.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.executemany("DELETE FROM paths WHERE path = ?", [(p,) for p in paths])
+        self._recount(cur)
+        cur.execute("COMMIT")
+
+    def clean(self):
+        """删除不存在的目录，返回保留的条数"""
+        stale = [path for path, in self.conn.execute("SELECT path FROM paths") if not os.path.isdir(path)]
+        if stale:
+            self.remove(stale)
+        return self.conn.execute("SELECT COUNT(*) FROM paths").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    args = sys.argv[1:]
+    if not args:
+        print(__doc__.strip().split('用法：')[-1].split('环境变量')[0].strip())
+        sys.exit(1)
+
+    command = args[0]
+    exclude = None
+    if '--exclude' in args:
+        i = args.index('--exclude')
+        exclude = os.path.abspath(args[i + 1]) if i + 1 < len(args) else None
+        del args[i:i + 2]
+    store = RecentPaths()
+    try:
+        if command == 'add':
+            path = os.path.abspath(args[1]) if len(args) > 1 else os.getcwd()
+            store.add(path)
+        elif command == 'list':
+            for path, score in store.top(int(args[1]) if len(args) > 1 else 20):
+                print(f"{score:.1f}\t{path}")
+        elif command == 'get':
+            path = store.get(int(args[1]) if len(args) > 1 else 1, exclude)
+            if not path:
+                sys.exit(1)
+            print(path)
+        elif command == 'query':
+            show_all = '--all' in args
+            rows = store.query([a for a in args[1:] if a != '--all'], exclude=exclude)
+            if not rows:
+                sys.exit(1)
+            for path, score in (rows if show_all else rows[:1]):
+                print(f"{score:.1f}\t{path}" if show_all else path)
+        elif command == 'clean':
+            print(store.clean())
+        else:
+            print(f"未知命令: {command}", file=sys.stderr)
+            sys.exit(1)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,10 @@
 # iZsh 路径记录功能 - 记住最近的工作目录
 
 # 配置
-RECENT_PATHS_FILE="${HOME}/.izsh/recent_paths"
-MAX_PATHS=10  # 保存最近10个路径
+# 路径按访问频度和时效排序，存储在 SQLite 中（见 recent_paths.py）
+RECENT_PATHS_PY="${HOME}/.izsh/recent_paths.py"
+RECENT_PATHS_DB="${IZSH_RECENT_PATHS_DB:-${HOME}/.izsh/recent_paths.db}"
+MAX_PATHS="${IZSH_RECENT_PATHS_MAX:-5000}"  # 最多保存的路径数
 
 # 颜色定义
 GREEN='\033[0;32m'
@@ -12,17 +14,8 @@ YELLOW='\033[1;33m'
 CYAN='\033[0;36m'
 NC='\033[0m' # No Color
 
-# 初始化：创建目录
-init_recent_paths() {
-    local dir=$(dirname "$RECENT_PATHS_FILE")
-    mkdir -p "$dir"
-    touch "$RECENT_PATHS_FILE"
-}
-
-# 保存当前路径（退出时调用）
+# 保存当前路径（切换目录和退出时调用）
 save_current_path() {
-    init_recent_paths
-
     local current_path="$PWD"
 
     # 跳过 HOME 目录和不存在的目录
@@ -30,96 +23,46 @@ save_current_path() {
         return 0
     fi
 
-    # 读取现有路径
-    local existing_paths=()
-    if [[ -f "$RECENT_PATHS_FILE" ]]; then
-        while IFS= read -r line; do
-            existing_paths+=("$line")
-        done < "$RECENT_PATHS_FILE"
-    fi
-
-    # 移除重复的路径（如果已存在，删除旧的）
-    local new_paths=("$current_path")
-    for path in "${existing_paths[@]}"; do
-        if [[ "$path" != "$current_path" ]] && [[ -d "$path" ]]; then
-            new_paths+=("$path")
-        fi
-    done
-
-    # 限制保存的数量
-    local save_count=0
-    > "$RECENT_PATHS_FILE"  # 清空文件
-    for path in "${new_paths[@]}"; do
-        if [[ $save_count -lt $MAX_PATHS ]]; then
-            echo "$path" >> "$RECENT_PATHS_FILE"
-            ((save_count++))
-        else
-            break
-        fi
-    done
+    # 只更新一行记录，多个窗口同时写入由 SQLite 加锁串行化
+    python3 "$RECENT_PATHS_PY" add "$current_path" 2>/dev/null
 }
 
-# 获取最近的路径
+# 获取最近的路径（不含当前目录）
 get_recent_path() {
     local index=${1:-0}  # 默认获取最近的第1个
 
-    init_recent_paths
-
-    if [[ ! -f "$RECENT_PATHS_FILE" ]]; then
-        return 1
-    fi
-
-    local paths=()
-    while IFS= read -r line; do
-        if [[ -d "$line" ]]; then
-            paths+=("$line")
-        fi
-    done < "$RECENT_PATHS_FILE"
-
-    if [[ ${#paths[@]} -eq 0 ]]; then
-        return 1
-    fi
-
-    if [[ $index -ge ${#paths[@]} ]]; then
-        return 1
-    fi
+    python3 "$RECENT_PATHS_PY" get $((index + 1)) --exclude "$PWD" 2>/dev/null
+}
 
-    echo "${paths[$index]}"
+# 按关键词查找路径（最佳匹配，不含当前目录）
+query_recent_path() {
+    python3 "$RECENT_PATHS_PY" query --exclude "$PWD" "$@" 2>/dev/null
 }
 
 # 列出所有最近的路径
 list_recent_paths() {
-    init_recent_paths
-
     echo -e "${CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}"
-    echo -e "${CYAN}📁 最近访问的路径${NC}"
+    echo -e "${CYAN}📁 最近访问的路径（按频度和时效排序）${NC}"
     echo -e "${CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}"
 
-    if [[ ! -f "$RECENT_PATHS_FILE" ]]; then
-        echo -e "${YELLOW}暂无最近访问的路径记录${NC}"
-        return 0
-    fi
-
     local index=0
     local current_path="$PWD"
 
-    while IFS= read -r path; do
-        if [[ -d "$path" ]]; then
-            local marker=""
-            if [[ "$path" == "$current_path" ]]; then
-                marker="${GREEN} ← 当前位置${NC}"
-            fi
-
-            # 显示相对于HOME的路径（更简洁）
-            local display_path="$path"
-            if [[ "$path" == "$HOME"* ]]; then
-                display_path="~${path#$HOME}"
-            fi
-
-            echo -e "${BLUE}[$((index + 1))]${NC} $display_path$marker"
-            ((index++))
+    while IFS=$'\t' read -r score path; do
+        local marker=""
+        if [[ "$path" == "$current_path" ]]; then
+            marker="${GREEN} ← 当前位置${NC}"
         fi
-    done < "$RECENT_PATHS_FILE"
+
+        # 显示相对于HOME的路径（更简洁）
+        local display_path="$path"
+        if [[ "$path" == "$HOME"* ]]; then
+            display_path="~${path#$HOME}"
+        fi
+
+        echo -e "${BLUE}[$((index + 1))]${NC} $display_path$marker ${CYAN}(${score})${NC}"
+        ((index++))
+    done < <(python3 "$RECENT_PATHS_PY" list 20 2>/dev/null)
 
     if [[ $index -eq 0 ]]; then
         echo -e "${YELLOW}暂无有效的路径记录${NC}"
@@ -128,6 +71,7 @@ list_recent_paths() {
         echo -e "${YELLOW}使用方式：${NC}"
         echo -e "  ${GREEN}最近路径${NC}          # 回到最近的路径（第1个）"
         echo -e "  ${GREEN}最近路径 2${NC}        # 回到第2个最近的路径"
+        echo -e "  ${GREEN}最近路径 proj${NC}     # 回到匹配关键词的最常用路径"
         echo -e "  ${GREEN}recent-path${NC}      # 同上"
         echo -e "  ${GREEN}recent-path list${NC} # 显示此列表"
     fi
@@ -145,15 +89,16 @@ recent_path_command() {
         return 0
     fi
 
-    # 如果参数是数字，切换到第N个路径
-    local index=0
-    if [[ -n "$action" ]] && [[ "$action" == <-> ]]; then
-        index=$((action - 1))  # 用户输入从1开始，索引从0开始
+    # 如果参数是数字，切换到第N个路径；其他参数作为关键词查找
+    local target_path
+    if [[ -z "$action" ]]; then
+        target_path=$(get_recent_path 0)
+    elif [[ "$action" == <-> ]]; then
+        target_path=$(get_recent_path $((action - 1)))  # 用户输入从1开始，索引从0开始
+    else
+        target_path=$(query_recent_path "$@")
     fi
 
-    # 获取路径
-    local target_path=$(get_recent_path $index)
-
     if [[ -z "$target_path" ]]; then
         echo -e "${YELLOW}⚠️  没有找到最近的路径记录${NC}" >&2
         echo ""
@@ -177,26 +122,9 @@ recent_path_command() {
 
 # 清理无效路径
 clean_recent_paths() {
-    init_recent_paths
-
-    if [[ ! -f "$RECENT_PATHS_FILE" ]]; then
-        return 0
-    fi
-
-    local valid_paths=()
-    while IFS= read -r path; do
-        if [[ -d "$path" ]]; then
-            valid_paths+=("$path")
-        fi
-    done < "$RECENT_PATHS_FILE"
-
-    # 重写文件
-    > "$RECENT_PATHS_FILE"
-    for path in "${valid_paths[@]}"; do
-        echo "$path" >> "$RECENT_PATHS_FILE"
-    done
+    local count=$(python3 "$RECENT_PATHS_PY" clean 2>/dev/null)
 
-    echo -e "${GREEN}✅ 已清理无效路径，保留 ${#valid_paths[@]} 条记录${NC}"
+    echo -e "${GREEN}✅ 已清理无效路径，保留 ${count:-0} 条记录${NC}"
 }
 
 # 帮助信息
@@ -207,11 +135,13 @@ ${CYAN}📁 iZsh 路径记录功能${NC}
 ${CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}
 
 ${YELLOW}功能说明：${NC}
-  自动记录每次关闭窗口时的路径，快速回到上次工作目录
+  自动记录切换到的目录和关闭窗口时的路径，按访问频度和时效排序，
+  快速回到常用的工作目录
 
 ${YELLOW}使用方式：${NC}
   ${GREEN}最近路径${NC}              # 回到最近的路径（第1个）
   ${GREEN}最近路径 2${NC}            # 回到第2个最近的路径
+  ${GREEN}最近路径 proj api${NC}     # 回到匹配关键词的最常用路径
   ${GREEN}最近路径 list${NC}         # 显示所有最近的路径
   ${GREEN}recent-path${NC}          # 同 "最近路径"
   ${GREEN}recent-path list${NC}     # 同 "最近路径 list"
@@ -230,12 +160,12 @@ ${YELLOW}示例：${NC}
   $ cd ~/projects/projectB
 
   # 快速回到项目A
-  $ 最近路径
+  $ 最近路径 projectA
   ✅ 已切换到：/Users/username/projects/projectA
 
 ${YELLOW}配置：${NC}
-  记录文件：~/.izsh/recent_paths
-  最大记录数：${MAX_PATHS} 条
+  记录数据库：${RECENT_PATHS_DB}（IZSH_RECENT_PATHS_DB）
+  最大记录数：${MAX_PATHS} 条（IZSH_RECENT_PATHS_MAX）
 
 ${CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}
 EOF
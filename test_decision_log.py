@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+决策日志（decision_log）索引格式的测试
+
+用法：python3 -m unittest test_decision_log
+"""
+
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from decision_log import (I_ANSWER, I_OFFSET, INDEX_MAGIC_V1, INDEX_V1, RECORD, SEGMENT_MAGIC, SOURCE_AI,
+                          DecisionLog, build_report, encode_options, iter_index, iter_records, prompt_hash,
+                          tail_records)
+
+OPTIONS = [('1', 'Yes'), ('2', 'No')]
+
+
+def write_v1_segment(directory, prompts, answer='2'):
+    """按旧格式（IZDIDX1，索引项没有回答前缀）写一个分段，返回各记录的偏移"""
+    base = Path(directory) / f"{time.time_ns() - 10 ** 9:020d}-1"
+    seg = bytearray(SEGMENT_MAGIC)
+    idx = bytearray(INDEX_MAGIC_V1)
+    offsets = []
+    for i, prompt in enumerate(prompts):
+        text = prompt.encode('utf-8')
+        opts = encode_options(OPTIONS)
+        digest = prompt_hash(prompt, OPTIONS)
+        ts = 1700000000.0 + i
+        offsets.append(len(seg))
+        idx += INDEX_V1.pack(ts, 7, digest, len(seg), 120.0, 3000.0, SOURCE_AI, 0)
+        seg += RECORD.pack(ts, 7, digest, 120.0, 3000.0, SOURCE_AI, len(OPTIONS),
+                           len(text), len(opts), len(answer)) + text + opts + answer.encode()
+    Path(f"{base}.seg").write_bytes(seg)
+    Path(f"{base}.idx").write_bytes(idx)
+    return offsets
+
+
+class DecisionLogFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_reads_old_format_index(self):
+        prompts = ['Run npm test?', 'Delete build/?', 'Run npm test?']
+        offsets = write_v1_segment(self.directory, prompts)
+
+        entries = list(iter_index(self.directory))
+        self.assertEqual([entry[I_OFFSET] for entry in entries], offsets)
+        self.assertTrue(all(entry[I_ANSWER] is None for entry in entries))
+
+        records = list(iter_records(self.directory))
+        self.assertEqual([record.prompt for record in records], prompts)
+        self.assertEqual({record.answer for record in records}, {'2'})
+        self.assertEqual([record.prompt for record in tail_records(2, self.directory)], prompts[1:])
+
+    def test_old_and_new_segments_together(self):
+        write_v1_segment(self.directory, ['Run npm test?', 'Run npm test?'])
+        log = DecisionLog(self.directory)
+        log.record('Run npm test?', OPTIONS, '2', SOURCE_AI, 0.2, 1.0)
+        log.record('Run npm test?', OPTIONS, '2', SOURCE_AI, 0.2, 1.0)
+        log.close()
+
+        records = list(iter_records(self.directory))
+        self.assertEqual(len(records), 4)
+        self.assertEqual([entry[I_ANSWER] for entry in iter_index(self.directory)], [None, None, b'2\0\0\0', b'2\0\0\0'])
+
+        report = build_report(self.directory)
+        self.assertEqual(report['records'], 4)
+        self.assertEqual(report['answerable']['ai_decisions'], 4)
+        # 只有新格式的第二条能确认与上一次回答相同
+        self.assertEqual(report['answerable']['cache'], 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
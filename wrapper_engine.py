@@ -0,0 +1,808 @@
+#!/usr/bin/env python3
+"""
+Claude Code 包装器核心引擎
+
+PTY 版本和管道版本共用的检测、决策和注入逻辑：
+- PromptDetector：上下文行缓冲、确认提示检测、菜单解析、等待输入/工作状态检测
+- Decider：按决策协议调用 AI，统一的默认选项回退，写入决策日志
+- Injector：把决策转换为按键（数字/Y/n 直接输入，通用箭头菜单用 MenuNavigator 导航）
+- WrapperEngine：组合以上三者，提供按字节喂入输出、查找提示、决策并注入的接口
+
+传输适配器只负责搬运字节和倒计时界面：
+- PTY：claude_code_wrapper_pty.ClaudeCodeWrapperPTY
+- 管道：claude_code_wrapper.ClaudeCodeWrapper
+- 结构化事件流：claude_code_wrapper_stream.ClaudeCodeWrapperStream（只用 Decider 和状态表）
+- 回放：ReplayTransport，把录制的终端输出按块喂给引擎，记录注入的按键（不启动子进程），
+  用法：python3 wrapper_engine.py replay <录制文件> [--ai] [--generic] [--chunk N]
+"""
+
+import codecs
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from threading import Lock, Timer
+
+from pattern_guard import compile_table, format_report
+
+# AI 决策模块（ai_decision/ai_backend）和决策日志在首次检测到提示时才导入，保持包装器启动轻量
+
+# 通用确认提示模式
+CONFIRM_PATTERNS = [
+    # 通用确认
+    (r'\[Y/n\]|\[y/N\]', 'Y/n'),
+    (r'\[yes/no\]', 'yes/no'),
+    (r'\(Y/n\)|\(y/N\)', 'Y/n'),
+    (r'\(yes/no\)', 'yes/no'),
+
+    # 数字选项（支持更多数字）
+    (r'\[1/2/3/4/5\]', '1/2/3/4/5'),
+    (r'\[1/2/3/4\]', '1/2/3/4'),
+    (r'\[1/2/3\]', '1/2/3'),
+    (r'\[1/2\]', '1/2'),
+    (r'\[0/1/2\]', '0/1/2'),
+    (r'❯\s*\d+\.', 'numbered_menu'),  # Claude Code 菜单格式
+
+    # 带描述的选项（如：1) Option A  2) Option B）
+    (r'\d+\)\s+\w+.*?\d+\)\s+\w+', 'numbered_options'),
+
+    # 继续/取消
+    (r'\[continue/cancel\]', 'continue/cancel'),
+    (r'\[proceed/abort\]', 'proceed/abort'),
+    (r'\[c/q\]', 'c/q'),
+
+    # 其他常见模式
+    (r'\[a/r/s/k\]', 'a/r/s/k'),  # approve/reject/skip/kill
+    (r'\[accept/reject\]', 'accept/reject'),
+    (r'\[enable/disable\]', 'enable/disable'),
+
+    # 回答问题
+    (r'\?$', 'question_prompt'),
+]
+
+# 通用菜单检测模式
+MENU_PATTERNS = [
+    # Claude Code 特定菜单标记
+    (r'❯\s*\d+\.', 'claude_menu'),  # ❯ 1. Yes
+    # 箭头指示器
+    (r'[>→▶]', 'arrow_indicator'),
+    # 选中标记
+    (r'[\*●■]', 'selection_marker'),
+    # 反色/高亮（ANSI 转义序列）
+    (r'\x1b\[7m', 'reverse_video'),
+    (r'\x1b\[1m', 'bold'),
+]
+
+# Claude Code 等待输入新任务的常见模式
+WAITING_PATTERNS = [
+    r'How can I help you\?',
+    r'What would you like me to do\?',
+    r'What can I help you with\?',
+    r'>\s*$',  # 单独的 > 提示符
+    r'What\'s next\?',
+    # Claude Code 2.0 的提示格式
+    r'>\s+Try\s+"write',  # > Try "write a test for <filepath>"
+    r'>\s+.*for shortcuts',  # Claude Code 的输入提示行
+    r'Claude Code.*v\d+\.\d+',  # Claude Code 欢迎界面
+]
+
+# 状态检测关键词（按检测优先级）
+THINKING_KEYWORDS = ['analyzing', 'planning', 'considering', 'let me', 'i\'ll', 'i will',
+                     '分析', '规划', '让我', '我将', '我会']
+READING_KEYWORDS = ['reading', 'read', 'looking at', 'checking', 'reviewing',
+                    '读取', '查看', '检查', '审查']
+WRITING_KEYWORDS = ['writing', 'creating', 'modifying', 'editing', 'updating',
+                    '编写', '创建', '修改', '更新']
+EXECUTING_KEYWORDS = ['running', 'executing', 'command', 'bash', 'git', 'npm',
+                      '运行', '执行', '命令']
+SEARCHING_KEYWORDS = ['searching', 'finding', 'looking for', 'grep', 'search',
+                      '搜索', '查找', '寻找']
+WARNING_KEYWORDS = ['warning', 'caution', 'notice', 'important',
+                    '警告', '注意', '重要']
+DONE_KEYWORDS = ['done', 'completed', 'finished', 'success',
+                 '完成', '成功']
+
+# 错误检测：只匹配真正的错误消息格式，而非包含关键词的普通文本
+ERROR_PATTERNS = [
+    r'(?:^|\s)error:',           # "Error:" 开头的消息
+    r'(?:^|\s)fatal:',           # "Fatal:" 开头的消息
+    r'failed with.*error',       # "failed with error" 格式
+    r'exception.*occurred',      # "exception occurred" 格式
+    r'traceback',                # Python traceback
+    r'错误：',                    # 中文错误消息
+    r'失败：',                    # 中文失败消息
+    r'异常：',                    # 中文异常消息
+]
+
+# 检测模式表：名称 -> ([(模式, 标签)], 标志)
+PATTERN_TABLES = {
+    'confirm': (CONFIRM_PATTERNS, re.IGNORECASE),
+    'menu': (MENU_PATTERNS, 0),
+    'waiting': ([(p, 'waiting') for p in WAITING_PATTERNS], re.IGNORECASE),
+    'error': ([(p, 'error') for p in ERROR_PATTERNS], 0),
+}
+
+# 已编译的模式表（首次使用时编译，见 matchers()）
+_matchers = {}
+_matchers_lock = Lock()
+
+# Claude Code 菜单：❯ 1. Yes（去掉末尾的括号说明）
+CLAUDE_MENU_MARKER = re.compile(r'❯\s*\d+\.')
+CLAUDE_MENU_ITEM = re.compile(r'(❯)?\s*(\d+)\.\s+(.+?)(?:\s+\([^)]+\))?$')
+
+# 通用菜单的箭头/选中标记
+GENERIC_MENU_MARKER = re.compile(r'[>→▶\*●■]')
+GENERIC_MENU_PREFIX = re.compile(r'^[>→▶\*●■]\s*')
+
+# 带描述的编号选项：1) Use recommended settings
+OPTION_DESCRIPTION = re.compile(r'(\d+)\)\s+(.+?)(?=\n\d+\)|$)', re.MULTILINE | re.DOTALL)
+
+# 在字节层面移除 ANSI 转义序列和控制字符（解码前执行）
+ANSI_ESCAPE_BYTES = re.compile(rb'\x1b\[[0-9;]*[A-Za-z]|\x1b\][^\x07]*\x07|\x1b[=>]|[\x00-\x1f]')
+ANSI_SGR = re.compile(r'\x1b\[[0-9;]*m')
+
+# 字节级预筛选：行中不含以下任何片段时，不可能触发等待输入或状态检测，无需解码
+# 覆盖上面所有关键词，以及 WAITING_PATTERNS / ERROR_PATTERNS 中的必需片段
+DETECTION_TRIGGERS = (
+    THINKING_KEYWORDS + READING_KEYWORDS + WRITING_KEYWORDS + EXECUTING_KEYWORDS
+    + SEARCHING_KEYWORDS + WARNING_KEYWORDS + DONE_KEYWORDS
+    + ['>', 'help you', 'would you like', 'what\'s next', 'claude code',
+       'error', 'fatal:', 'exception', 'traceback', '错误：', '失败：', '异常：']
+)
+DETECTION_PREFILTER = re.compile(
+    b'|'.join(re.escape(kw.encode('utf-8')) for kw in DETECTION_TRIGGERS), re.IGNORECASE)
+
+# 未完成行的最大保留字节数
+MAX_PENDING_LINE = 4096
+
+# 箭头键的 ANSI 转义序列
+ARROW_KEYS = {
+    'UP': '\x1b[A',
+    'DOWN': '\x1b[B',
+    'RIGHT': '\x1b[C',
+    'LEFT': '\x1b[D',
+    'ENTER': '\n',
+}
+
+# 菜单导航：批量发送方向键后等待重绘确认的时间（秒），以及逐键发送时的间隔
+MENU_CONFIRM_TIMEOUT = float(os.environ.get('IZSH_MENU_CONFIRM_MS', 300)) / 1000
+MENU_KEY_PACE = 0.1
+
+# 菜单行中表示当前选中项的标记
+SELECTION_MARKERS = re.compile(r'[>→▶❯]')
+
+# 提示类型
+PROMPT_MENU = 'menu'
+PROMPT_CONFIRM = 'confirm'
+
+# 检测到的提示：类型、问题文本、选项 [(键, 文本)]、菜单项、原始行
+Prompt = namedtuple('Prompt', ['kind', 'question', 'options', 'menu_items', 'line'])
+
+
+def matchers(name):
+    """经过安全检查的已编译模式表 [(SafePattern, 标签)]（长度上限、时间预算、耗时统计）
+
+    安全检查要解析每个模式，首次使用时才编译，不增加包装器的导入时间。
+    """
+    table = _matchers.get(name)
+    if table is None:
+        with _matchers_lock:
+            table = _matchers.get(name)
+            if table is None:
+                table = _matchers[name] = compile_table(*PATTERN_TABLES[name])
+    return table
+
+
+def all_matchers():
+    """已使用过的受耗时统计的模式（用于 IZSH_PATTERN_PROFILE 报告）"""
+    return [matcher for table in list(_matchers.values()) for matcher, _ in table]
+
+
+class WrapperStates:
+    """包装器状态（显示在终端标题栏的状态指示器中）"""
+
+    # 1. 启动和初始化
+    STATE_STARTING = "starting"           # 🚀 启动中
+    STATE_INITIALIZING = "initializing"   # 🔄 初始化
+
+    # 2. 正常工作状态
+    STATE_THINKING = "thinking"           # 🤔 思考中
+    STATE_READING = "reading"             # 📖 读取文件
+    STATE_WRITING = "writing"             # ✏️ 编写代码
+    STATE_EXECUTING = "executing"         # ⚙️ 执行命令
+    STATE_SEARCHING = "searching"         # 🔍 搜索分析
+    STATE_MONITORING = "monitoring"       # 🟢 监控中
+
+    # 3. 交互和等待状态
+    STATE_WAITING_TASK = "waiting_task"   # 🔵 等待任务
+    STATE_WAITING_CONFIRM = "waiting_confirm"  # 🟡 等待确认
+    STATE_WAITING_CHOICE = "waiting_choice"    # 🟠 等待选择
+    STATE_COUNTDOWN = "countdown"         # ⏱️ 倒计时 Ns
+
+    # 4. AI 决策状态
+    STATE_AI_ANALYZING = "ai_analyzing"   # 🧠 AI分析中
+    STATE_AI_SELECTED = "ai_selected"     # ✅ AI已选择
+    STATE_AI_EXECUTING = "ai_executing"   # 🎯 AI执行中
+    STATE_AI_UNAVAILABLE = "ai_unavailable"  # ⛔ AI熔断（后端连续失败，直接使用默认选项）
+
+    # 5. 特殊和异常状态
+    STATE_WARNING = "warning"             # ⚠️ 需要注意
+    STATE_ERROR = "error"                 # ❌ 错误发生
+    STATE_PAUSED = "paused"               # ⏸️ 用户暂停
+    STATE_INTERRUPTED = "interrupted"     # 🛑 用户中断
+    STATE_DEBUG = "debug"                 # 🔧 调试模式
+
+    # 6. 完成和结束状态
+    STATE_TASK_DONE = "task_done"         # ✨ 任务完成
+    STATE_ALL_DONE = "all_done"           # 🎉 全部完成
+    STATE_EXITED = "exited"               # 👋 已退出
+
+    # 状态指示器文本
+    INDICATORS = {
+        STATE_STARTING: "🚀 启动中",
+        STATE_INITIALIZING: "🔄 初始化",
+        STATE_THINKING: "🤔 思考中",
+        STATE_READING: "📖 读取文件",
+        STATE_WRITING: "✏️ 编写代码",
+        STATE_EXECUTING: "⚙️ 执行命令",
+        STATE_SEARCHING: "🔍 搜索分析",
+        STATE_MONITORING: "🟢 监控中",
+        STATE_WAITING_TASK: "🔵 等待任务",
+        STATE_WAITING_CONFIRM: "🟡 等待确认",
+        STATE_WAITING_CHOICE: "🟠 等待选择",
+        STATE_AI_ANALYZING: "🧠 AI分析中",
+        STATE_AI_SELECTED: "✅ AI已选择",
+        STATE_AI_EXECUTING: "🎯 AI执行中",
+        STATE_AI_UNAVAILABLE: "⛔ AI熔断",
+        STATE_WARNING: "⚠️ 需要注意",
+        STATE_ERROR: "❌ 错误发生",
+        STATE_PAUSED: "⏸️ 用户暂停",
+        STATE_INTERRUPTED: "🛑 用户中断",
+        STATE_DEBUG: "🔧 调试模式",
+        STATE_TASK_DONE: "✨ 任务完成",
+        STATE_ALL_DONE: "🎉 全部完成",
+        STATE_EXITED: "👋 已退出",
+    }
+
+    @classmethod
+    def indicator(cls, state, countdown=0):
+        """状态指示器文本（倒计时状态显示剩余秒数）"""
+        if state == cls.STATE_COUNTDOWN:
+            return f"⏱️ 倒计时 {countdown}s"
+        return cls.INDICATORS.get(state, "🟢 监控中")
+
+
+class PromptDetector(WrapperStates):
+    """提示和状态检测（上下文为最近几行已移除 ANSI 的字节串，按需解码）"""
+
+    def __init__(self, max_context_lines=10, generic_menus=False):
+        self.recent_lines = []
+        self.max_context_lines = max_context_lines
+        # 通用箭头菜单（> / → / ● 等标记）容易误报，只在管道版本中启用
+        self.generic_menus = generic_menus
+
+    @staticmethod
+    def strip_ansi(data):
+        """移除 ANSI 转义序列（bytes -> bytes）"""
+        return ANSI_ESCAPE_BYTES.sub(b'', data)
+
+    def add_to_context(self, line):
+        """添加行（bytes）到上下文缓冲区"""
+        self.recent_lines.append(line)
+        if len(self.recent_lines) > self.max_context_lines:
+            self.recent_lines.pop(0)
+
+    def clear(self):
+        self.recent_lines = []
+
+    def get_context(self):
+        """获取上下文（最近几行，按需解码）"""
+        return '\n'.join(line.decode('utf-8', errors='replace') for line in self.recent_lines)
+
+    def detect_waiting_for_input(self, text):
+        """检测是否在等待用户输入新任务"""
+        for matcher, _ in matchers('waiting'):
+            if matcher.search(text):
+                return True
+        return False
+
+    def detect_state_from_output(self, text):
+        """从输出文本智能检测当前状态"""
+        text_lower = text.lower()
+
+        # 思考和规划
+        if any(kw in text_lower for kw in THINKING_KEYWORDS):
+            return self.STATE_THINKING
+
+        # 读取文件
+        if any(kw in text_lower for kw in READING_KEYWORDS):
+            if 'file' in text_lower or 'code' in text_lower or '文件' in text:
+                return self.STATE_READING
+
+        # 编写代码
+        if any(kw in text_lower for kw in WRITING_KEYWORDS):
+            if any(w in text_lower for w in ['file', 'code', 'function', '文件', '代码', '函数']):
+                return self.STATE_WRITING
+
+        # 执行命令
+        if any(kw in text_lower for kw in EXECUTING_KEYWORDS):
+            return self.STATE_EXECUTING
+
+        # 搜索分析
+        if any(kw in text_lower for kw in SEARCHING_KEYWORDS):
+            return self.STATE_SEARCHING
+
+        # 错误检测（更严格，避免误报）
+        if any(matcher.search(text_lower) for matcher, _ in matchers('error')):
+            return self.STATE_ERROR
+
+        # 警告检测
+        if any(kw in text_lower for kw in WARNING_KEYWORDS):
+            return self.STATE_WARNING
+
+        # 任务完成
+        if any(kw in text_lower for kw in DONE_KEYWORDS):
+            return self.STATE_TASK_DONE
+
+        return None  # 未检测到特定状态
+
+    def classify_line(self, clean):
+        """对一行已清理的输出（bytes）做等待输入和状态检测，返回状态或 None
+
+        预筛选：不含任何触发片段的行无需解码和正则检测。
+        """
+        if not DETECTION_PREFILTER.search(clean):
+            return None
+        text = clean.decode('utf-8', errors='replace')
+        if self.detect_waiting_for_input(text):
+            return self.STATE_WAITING_TASK
+        return self.detect_state_from_output(text)
+
+    def detect_confirm_prompt(self, line):
+        """检测是否是确认提示，返回选项描述（如 'Y/n'）"""
+        for matcher, options in matchers('confirm'):
+            if matcher.search(line):
+                return options
+        return None
+
+    def detect_menu(self, context):
+        """检测是否是交互式菜单
+
+        返回: (is_menu, menu_items)
+        """
+        lines = context.split('\n')
+
+        # Claude Code 格式：❯ 1. Yes
+        if CLAUDE_MENU_MARKER.search(context):
+            menu_items = []
+            for i, line in enumerate(lines):
+                match = CLAUDE_MENU_ITEM.search(ANSI_SGR.sub('', line).strip())
+                if match:
+                    menu_items.append({
+                        'index': i,
+                        'number': match.group(2),
+                        'text': match.group(3).strip(),
+                        'is_selected': match.group(1) == '❯',
+                        'format': 'claude_code'
+                    })
+            if menu_items:
+                return True, menu_items
+
+        if not self.generic_menus:
+            return False, []
+
+        # 通用格式：需要菜单标记
+        if not any(matcher.search(context) for matcher, _ in matchers('menu')):
+            return False, []
+
+        menu_items = []
+        for i, line in enumerate(lines):
+            if not GENERIC_MENU_MARKER.search(line):
+                continue
+            clean_line = GENERIC_MENU_PREFIX.sub('', ANSI_SGR.sub('', line).strip())
+            if clean_line:
+                menu_items.append({
+                    'index': i,
+                    'text': clean_line,
+                    'is_selected': bool(SELECTION_MARKERS.search(line)),
+                    'format': 'generic'
+                })
+
+        return len(menu_items) > 0, menu_items
+
+    def option_descriptions(self, context):
+        """从上下文中提取带描述的编号选项
+
+        示例：
+        1) Use recommended settings (default)
+        2) Custom configuration
+
+        返回：[(编号, 描述)]
+        """
+        return [(num, ' '.join(desc.split())) for num, desc in OPTION_DESCRIPTION.findall(context)]
+
+
+class Decider:
+    """按决策协议调用 AI 选择选项；失败或回答无效时使用第一个选项，并写入决策日志
+
+    AI 调用经过跨会话共享的熔断器（ai_breaker）：后端连续故障（传输错误、超时、HTTP 5xx/429）
+    后在冷却期内直接跳过 AI，此时 ai_skipped 为 True，传输层据此显示熔断状态。
+    AI 正常返回但回答无效按成功计。
+
+    调用 AI 之前先查相似提示索引（decision_index）：选项、工具类别和可执行程序相同，
+    只在措辞、相对路径（扩展名相同）或数字上不同的历史 AI 决策直接复用其回答（来源 SOURCE_CACHE），
+    含破坏性操作的提示只复用命令完全相同的；熔断期间同样可用。
+    """
+
+    def __init__(self, timeout=3, use_ai=True, log=True):
+        self.timeout = timeout
+        self.use_ai = use_ai
+        self.log = log
+        self.ai_skipped = False   # 最近一次决策因熔断跳过了 AI
+        self.reused = False       # 最近一次决策复用了相似提示的历史回答
+
+    def breaker_open(self):
+        """AI 后端是否处于熔断冷却期（决策将直接使用默认选项）"""
+        if not self.use_ai:
+            return False
+        from ai_breaker import get_breaker
+        breaker = get_breaker()
+        return breaker is not None and breaker.is_open()
+
+    def reuse(self, question, options):
+        """相似提示的历史回答（没有或索引关闭时返回 None）"""
+        from decision_index import get_index
+        index = get_index()
+        found = index.lookup(question, options) if index else None
+        return found[0] if found else None
+
+    def remember(self, question, options, choice):
+        from decision_index import get_index
+        index = get_index()
+        if index:
+            index.add(question, options, choice)
+
+    def call_ai(self, question, options):
+        """调用 AI，返回经过校验的选项键（失败或熔断返回 None）"""
+        from ai_breaker import get_breaker, is_backend_failure
+        breaker = get_breaker()
+        if breaker and not breaker.allow(lease=self.timeout + 5):
+            self.ai_skipped = True
+            return None
+
+        choice = None
+        error = None
+        try:
+            from ai_decision import decide_batched
+            choice = decide_batched(question, options, timeout=self.timeout + 3)
+        except Exception as e:
+            error = e
+            print(f"\n❌ AI 决策失败: {e}", file=sys.stderr)
+        if breaker:
+            if error is None:
+                # 后端正常返回（回答无效也算；错误信息以 APIError 抛出，不会走到这里）
+                breaker.record_success()
+            elif is_backend_failure(error):
+                breaker.record_failure(error)
+            else:
+                # 与后端无关的错误：如果本次是探测调用，交还租期而不是占到租期结束
+                breaker.release_probe()
+        return choice
+
+    def decide(self, prompt, countdown=0.0):
+        """为提示选择一个选项键"""
+        from decision_log import SOURCE_AI, SOURCE_CACHE, SOURCE_DEFAULT
+        self.ai_skipped = self.reused = False
+        start = time.monotonic()
+        choice = None
+        source = SOURCE_AI
+        if self.use_ai:
+            choice = self.reuse(prompt.question, prompt.options)
+            if choice:
+                source = SOURCE_CACHE
+                self.reused = True
+            else:
+                choice = self.call_ai(prompt.question, prompt.options)
+                if choice:
+                    self.remember(prompt.question, prompt.options, choice)
+        latency = time.monotonic() - start
+        if not choice:
+            # 默认选择第一个选项（通常是默认/推荐项）
+            choice = prompt.options[0][0] if prompt.options else '1'
+            source = SOURCE_DEFAULT
+        self.record(prompt, choice, source, latency, countdown)
+        return choice
+
+    def skip(self, prompt, countdown=0.0):
+        """用户已手动响应，只记录"""
+        from decision_log import SOURCE_USER
+        self.record(prompt, '', SOURCE_USER, 0.0, countdown)
+
+    def record(self, prompt, choice, source, latency, countdown):
+        if not self.log:
+            return
+        from decision_log import log_decision
+        log_decision(prompt.question, prompt.options, choice, source, latency, countdown)
+
+
+class MenuNavigator:
+    """箭头键菜单导航
+
+    由菜单项和当前选中项计算按键序列，一次写入全部方向键；之后通过观察程序重绘的
+    菜单行确认光标到达目标项再发送回车，而不是固定等待。只有在重绘显示光标没有到达
+    目标（程序丢键）时，才改为逐键发送剩余的移动，并在之后的导航中一直逐键发送。
+    """
+
+    def __init__(self, send, confirm_timeout=MENU_CONFIRM_TIMEOUT, pace=MENU_KEY_PACE):
+        self.send = send
+        self.confirm_timeout = confirm_timeout
+        self.pace = pace
+        self.paced = False       # 程序会丢键时逐键发送
+        self.lock = Lock()
+        self.texts = []
+        self.target = None
+        self.observed = None     # 最近一次重绘中选中项的索引
+        self.timer = None
+
+    @property
+    def pending(self):
+        return self.target is not None
+
+    @staticmethod
+    def key_sequence(current, target):
+        """从当前选中项移动到目标项的方向键序列"""
+        moves = target - current
+        key = ARROW_KEYS['DOWN'] if moves > 0 else ARROW_KEYS['UP']
+        return key * abs(moves)
+
+    def navigate(self, menu_items, target):
+        """移动到目标项并选中"""
+        current = 0
+        for i, item in enumerate(menu_items):
+            if item.get('is_selected'):
+                current = i
+                break
+
+        with self.lock:
+            if target == current:
+                self.send(ARROW_KEYS['ENTER'])
+                return
+            if not self.paced:
+                self.texts = [item['text'] for item in menu_items]
+                self.target = target
+                self.observed = None
+                self.send(self.key_sequence(current, target))
+                self.timer = Timer(self.confirm_timeout, self._on_timeout)
+                self.timer.daemon = True
+                self.timer.start()
+                return
+        self._send_paced(current, target)
+
+    def observe(self, line):
+        """观察程序输出的一行：重绘显示已到达目标项时发送回车"""
+        if self.target is None or not SELECTION_MARKERS.search(line):
+            return
+        clean = ANSI_SGR.sub('', line).strip()
+        clean = re.sub(r'^[>→▶\*●■❯]\s*', '', clean)
+        with self.lock:
+            if self.target is None or clean not in self.texts:
+                return
+            self.observed = self.texts.index(clean)
+            if self.observed == self.target:
+                self._finish()
+
+    def _on_timeout(self):
+        """确认超时：重绘显示光标停在别处时逐键补发，没有重绘时按已到达处理"""
+        with self.lock:
+            if self.target is None:
+                return
+            if self.observed is None or self.observed == self.target:
+                self._finish()
+                return
+            self.paced = True
+            current, target = self.observed, self.target
+            self.target = None
+        self._send_paced(current, target)
+
+    def _send_paced(self, current, target):
+        """逐键发送移动和回车（不持有锁：间隔等待期间 observe 和新的导航不被阻塞）"""
+        key = ARROW_KEYS['DOWN'] if target > current else ARROW_KEYS['UP']
+        for _ in range(abs(target - current)):
+            self.send(key)
+            time.sleep(self.pace)
+        time.sleep(self.pace)
+        self.send(ARROW_KEYS['ENTER'])
+
+    def _finish(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self.target = None
+        self.send(ARROW_KEYS['ENTER'])
+
+
+class Injector:
+    """把决策转换为发往程序的按键"""
+
+    def __init__(self, send):
+        self.send = send
+        self.navigator = MenuNavigator(send)
+
+    @property
+    def pending(self):
+        """菜单导航是否在等待重绘确认"""
+        return self.navigator.pending
+
+    def inject(self, prompt, choice):
+        """发送选择：通用箭头菜单用方向键导航，其余直接输入选项键并回车"""
+        items = prompt.menu_items
+        if prompt.kind == PROMPT_MENU and items and items[0].get('format') == 'generic':
+            keys = [key for key, _ in prompt.options]
+            self.navigator.navigate(items, keys.index(choice) if choice in keys else 0)
+            return
+        self.send(choice + ARROW_KEYS['ENTER'])
+
+    def observe(self, line):
+        self.navigator.observe(line)
+
+
+class WrapperEngine:
+    """包装器核心：检测 + 决策 + 注入
+
+    send(按键字符串) 由传输层提供；on_state(状态) 在从输出检测到工作状态时调用。
+    """
+
+    def __init__(self, send, timeout=3, generic_menus=False, use_ai=True, log=True, on_state=None):
+        self.detector = PromptDetector(generic_menus=generic_menus)
+        self.decider = Decider(timeout, use_ai, log)
+        self.injector = Injector(send)
+        self.on_state = on_state
+        self.current_line = bytearray()
+
+    def feed(self, data):
+        """分析输出数据（bytes）
+
+        按字节切分行并在字节层面移除 ANSI，只有通过关键词预筛选的行才解码做状态检测。
+        换行符不会出现在多字节字符内部，因此按行解码不会截断字符。
+        """
+        self.current_line += data
+
+        if b'\n' in data:
+            lines = self.current_line.split(b'\n')
+            for line in lines[:-1]:
+                self.add_line(self.detector.strip_ansi(line).strip())
+            self.current_line = bytearray(lines[-1])
+
+        # 没有换行的重绘输出只保留末尾部分，避免当前行无限增长
+        if len(self.current_line) > MAX_PENDING_LINE:
+            del self.current_line[:-MAX_PENDING_LINE]
+
+    def add_line(self, clean):
+        """处理一行完整的输出（已移除 ANSI 的 bytes 或 str）"""
+        if isinstance(clean, str):
+            clean = clean.encode('utf-8')
+        if not clean:
+            return
+        self.detector.add_to_context(clean)
+        if self.injector.pending:
+            self.injector.observe(clean.decode('utf-8', errors='replace'))
+        if self.on_state:
+            state = self.detector.classify_line(clean)
+            if state:
+                self.on_state(state)
+
+    def reset_line(self):
+        """丢弃当前未完成行"""
+        self.current_line = bytearray()
+
+    def reset(self):
+        """丢弃上下文和当前行（提示已处理或用户已手动响应）"""
+        self.current_line = bytearray()
+        self.detector.clear()
+
+    def current_line_text(self):
+        """当前未完成行（已移除 ANSI）的文本，末尾不完整的多字节字符暂不解码"""
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        return decoder.decode(self.detector.strip_ansi(bytes(self.current_line)), final=False)
+
+    def find_menu(self):
+        """在上下文中查找交互式菜单"""
+        is_menu, menu_items = self.detector.detect_menu(self.detector.get_context())
+        if not is_menu:
+            return None
+        if menu_items[0].get('format') == 'claude_code':
+            from ai_decision import menu_options
+            options = menu_options(menu_items)
+        else:
+            options = [(str(i + 1), item['text']) for i, item in enumerate(menu_items)]
+        return Prompt(PROMPT_MENU, '', options, menu_items, '')
+
+    def find_confirm(self, line):
+        """检查一行文本是否是确认提示"""
+        if not line.strip():
+            return None
+        label = self.detector.detect_confirm_prompt(line)
+        if not label:
+            return None
+        question = re.sub(r'\s*[\[\(].*?[\]\)].*$', '', line).strip()
+        options = None
+        if label in ('numbered_menu', 'numbered_options'):
+            # 上下文中有带描述的编号选项时优先使用
+            options = self.detector.option_descriptions(self.detector.get_context())
+        if not options:
+            from ai_decision import confirm_options
+            options = confirm_options(label, line)
+        return Prompt(PROMPT_CONFIRM, question, options, None, line)
+
+    def find_prompt(self):
+        """查找菜单或当前行上的确认提示"""
+        return self.find_menu() or self.find_confirm(self.current_line_text())
+
+    def decide(self, prompt, countdown=0.0):
+        return self.decider.decide(prompt, countdown)
+
+    def skip(self, prompt, countdown=0.0):
+        self.decider.skip(prompt, countdown)
+        self.reset()
+
+    def inject(self, prompt, choice):
+        self.reset()
+        self.injector.inject(prompt, choice)
+
+    def resolve(self, prompt, countdown=0.0):
+        """决策并注入，返回选择的选项键"""
+        choice = self.decide(prompt, countdown)
+        self.inject(prompt, choice)
+        return choice
+
+
+class ReplayTransport:
+    """回放传输：把录制的终端输出按块喂给引擎，记录检测到的提示和注入的按键
+
+    不启动子进程、没有倒计时；默认不调用 AI（直接取默认选项）、不写决策日志，
+    结果可重复，适合比较不同实现在同一段输出上的检测行为和耗时。
+    """
+
+    def __init__(self, chunk_size=4096, use_ai=False, generic_menus=False, timeout=3):
+        self.chunk_size = chunk_size
+        self.sent = []
+        self.decisions = []   # [(偏移, 提示, 选择)]
+        self.engine = WrapperEngine(self.sent.append, timeout, generic_menus, use_ai, log=False)
+
+    def run(self, data):
+        """回放数据，返回耗时（秒）"""
+        start = time.perf_counter()
+        for offset in range(0, len(data), self.chunk_size):
+            self.engine.feed(data[offset:offset + self.chunk_size])
+            prompt = self.engine.find_prompt()
+            if prompt:
+                choice = self.engine.resolve(prompt)
+                self.decisions.append((offset, prompt, choice))
+        return time.perf_counter() - start
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] != 'replay':
+        print("用法: wrapper_engine.py replay <录制文件> [--ai] [--generic] [--chunk N]")
+        sys.exit(1)
+
+    chunk_size = 4096
+    if '--chunk' in args:
+        chunk_size = int(args[args.index('--chunk') + 1])
+    with open(args[1], 'rb') as f:
+        data = f.read()
+
+    replay = ReplayTransport(chunk_size, use_ai='--ai' in args, generic_menus='--generic' in args)
+    elapsed = replay.run(data)
+    for offset, prompt, choice in replay.decisions:
+        question = prompt.question or ' / '.join(text or key for key, text in prompt.options)
+        print(f"{offset:10d}  {prompt.kind:<8} {choice:<6} {question[:60]}")
+    print(f"replay: {len(data)} bytes, {len(replay.decisions)} prompts, {elapsed * 1000:.1f} ms")
+    if os.environ.get('IZSH_PATTERN_PROFILE', '0') == '1':
+        print(format_report(all_matchers()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()